@@ -1,13 +1,38 @@
 """
 Agent package for search functionality.
+
+The public names are imported lazily: importing ``agent`` is cheap, and
+LangGraph, the Gemini SDKs and Rich are only loaded when a name that needs
+them is first used.
 """
 
-from agent.graph import create_graph_for_direct_use
-from agent.formatting import OutputFormatter, show_spinner, extract_citation_urls
+import importlib
+
+_EXPORTS = {
+    "create_graph_for_direct_use": "agent.graph",
+    "create_async_graph_for_direct_use": "agent.graph",
+    "OutputFormatter": "agent.formatting",
+    "show_spinner": "agent.formatting",
+    "extract_citation_urls": "agent.formatting",
+}
 
 __all__ = [
     "create_graph_for_direct_use",
+    "create_async_graph_for_direct_use",
     "OutputFormatter",
     "show_spinner",
     "extract_citation_urls"
 ]
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,126 @@
+"""
+Model backends behind the graph's API calls.
+
+The graph needs two things from a model provider: chat models (optionally
+with structured output) for query generation, reflection and the final
+answer, and a grounded search that returns text together with Google Search
+grounding metadata. :class:`GeminiBackend` provides them with the shared
+Gemini clients. Other backends, such as the offline
+:class:`agent.fake_backend.FakeBackend`, are registered by name and selected
+with the ``model_backend`` setting.
+"""
+
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Optional, Type
+
+from pydantic import BaseModel
+
+from agent.clients import get_chat_model, get_genai_client
+
+
+class ModelBackend(ABC):
+    """Interface of a model backend.
+
+    ``chat_model`` returns an object with ``invoke``/``ainvoke`` (and
+    ``stream``/``astream`` for plain text) like a langchain chat model.
+    ``search`` returns a response shaped like ``google.genai``'s
+    ``GenerateContentResponse``: ``text``, ``candidates[0].grounding_metadata``
+    and ``usage_metadata``.
+
+    ``timeout`` (in seconds, None for none) bounds each request at the
+    transport, so a request that takes too long is really aborted and raises
+    a timeout error instead of running on in the background.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def chat_model(
+        self,
+        model: str,
+        temperature: float,
+        schema: Optional[Type[BaseModel]] = None,
+        include_raw: bool = False,
+        timeout: Optional[float] = None,
+    ):
+        """Chat model for ``model``, with structured output when ``schema`` is given."""
+
+    @abstractmethod
+    def search(self, model: str, prompt: str, timeout: Optional[float] = None):
+        """Grounded Google Search for ``prompt``."""
+
+    @abstractmethod
+    async def asearch(self, model: str, prompt: str, timeout: Optional[float] = None):
+        """Async version of :meth:`search`."""
+
+
+def _web_search_config(timeout: Optional[float] = None) -> dict:
+    config = {"tools": [{"google_search": {}}], "temperature": 0}
+    if timeout:
+        # The genai SDK takes milliseconds
+        config["http_options"] = {"timeout": max(1, int(timeout * 1000))}
+    return config
+
+
+class GeminiBackend(ModelBackend):
+    """The Gemini API, through the process-wide clients in :mod:`agent.clients`."""
+
+    name = "gemini"
+
+    def chat_model(self, model, temperature, schema=None, include_raw=False, timeout=None):
+        return get_chat_model(model, temperature, schema, include_raw, timeout)
+
+    def search(self, model, prompt, timeout=None):
+        # Uses the google genai client as the langchain client doesn't return grounding metadata
+        return get_genai_client().models.generate_content(
+            model=model, contents=prompt, config=_web_search_config(timeout)
+        )
+
+    async def asearch(self, model, prompt, timeout=None):
+        return await get_genai_client().aio.models.generate_content(
+            model=model, contents=prompt, config=_web_search_config(timeout)
+        )
+
+
+def _fake_backend() -> ModelBackend:
+    from agent.fake_backend import FakeBackend
+
+    return FakeBackend()
+
+
+_factories: Dict[str, Callable[[], ModelBackend]] = {
+    "gemini": GeminiBackend,
+    "fake": _fake_backend,
+}
+_backends: Dict[str, ModelBackend] = {}
+_lock = threading.Lock()
+
+
+def register_backend(name: str, backend: Any) -> None:
+    """Make ``backend`` (an instance or a zero-argument factory) available as ``name``."""
+    with _lock:
+        if isinstance(backend, ModelBackend):
+            instance = backend
+            _factories[name] = lambda: instance
+            _backends[name] = instance
+        else:
+            _factories[name] = backend
+            _backends.pop(name, None)
+
+
+def get_backend(name: str = "gemini") -> ModelBackend:
+    """Return the backend registered as ``name``, creating it on first use."""
+    backend = _backends.get(name)
+    if backend is None:
+        with _lock:
+            backend = _backends.get(name)
+            if backend is None:
+                factory = _factories.get(name)
+                if factory is None:
+                    raise ValueError(
+                        f"Unknown model backend {name!r} (available: {', '.join(sorted(_factories))})"
+                    )
+                backend = factory()
+                _backends[name] = backend
+    return backend
@@ -0,0 +1,457 @@
+"""
+Batch research: run many queries concurrently through the async graph.
+
+Queries are read from a JSONL or plain text file, run with a bounded number of
+concurrent sessions that share one compiled graph and one client pool, and each
+result is written to the output (a JSONL file, or a SQLite database for
+``.sqlite``/``.db`` paths) as soon as it finishes. Queries that already have a
+successful result in the output are skipped, so an interrupted batch can
+simply be restarted.
+
+Large batches can be sharded across worker processes
+(:func:`run_batch_processes`), each with its own graph, client pool and share
+of the API quota; their results are written in input order.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import signal
+import sqlite3
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from agent.metrics import RunMetrics
+from agent.retry import RetryBudget, run_deadline
+
+DEFAULT_CONCURRENCY = 4
+
+
+def query_id(query: str) -> str:
+    """Stable id for a query that doesn't come with one."""
+    return hashlib.sha1(query.strip().encode("utf-8")).hexdigest()[:12]
+
+
+def _query_from_record(record: Dict[str, Any]) -> str:
+    if record.get("query") or record.get("question"):
+        return record.get("query") or record.get("question")
+    # Request style records (e.g. requests.jsonl) with a title and a body
+    return "\n\n".join(part for part in (record.get("title"), record.get("body")) if part)
+
+
+def _query_entry(item: Any) -> Tuple[str, str]:
+    if isinstance(item, str):
+        return item.strip(), query_id(item)
+    text = _query_from_record(item)
+    return text, item.get("id") or item.get("request_id") or query_id(text)
+
+
+def load_batch_queries(path: str) -> List[Dict[str, str]]:
+    """Read queries from a JSON list, a JSONL file or a plain text file (one query per line).
+
+    Records may be strings or objects using ``query``/``question`` or
+    ``title``/``body`` for the text and ``id``/``request_id`` for the id.
+    Blank lines and lines starting with ``#`` in text files are ignored.
+
+    Returns:
+        A list of ``{"id": ..., "query": ...}`` dictionaries in file order.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+
+    if content.lstrip().startswith("["):
+        items = json.loads(content)
+    else:
+        lines = [line.strip() for line in content.splitlines()]
+        is_jsonl = path.endswith((".jsonl", ".json")) or any(
+            line.startswith("{") for line in lines if line
+        )
+        items = [
+            json.loads(line) if is_jsonl else line
+            for line in lines
+            if line and not line.startswith("#")
+        ]
+
+    queries = []
+    for item in items:
+        text, qid = _query_entry(item)
+        if text:
+            queries.append({"id": str(qid), "query": text})
+    return queries
+
+
+def completed_ids(output_path: str) -> Set[str]:
+    """Ids of queries that already finished successfully in ``output_path``."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Partial line from an interrupted run
+                continue
+            if record.get("status") == "ok":
+                done.add(str(record.get("id")))
+    return done
+
+
+SQLITE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+
+
+class JsonlSink:
+    """Appends result records to a JSONL file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    def completed_ids(self) -> Set[str]:
+        return completed_ids(self.path)
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SqliteSink:
+    """Stores result records in a SQLite table keyed by query id.
+
+    A rerun replaces the record of a query that failed before.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " id TEXT PRIMARY KEY,"
+                " finished REAL NOT NULL,"
+                " status TEXT NOT NULL,"
+                " query TEXT NOT NULL,"
+                " record TEXT NOT NULL)"
+            )
+
+    def completed_ids(self) -> Set[str]:
+        rows = self._conn.execute("SELECT id FROM results WHERE status = 'ok'").fetchall()
+        return {row[0] for row in rows}
+
+    def write(self, record: Dict[str, Any]) -> None:
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (id, finished, status, query, record)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (str(record["id"]), time.time(), record["status"], record["query"],
+                 json.dumps(record, ensure_ascii=False)),
+            )
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_sink(path: str):
+    """The result sink for ``path``: SQLite for ``.sqlite``/``.sqlite3``/``.db`` files, JSONL otherwise."""
+    return SqliteSink(path) if path.endswith(SQLITE_SUFFIXES) else JsonlSink(path)
+
+
+def unique_sources(sources: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """The distinct URLs of ``sources`` as ``{"label", "url"}`` dictionaries."""
+    unique = {}
+    for source in sources:
+        if isinstance(source, dict) and source.get("value") and source["value"] not in unique:
+            unique[source["value"]] = {"label": source.get("label", "Source"), "url": source["value"]}
+    return list(unique.values())
+
+
+async def _run_one(
+    graph, item: Dict[str, str], config: Dict[str, Any]
+) -> Tuple[Dict[str, Any], RunMetrics]:
+    from langchain_core.messages import HumanMessage
+    from agent.configuration import Configuration
+    from agent.history import get_research_history
+
+    configurable = Configuration.from_runnable_config({"configurable": config})
+    retry_budget = RetryBudget(max_wait_seconds=configurable.retry_budget_seconds)
+    metrics = RunMetrics()
+    state = {
+        "messages": [HumanMessage(content=item["query"])],
+        "reasoning_model": config.get("reasoning_model"),
+    }
+    start = time.time()
+    record: Dict[str, Any] = {"id": item["id"], "query": item["query"]}
+    try:
+        result = await graph.ainvoke(
+            state,
+            {"configurable": {
+                **config,
+                "configuration": configurable,
+                "retry_budget": retry_budget,
+                "deadline": run_deadline(configurable.run_deadline_seconds),
+                "metrics": metrics,
+                "thread_id": item["id"],
+            }},
+        )
+        record.update(
+            status="ok",
+            answer=result["messages"][-1].content if result.get("messages") else "",
+            sources=unique_sources(result.get("sources_gathered", [])),
+        )
+    except Exception as e:
+        record.update(status="error", error=f"{type(e).__name__}: {e}")
+    if record["status"] == "ok" and configurable.research_history:
+        try:
+            get_research_history(configurable.research_history_path).add_state(
+                item["query"], result, configurable.max_research_loops
+            )
+        except sqlite3.Error as e:
+            record["history_error"] = str(e)
+    record["elapsed_seconds"] = round(time.time() - start, 3)
+    record["run_metrics"] = retry_budget.snapshot()
+    if record["status"] == "ok":
+        record["run_metrics"]["reflection_usage"] = result.get("reflection_usage", [])
+        record["run_metrics"]["searches_saved"] = len(result.get("skipped_follow_up_queries", []))
+        record["run_metrics"]["stopping_decisions"] = result.get("stopping_decisions", [])
+        record["run_metrics"]["failed_searches"] = result.get("failed_searches", [])
+    record["run_metrics"]["nodes"] = metrics.summary()
+    metrics.finish()
+    return record, metrics
+
+
+async def run_batch(
+    queries: List[Dict[str, str]],
+    config: Dict[str, Any],
+    output_path: str,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+    metrics_path: Optional[str] = None,
+) -> Dict[str, int]:
+    """Run ``queries`` with at most ``concurrency`` sessions at a time.
+
+    Args:
+        queries: Items as returned by :func:`load_batch_queries`
+        config: The ``configurable`` settings shared by every session
+        output_path: JSONL file (or SQLite database, see :func:`open_sink`)
+            that results are written to
+        concurrency: Maximum number of research sessions in flight
+        on_result: Optional callback invoked with each finished record
+        metrics_path: Optional JSONL file that each query's full run report is appended to
+
+    Returns:
+        Counts of ``ok``, ``error`` and ``skipped`` queries.
+    """
+    # Imported here so that loading this module (e.g. for CLI defaults) stays cheap
+    from agent.graph import create_async_graph_for_direct_use
+
+    with open_sink(output_path) as sink, \
+            open(metrics_path or os.devnull, "a", encoding="utf-8") as metrics_out:
+        done = sink.completed_ids()
+        pending = [item for item in queries if item["id"] not in done]
+        counts = {"ok": 0, "error": 0, "skipped": len(queries) - len(pending)}
+        graph = create_async_graph_for_direct_use()
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def worker(item):
+            async with semaphore:
+                record, metrics = await _run_one(graph, item, config)
+            # Single event loop thread: writes are never interleaved
+            sink.write(record)
+            if metrics_path:
+                report = metrics.report(id=record["id"], query=record["query"], status=record["status"])
+                metrics_out.write(json.dumps(report, ensure_ascii=False, default=str) + "\n")
+                metrics_out.flush()
+            counts[record["status"]] += 1
+            if on_result is not None:
+                on_result(record)
+
+        await asyncio.gather(*(worker(item) for item in pending))
+
+    return counts
+
+
+def run_batch_processes(
+    queries: List[Dict[str, str]],
+    config: Dict[str, Any],
+    output_path: str,
+    workers: int,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+    metrics_path: Optional[str] = None,
+    tracing: bool = False,
+) -> Dict[str, int]:
+    """Run ``queries`` sharded across ``workers`` processes.
+
+    Every process compiles its own graph and client pool and runs its shard
+    (every ``workers``-th pending query) with up to ``concurrency`` sessions.
+    The API quota is split evenly between the processes (see
+    :func:`agent.ratelimit.share_limits`) so that together they stay within
+    it. Results come back through one queue and are written in input order;
+    if a process dies, its unfinished queries are recorded as errors.
+
+    Args:
+        queries: Items as returned by :func:`load_batch_queries`
+        config: The ``configurable`` settings shared by every session
+        output_path: JSONL file or SQLite database that results are written to
+        workers: Number of worker processes
+        concurrency: Maximum number of research sessions in flight per process
+        on_result: Optional callback invoked with each finished record, in
+            completion order
+        metrics_path: Optional JSONL file that each query's full run report is appended to
+        tracing: Whether the workers export OpenTelemetry spans
+
+    Returns:
+        Counts of ``ok``, ``error`` and ``skipped`` queries.
+    """
+    import multiprocessing
+    from agent.configuration import Configuration
+    from agent.ratelimit import share_limits
+
+    with open_sink(output_path) as sink, \
+            open(metrics_path or os.devnull, "a", encoding="utf-8") as metrics_out:
+        done = sink.completed_ids()
+        pending = [item for item in queries if item["id"] not in done]
+        counts = {"ok": 0, "error": 0, "skipped": len(queries) - len(pending)}
+        if not pending:
+            return counts
+        workers = max(1, min(workers, len(pending)))
+        limits = share_limits(Configuration.from_runnable_config({"configurable": config}), workers)
+        shards = [list(range(index, len(pending), workers)) for index in range(workers)]
+
+        # Spawned rather than forked: the parent may already hold client
+        # connections and rate limiter threads
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        processes = [
+            context.Process(
+                target=_process_worker,
+                args=(index, [(position, pending[position]) for position in shard],
+                      {**config, **limits}, limits, concurrency, bool(metrics_path), tracing, results),
+                name=f"batch-worker-{index}",
+                daemon=True,
+            )
+            for index, shard in enumerate(shards)
+        ]
+        for process in processes:
+            process.start()
+
+        finished: Set[int] = set()
+        received: Set[int] = set()
+        buffered: Dict[int, Tuple[Dict[str, Any], Optional[Dict[str, Any]]]] = {}
+        next_position = 0
+
+        def accept(position, record, report):
+            nonlocal next_position
+            if position in received:
+                return
+            received.add(position)
+            counts[record["status"]] += 1
+            if on_result is not None:
+                on_result(record)
+            buffered[position] = (record, report)
+            while next_position in buffered:
+                write(*buffered.pop(next_position))
+                next_position += 1
+
+        def write(record, report):
+            sink.write(record)
+            if report is not None:
+                metrics_out.write(json.dumps(report, ensure_ascii=False, default=str) + "\n")
+                metrics_out.flush()
+
+        try:
+            while len(finished) < workers:
+                try:
+                    message = results.get(timeout=1.0)
+                except queue.Empty:
+                    for index, process in enumerate(processes):
+                        # A clean exit always sends "done" first; anything else is a crash
+                        if index in finished or process.is_alive() or process.exitcode == 0:
+                            continue
+                        finished.add(index)
+                        for position in shards[index]:
+                            accept(position, {
+                                "id": pending[position]["id"],
+                                "query": pending[position]["query"],
+                                "status": "error",
+                                "error": f"Worker process exited with code {process.exitcode}",
+                            }, None)
+                    continue
+                if message[0] == "done":
+                    finished.add(message[1])
+                else:
+                    accept(*message[1:])
+        finally:
+            # Keep what finished out of order, e.g. when interrupted
+            for position in sorted(buffered):
+                write(*buffered[position])
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+    return counts
+
+
+def _process_worker(
+    index: int,
+    shard: List[Tuple[int, Dict[str, str]]],
+    config: Dict[str, Any],
+    limits: Dict[str, Any],
+    concurrency: int,
+    with_reports: bool,
+    tracing: bool,
+    results,
+) -> None:
+    from agent.configuration import refresh_environment
+
+    # The parent handles Ctrl+C and stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Environment variables override configurable values, so the quota share
+    # has to replace them too
+    for name, value in limits.items():
+        if name.upper() in os.environ:
+            os.environ[name.upper()] = str(value)
+    refresh_environment()
+    if tracing:
+        from agent.metrics import configure_tracing, shutdown_tracing
+        configure_tracing()
+    try:
+        asyncio.run(_run_shard(shard, config, concurrency, with_reports, results))
+    finally:
+        if tracing:
+            shutdown_tracing()
+    results.put(("done", index))
+
+
+async def _run_shard(shard, config, concurrency, with_reports, results) -> None:
+    from agent.graph import create_async_graph_for_direct_use
+
+    graph = create_async_graph_for_direct_use()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def worker(position, item):
+        async with semaphore:
+            record, metrics = await _run_one(graph, item, config)
+        report = None
+        if with_reports:
+            report = metrics.report(id=record["id"], query=record["query"], status=record["status"])
+        results.put(("result", position, record, report))
+
+    await asyncio.gather(*(worker(position, item) for position, item in shard))
@@ -0,0 +1,178 @@
+"""
+Persistent cache for grounded web research results.
+
+``web_research`` is the most expensive call in the graph and the same
+questions come up over and over, so grounded Gemini responses are stored in a
+local SQLite database keyed by the normalized query, the model and the date.
+Only the parts the graph needs are kept (text, grounding chunks and grounding
+supports); short URLs are *not* cached because they depend on the id of the
+search within the current run and are recomputed on every hit.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "agentblack", "web_research.sqlite"
+)
+
+_caches: Dict[str, "WebResearchCache"] = {}
+_caches_lock = threading.Lock()
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a search query so trivially different spellings share a key."""
+    query = query.lower().strip()
+    query = re.sub(r"\s+", " ", query)
+    return query.strip(" ?.!,;:\"'")
+
+
+def cache_key(query: str, model: str, date_bucket: Optional[str] = None) -> str:
+    """Content address of a web research result."""
+    date_bucket = date_bucket or datetime.now().strftime("%Y-%m-%d")
+    raw = "\x00".join((normalize_query(query), model, date_bucket))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def payload_from_response(response) -> Dict[str, Any]:
+    """Extract the cacheable parts of a grounded ``generate_content`` response."""
+    chunks, supports = [], []
+    candidate = response.candidates[0] if response.candidates else None
+    metadata = getattr(candidate, "grounding_metadata", None)
+    if metadata is not None:
+        for chunk in metadata.grounding_chunks or []:
+            web = getattr(chunk, "web", None)
+            chunks.append({
+                "uri": getattr(web, "uri", None),
+                "title": getattr(web, "title", None),
+            })
+        for support in metadata.grounding_supports or []:
+            segment = getattr(support, "segment", None)
+            if segment is None:
+                continue
+            supports.append({
+                "start_index": segment.start_index,
+                "end_index": segment.end_index,
+                "grounding_chunk_indices": list(support.grounding_chunk_indices or []),
+            })
+    return {"text": response.text, "chunks": chunks, "supports": supports}
+
+
+def response_from_payload(payload: Dict[str, Any]):
+    """Rebuild a response-like object that ``resolve_urls`` and ``get_citations`` accept."""
+    chunks = [
+        SimpleNamespace(web=SimpleNamespace(uri=c["uri"], title=c["title"]))
+        for c in payload["chunks"]
+    ]
+    supports = [
+        SimpleNamespace(
+            segment=SimpleNamespace(start_index=s["start_index"], end_index=s["end_index"]),
+            grounding_chunk_indices=s["grounding_chunk_indices"],
+        )
+        for s in payload["supports"]
+    ]
+    metadata = SimpleNamespace(grounding_chunks=chunks, grounding_supports=supports)
+    return SimpleNamespace(
+        text=payload["text"],
+        candidates=[SimpleNamespace(grounding_metadata=metadata)],
+    )
+
+
+class WebResearchCache:
+    """SQLite-backed cache with a TTL and size-bounded LRU eviction."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl_hours: float = 24.0, max_mb: float = 256.0):
+        self.path = path
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS web_research ("
+                " key TEXT PRIMARY KEY,"
+                " created REAL NOT NULL,"
+                " accessed REAL NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " payload BLOB NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS web_research_accessed ON web_research (accessed)"
+            )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached payload for ``key``, or None on a miss or expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created, payload FROM web_research WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[0] > self.ttl_seconds:
+                if row is not None:
+                    with self._conn:
+                        self._conn.execute("DELETE FROM web_research WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE web_research SET accessed = ? WHERE key = ?", (now, key)
+                )
+            self.hits += 1
+        return json.loads(zlib.decompress(row[1]).decode("utf-8"))
+
+    def put(self, key: str, payload: Dict[str, Any]) -> None:
+        """Store ``payload`` under ``key`` and evict least recently used entries if needed."""
+        blob = zlib.compress(json.dumps(payload).encode("utf-8"))
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO web_research (key, created, accessed, size, payload)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, now, now, len(blob), blob),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute(
+            "DELETE FROM web_research WHERE created < ?", (now - self.ttl_seconds,)
+        )
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM web_research"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM web_research ORDER BY accessed ASC"
+        ).fetchall():
+            self._conn.execute("DELETE FROM web_research WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+def get_web_research_cache(path: str = "", ttl_hours: float = 24.0, max_mb: float = 256.0) -> WebResearchCache:
+    """Return the process-wide cache for ``path`` (the default location if empty)."""
+    path = path or DEFAULT_CACHE_PATH
+    cache = _caches.get(path)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(path)
+            if cache is None:
+                cache = WebResearchCache(path, ttl_hours, max_mb)
+                _caches[path] = cache
+    return cache
@@ -0,0 +1,358 @@
+"""
+Record and replay of model interactions ("cassettes").
+
+:class:`RecordingBackend` wraps another backend and appends every chat and
+grounded search interaction (prompt key, model, latency and the full
+response, including grounding metadata and token usage) to a gzipped JSONL
+file in the cassette directory. :class:`ReplayBackend` serves those responses
+back without a network, sleeping for the recorded latency multiplied by a
+time scale (1 for the original timing, less to compress it, 0 for none).
+
+Interactions are keyed by kind, model, output schema and prompt. The current
+date that the prompts embed is masked, so a cassette recorded yesterday still
+replays today. Repeated identical requests are replayed in recorded order.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from agent.backends import ModelBackend
+from agent.cache import payload_from_response, response_from_payload
+from agent.metrics import current_node
+
+CASSETTE_FILE = "interactions.jsonl.gz"
+
+_DATE_PATTERN = re.compile(
+    r"\b(January|February|March|April|May|June|July|August|September|October|November|December)"
+    r" \d{2}, \d{4}\b"
+)
+
+
+class CassetteMissError(LookupError):
+    """Raised when a replayed run makes a request that was not recorded."""
+
+
+def interaction_key(kind: str, model: str, schema: Optional[str], prompt: str) -> str:
+    """Stable key of a request; the current date in the prompt is masked."""
+    prompt = _DATE_PATTERN.sub("<date>", prompt)
+    raw = "\x00".join((kind, model, schema or "", prompt))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _schema_name(schema) -> Optional[str]:
+    return schema.__name__ if schema is not None else None
+
+
+def _message_payload(message) -> Dict[str, Any]:
+    content = message.content
+    if not isinstance(content, str):
+        content = "".join(p.get("text", "") if isinstance(p, dict) else str(p) for p in content)
+    return {"content": content, "usage": getattr(message, "usage_metadata", None)}
+
+
+def _message(payload: Dict[str, Any]) -> AIMessage:
+    if payload.get("usage"):
+        return AIMessage(content=payload["content"], usage_metadata=payload["usage"])
+    return AIMessage(content=payload["content"])
+
+
+def _search_payload(response) -> Dict[str, Any]:
+    payload = payload_from_response(response)
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        payload["usage"] = {
+            "prompt_token_count": getattr(usage, "prompt_token_count", None),
+            "candidates_token_count": getattr(usage, "candidates_token_count", None),
+            "total_token_count": getattr(usage, "total_token_count", None),
+        }
+    return payload
+
+
+def _search_response(payload: Dict[str, Any]):
+    response = response_from_payload(payload)
+    if payload.get("usage"):
+        response.usage_metadata = SimpleNamespace(**payload["usage"])
+    return response
+
+
+class _CassetteWriter:
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, CASSETTE_FILE)
+        self._lock = threading.Lock()
+
+    def write(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            # One gzip member per entry: everything written so far survives a crash
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(line)
+
+
+class RecordingChatModel:
+    """Chat model wrapper that records every call of the wrapped model."""
+
+    def __init__(self, recorder: "RecordingBackend", inner, model: str, schema, include_raw: bool):
+        self.recorder = recorder
+        self.inner = inner
+        self.model = model
+        self.schema = schema
+        self.include_raw = include_raw
+
+    def _record(self, prompt: str, result, latency: float) -> None:
+        if self.schema is None:
+            response = _message_payload(result)
+        elif self.include_raw:
+            response = {
+                "parsed": result["parsed"].model_dump() if result["parsed"] is not None else None,
+                "raw": _message_payload(result["raw"]),
+            }
+        else:
+            response = {"parsed": result.model_dump()}
+        self.recorder.record("chat", self.model, self.schema, prompt, latency, response)
+
+    def invoke(self, prompt: str, *args, **kwargs):
+        start = time.perf_counter()
+        result = self.inner.invoke(prompt, *args, **kwargs)
+        self._record(prompt, result, time.perf_counter() - start)
+        return result
+
+    async def ainvoke(self, prompt: str, *args, **kwargs):
+        start = time.perf_counter()
+        result = await self.inner.ainvoke(prompt, *args, **kwargs)
+        self._record(prompt, result, time.perf_counter() - start)
+        return result
+
+    def _record_stream(self, prompt: str, chunks: List[str], offsets: List[float], merged) -> None:
+        response = {"chunks": chunks, "offsets": [round(t, 4) for t in offsets]}
+        # Merging the chunks adds up their usage
+        usage = getattr(merged, "usage_metadata", None)
+        if usage:
+            response["usage"] = usage
+        self.recorder.record("stream", self.model, None, prompt, offsets[-1] if offsets else 0.0, response)
+
+    def stream(self, prompt: str, *args, **kwargs):
+        start = time.perf_counter()
+        chunks, offsets, merged = [], [], None
+        for chunk in self.inner.stream(prompt, *args, **kwargs):
+            chunks.append(_message_payload(chunk)["content"])
+            offsets.append(time.perf_counter() - start)
+            merged = chunk if merged is None else merged + chunk
+            yield chunk
+        self._record_stream(prompt, chunks, offsets, merged)
+
+    async def astream(self, prompt: str, *args, **kwargs):
+        start = time.perf_counter()
+        chunks, offsets, merged = [], [], None
+        async for chunk in self.inner.astream(prompt, *args, **kwargs):
+            chunks.append(_message_payload(chunk)["content"])
+            offsets.append(time.perf_counter() - start)
+            merged = chunk if merged is None else merged + chunk
+            yield chunk
+        self._record_stream(prompt, chunks, offsets, merged)
+
+
+class RecordingBackend(ModelBackend):
+    """Passes every call to ``inner`` and records it in the cassette at ``directory``."""
+
+    name = "record"
+
+    def __init__(self, inner: ModelBackend, directory: str):
+        self.inner = inner
+        self.directory = directory
+        self.recorded = 0
+        self._writer = _CassetteWriter(directory)
+
+    def record(self, kind: str, model: str, schema, prompt: str, latency: float, response: Dict[str, Any]) -> None:
+        node = current_node()
+        self._writer.write({
+            "key": interaction_key(kind, model, _schema_name(schema), prompt),
+            "kind": kind,
+            "node": node.node if node is not None else None,
+            "model": model,
+            "schema": _schema_name(schema),
+            "latency": round(latency, 4),
+            "recorded_at": time.time(),
+            "response": response,
+        })
+        self.recorded += 1
+
+    def chat_model(self, model, temperature, schema=None, include_raw=False, timeout=None):
+        inner = self.inner.chat_model(model, temperature, schema, include_raw, timeout)
+        return RecordingChatModel(self, inner, model, schema, include_raw)
+
+    def search(self, model, prompt, timeout=None):
+        start = time.perf_counter()
+        response = self.inner.search(model, prompt, timeout)
+        self.record("search", model, None, prompt, time.perf_counter() - start, _search_payload(response))
+        return response
+
+    async def asearch(self, model, prompt, timeout=None):
+        start = time.perf_counter()
+        response = await self.inner.asearch(model, prompt, timeout)
+        self.record("search", model, None, prompt, time.perf_counter() - start, _search_payload(response))
+        return response
+
+
+def load_cassette(directory: str) -> List[Dict[str, Any]]:
+    """Read every recorded interaction, skipping a truncated last entry."""
+    path = os.path.join(directory, CASSETTE_FILE)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No cassette found at {path}")
+    entries = []
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+    except EOFError:
+        # The recording was interrupted in the middle of an entry
+        pass
+    return entries
+
+
+class ReplayChatModel:
+    """Chat model serving recorded responses."""
+
+    def __init__(self, replayer: "ReplayBackend", model: str, schema, include_raw: bool):
+        self.replayer = replayer
+        self.model = model
+        self.schema = schema
+        self.include_raw = include_raw
+
+    def _result(self, entry: Dict[str, Any]):
+        response = entry["response"]
+        if self.schema is None:
+            return _message(response)
+        parsed = (
+            self.schema.model_validate(response["parsed"]) if response["parsed"] is not None else None
+        )
+        if not self.include_raw:
+            return parsed
+        raw = _message(response["raw"]) if "raw" in response else _message({"content": ""})
+        return {"raw": raw, "parsed": parsed, "parsing_error": None}
+
+    def _chat_entry(self, prompt: str) -> Dict[str, Any]:
+        try:
+            return self.replayer.next("chat", self.model, self.schema, prompt)
+        except CassetteMissError:
+            if self.schema is not None:
+                raise
+            # Recorded while streaming: replay the joined chunks
+            entry = self.replayer.next("stream", self.model, None, prompt)
+            response = entry["response"]
+            return {
+                "latency": entry["latency"],
+                "response": {"content": "".join(response["chunks"]), "usage": response.get("usage")},
+            }
+
+    def invoke(self, prompt: str, *args, **kwargs):
+        entry = self._chat_entry(prompt)
+        time.sleep(self.replayer.delay(entry["latency"]))
+        return self._result(entry)
+
+    async def ainvoke(self, prompt: str, *args, **kwargs):
+        entry = self._chat_entry(prompt)
+        await asyncio.sleep(self.replayer.delay(entry["latency"]))
+        return self._result(entry)
+
+    def _stream_entry(self, prompt: str) -> Dict[str, Any]:
+        try:
+            return self.replayer.next("stream", self.model, None, prompt)
+        except CassetteMissError:
+            # Recorded without streaming: replay the whole answer as one chunk
+            entry = self.replayer.next("chat", self.model, None, prompt)
+            response = entry["response"]
+            return {"response": {
+                "chunks": [response["content"]], "offsets": [entry["latency"]], "usage": response.get("usage"),
+            }}
+
+    def stream(self, prompt: str, *args, **kwargs):
+        response = self._stream_entry(prompt)["response"]
+        previous = 0.0
+        for text, offset, usage in _replayed_chunks(response):
+            time.sleep(self.replayer.delay(offset - previous))
+            previous = offset
+            yield AIMessageChunk(content=text, usage_metadata=usage)
+
+    async def astream(self, prompt: str, *args, **kwargs):
+        response = self._stream_entry(prompt)["response"]
+        previous = 0.0
+        for text, offset, usage in _replayed_chunks(response):
+            await asyncio.sleep(self.replayer.delay(offset - previous))
+            previous = offset
+            yield AIMessageChunk(content=text, usage_metadata=usage)
+
+
+def _replayed_chunks(response: Dict[str, Any]):
+    """(text, offset, usage) of each recorded chunk; the last one carries the recorded usage."""
+    chunks = list(zip(response["chunks"], response["offsets"]))
+    for i, (text, offset) in enumerate(chunks):
+        yield text, offset, response.get("usage") if i == len(chunks) - 1 else None
+
+
+class ReplayBackend(ModelBackend):
+    """Serves the interactions recorded in ``directory``.
+
+    Args:
+        directory: Cassette directory written by :class:`RecordingBackend`
+        time_scale: Multiplier on the recorded latencies (1 for the original
+            timing, e.g. 0.1 to replay ten times faster, 0 for no waiting)
+    """
+
+    name = "replay"
+
+    def __init__(self, directory: str, time_scale: float = 1.0):
+        self.directory = directory
+        self.time_scale = time_scale
+        self.replayed = 0
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        for entry in load_cassette(directory):
+            self._entries.setdefault(entry["key"], []).append(entry)
+        self._positions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def delay(self, seconds: float) -> float:
+        return max(0.0, seconds * self.time_scale)
+
+    def next(self, kind: str, model: str, schema, prompt: str) -> Dict[str, Any]:
+        """The next recorded response for this request (the last one repeats)."""
+        key = interaction_key(kind, model, _schema_name(schema), prompt)
+        entries = self._entries.get(key)
+        if not entries:
+            # The prompt is left out of the message: its text could look like a retryable error
+            raise CassetteMissError(
+                f"No recorded {kind} interaction for model {model!r} in {self.directory} "
+                f"(key {key[:12]}); the run diverged from the recording"
+            )
+        with self._lock:
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            self.replayed += 1
+        return entries[min(position, len(entries) - 1)]
+
+    def chat_model(self, model, temperature, schema=None, include_raw=False, timeout=None):
+        # Recorded responses are complete, so a replay never times out
+        return ReplayChatModel(self, model, schema, include_raw)
+
+    def search(self, model, prompt, timeout=None):
+        entry = self.next("search", model, None, prompt)
+        time.sleep(self.delay(entry["latency"]))
+        return _search_response(entry["response"])
+
+    async def asearch(self, model, prompt, timeout=None):
+        entry = self.next("search", model, None, prompt)
+        await asyncio.sleep(self.delay(entry["latency"]))
+        return _search_response(entry["response"])
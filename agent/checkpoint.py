@@ -0,0 +1,75 @@
+"""
+Durable checkpoints of research runs.
+
+With a checkpointer the graph saves its state after every superstep under
+the run's ``thread_id``, together with the results of the tasks that already
+finished inside an interrupted superstep. A run that crashed or was stopped
+with Ctrl-C can then be resumed by streaming ``None`` for the same thread:
+LangGraph continues after the last completed superstep and reuses the stored
+``web_research`` results instead of searching again.
+
+Checkpoints are kept in SQLite through the ``langgraph-checkpoint-sqlite``
+package, which requirements.txt lists. The rest of the agent works without it.
+Checkpoints are written with ``durability="async"``, so a step's checkpoint is persisted in the background
+while the next step runs, and the database uses WAL with relaxed syncing to
+keep the writes cheap.
+"""
+
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+
+DEFAULT_CHECKPOINT_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "agentblack", "checkpoints.sqlite"
+)
+# Persist each checkpoint while the next superstep is already running
+CHECKPOINT_DURABILITY = "async"
+
+_checkpointers: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def get_checkpointer(path: str = DEFAULT_CHECKPOINT_PATH):
+    """Return the process-wide SQLite checkpointer for ``path``.
+
+    Raises:
+        ImportError: If langgraph-checkpoint-sqlite is not installed
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    with _lock:
+        checkpointer = _checkpointers.get(path)
+        if checkpointer is None:
+            try:
+                from langgraph.checkpoint.sqlite import SqliteSaver
+            except ImportError as e:
+                raise ImportError(
+                    "Checkpointing (--thread-id) needs the langgraph-checkpoint-sqlite package: "
+                    "pip install langgraph-checkpoint-sqlite (it is listed in requirements.txt)"
+                ) from e
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            checkpointer = SqliteSaver(conn)
+            _checkpointers[path] = checkpointer
+    return checkpointer
+
+
+def thread_config(thread_id: str) -> Dict[str, Any]:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def saved_query(graph, thread_id: str) -> Optional[str]:
+    """The question of the run checkpointed under ``thread_id``, if there is one."""
+    values = graph.get_state(thread_config(thread_id)).values
+    messages = values.get("messages") if values else None
+    if not messages:
+        return None
+    return messages[0].content
+
+
+def is_resumable(graph, thread_id: str) -> bool:
+    """Whether ``thread_id`` has a checkpoint with steps still to run."""
+    return bool(graph.get_state(thread_config(thread_id)).next)
@@ -0,0 +1,119 @@
+"""
+Shared Gemini clients for the agent.
+
+Building a ``ChatGoogleGenerativeAI`` (or a ``google.genai.Client``) sets up a
+fresh HTTP transport every time.  The graph nodes call the same handful of
+models over and over, so the clients are created once per process and reused
+by every node, every retry and every research session.
+
+The SDKs are imported and the clients built on first use, so importing the
+agent (or running ``main.py --help``) doesn't pay for them.
+"""
+
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from google.genai import Client
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+# Retries handled by the langchain client itself (on top of the node retries)
+CLIENT_MAX_RETRIES = 2
+
+_lock = threading.RLock()
+_genai_client: Optional["Client"] = None
+_chat_models: Dict[Tuple[str, float, Optional[Type[BaseModel]], bool, Optional[float]], Any] = {}
+
+
+def get_genai_client() -> "Client":
+    """Return the process-wide ``google.genai`` client.
+
+    This is the client used for grounded Google Search calls, and its
+    connection pool is shared with the langchain chat models below.
+    """
+    global _genai_client
+    if _genai_client is None:
+        with _lock:
+            if _genai_client is None:
+                if os.getenv("GEMINI_API_KEY") is None:
+                    raise ValueError("GEMINI_API_KEY is not set")
+                from google.genai import Client
+
+                _genai_client = Client(api_key=os.getenv("GEMINI_API_KEY"))
+    return _genai_client
+
+
+def get_chat_model(
+    model: str,
+    temperature: float,
+    schema: Optional[Type[BaseModel]] = None,
+    include_raw: bool = False,
+    timeout: Optional[float] = None,
+):
+    """Return a warm chat model for ``(model, temperature, schema)``.
+
+    Args:
+        model: Name of the Gemini model
+        temperature: Sampling temperature
+        schema: Optional pydantic model for structured output
+        include_raw: For structured output, also return the raw message
+            (``{"raw": ..., "parsed": ..., "parsing_error": ...}``), e.g. to
+            read its token usage
+        timeout: HTTP timeout of each request in seconds (None for none)
+
+    Returns:
+        A ``ChatGoogleGenerativeAI`` instance, or its structured-output runnable
+        when ``schema`` is given. The same object is returned for the same key.
+    """
+    timeout = float(timeout) if timeout else None
+    key = (model, float(temperature), schema, include_raw and schema is not None, timeout)
+    llm = _chat_models.get(key)
+    if llm is not None:
+        return llm
+
+    with _lock:
+        llm = _chat_models.get(key)
+        if llm is None:
+            llm = _base_chat_model(model, temperature, timeout)
+            if schema is not None:
+                llm = llm.with_structured_output(schema, include_raw=include_raw)
+                _chat_models[key] = llm
+    return llm
+
+
+def _base_chat_model(model: str, temperature: float, timeout: Optional[float]) -> "ChatGoogleGenerativeAI":
+    """Build (or fetch) the plain chat model. Caller must hold ``_lock``."""
+    key = (model, float(temperature), None, False, timeout)
+    llm = _chat_models.get(key)
+    if llm is None:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        llm = ChatGoogleGenerativeAI(
+            model=model,
+            temperature=temperature,
+            max_retries=CLIENT_MAX_RETRIES,
+            timeout=timeout,
+            api_key=os.getenv("GEMINI_API_KEY"),
+        )
+        _share_transport(llm)
+        _chat_models[key] = llm
+    return llm
+
+
+def _share_transport(llm: "ChatGoogleGenerativeAI") -> None:
+    """Point the chat model at the shared genai client when the SDK allows it."""
+    from google.genai import Client
+
+    if isinstance(getattr(llm, "client", None), Client):
+        llm.client = get_genai_client()
+
+
+def clear_clients() -> None:
+    """Drop all cached clients (e.g. after the API key changed)."""
+    global _genai_client
+    with _lock:
+        _chat_models.clear()
+        _genai_client = None
@@ -1,12 +1,20 @@
+import functools
 import os
-from pydantic import BaseModel, Field
-from typing import Any, Optional
+import threading
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Any, Dict, Optional, Tuple
 
 from langchain_core.runnables import RunnableConfig
 
 
 class Configuration(BaseModel):
-    """The configuration for the agent."""
+    """The configuration for the agent.
+
+    Instances are immutable and hashable, so a run's configuration can be
+    resolved once and used as a cache key.
+    """
+
+    model_config = ConfigDict(frozen=True)
 
     query_generator_model: str = Field(
         default="gemini-2.0-flash",
@@ -39,22 +47,314 @@ class Configuration(BaseModel):
         metadata={"description": "The maximum number of research loops to perform."},
     )
 
+    max_retries: int = Field(
+        default=3,
+        metadata={"description": "The maximum number of retries for each API call."},
+    )
+
+    retry_base_delay: float = Field(
+        default=1.0,
+        metadata={
+            "description": "The base delay in seconds for exponential retry backoff."
+        },
+    )
+
+    retry_budget_seconds: float = Field(
+        default=60.0,
+        metadata={
+            "description": "The total time in seconds a run may spend waiting on retries."
+        },
+    )
+
+    web_research_cache: bool = Field(
+        default=True,
+        metadata={
+            "description": "Whether to reuse cached web research results for repeated queries."
+        },
+    )
+
+    web_research_cache_path: str = Field(
+        default="",
+        metadata={
+            "description": "Path of the web research cache database (empty for the default location)."
+        },
+    )
+
+    web_research_cache_ttl_hours: float = Field(
+        default=24.0,
+        metadata={"description": "How long cached web research results stay valid."},
+    )
+
+    web_research_cache_max_mb: float = Field(
+        default=256.0,
+        metadata={"description": "Maximum size of the web research cache in megabytes."},
+    )
+
+    stopping_policy: str = Field(
+        default="fixed",
+        metadata={
+            "description": "How the research loop stops: 'fixed' only on sufficiency and max_research_loops, 'marginal_gain' also early when a loop adds little or the budget runs out."
+        },
+    )
+
+    min_new_sources: int = Field(
+        default=1,
+        metadata={
+            "description": "Stop when a follow-up loop cites fewer new source URLs than this."
+        },
+    )
+
+    max_summary_overlap: float = Field(
+        default=0.9,
+        metadata={
+            "description": "Stop when this share (0-1) of a follow-up loop's summary vocabulary was already in earlier summaries."
+        },
+    )
+
+    research_time_budget_seconds: float = Field(
+        default=0,
+        metadata={
+            "description": "Don't start another research loop that would end after this many seconds of run time (0 for no budget)."
+        },
+    )
+
+    research_token_budget: int = Field(
+        default=0,
+        metadata={
+            "description": "Don't start another research loop that would take the run past this many tokens (0 for no budget)."
+        },
+    )
+
+    research_history: bool = Field(
+        default=True,
+        metadata={
+            "description": "Whether finished runs are stored in the searchable research history."
+        },
+    )
+
+    research_history_path: str = Field(
+        default="",
+        metadata={
+            "description": "Path of the research history database (empty for the default location)."
+        },
+    )
+
+    consult_history: bool = Field(
+        default=False,
+        metadata={
+            "description": "Whether fresh prior runs are consulted to answer or seed a run before any query is generated."
+        },
+    )
+
+    history_max_age_hours: float = Field(
+        default=168.0,
+        metadata={"description": "How old a prior run may be to answer or seed a new run."},
+    )
+
+    history_answer_threshold: float = Field(
+        default=0.9,
+        metadata={
+            "description": "Question similarity (0-1) at or above which a prior run's answer is reused."
+        },
+    )
+
+    history_seed_threshold: float = Field(
+        default=0.4,
+        metadata={
+            "description": "Question similarity (0-1) at or above which a prior run's searches seed a new run."
+        },
+    )
+
+    stream_answer: bool = Field(
+        default=False,
+        metadata={
+            "description": "Whether to stream the final answer as custom stream events while it is generated."
+        },
+    )
+
+    incremental_reflection: bool = Field(
+        default=False,
+        metadata={
+            "description": "Whether reflection sees a running digest plus only the latest results instead of every summary."
+        },
+    )
+
+    answer_group_size: int = Field(
+        default=0,
+        metadata={
+            "description": "Condense web research results in groups of this size before the final answer (0 disables hierarchical synthesis)."
+        },
+    )
+
+    answer_map_parallelism: int = Field(
+        default=4,
+        metadata={"description": "The maximum number of groups condensed in parallel."},
+    )
+
+    dedup_follow_up_queries: bool = Field(
+        default=True,
+        metadata={
+            "description": "Whether follow-up queries that rephrase an already executed query are dropped."
+        },
+    )
+
+    follow_up_dedup_threshold: float = Field(
+        default=0.8,
+        metadata={
+            "description": "Jaccard similarity (0-1) of word shingles at or above which a follow-up query counts as a duplicate."
+        },
+    )
+
+    call_timeout_seconds: float = Field(
+        default=120.0,
+        metadata={
+            "description": "HTTP timeout of one API call attempt; a slower attempt is aborted and retried (0 for no limit)."
+        },
+    )
+
+    run_deadline_seconds: float = Field(
+        default=0,
+        metadata={
+            "description": "Wall-clock limit of the research; after it the run answers with what it has (0 for no deadline)."
+        },
+    )
+
+    drop_failed_searches: bool = Field(
+        default=True,
+        metadata={
+            "description": "Whether a web search that fails after its retries or times out is dropped instead of failing the run."
+        },
+    )
+
+    hedge_web_research: bool = Field(
+        default=False,
+        metadata={
+            "description": "Whether a slow web search gets a duplicate request and the first response is used."
+        },
+    )
+
+    hedge_percentile: float = Field(
+        default=95.0,
+        metadata={
+            "description": "Percentile of recent web search latency after which a search is hedged."
+        },
+    )
+
+    hedge_budget: float = Field(
+        default=0.1,
+        metadata={
+            "description": "Hedged requests allowed per web search request (e.g. 0.1 for at most 10% extra requests)."
+        },
+    )
+
+    model_backend: str = Field(
+        default="gemini",
+        metadata={
+            "description": "The model backend the graph calls: 'gemini', or 'fake' for offline runs and benchmarks."
+        },
+    )
+
+    max_concurrent_requests: int = Field(
+        default=8,
+        metadata={
+            "description": "The maximum number of Gemini API calls in flight across all sessions of the process (0 for no limit)."
+        },
+    )
+
+    requests_per_minute: float = Field(
+        default=0,
+        metadata={"description": "Requests per minute allowed per model (0 for no limit)."},
+    )
+
+    tokens_per_minute: float = Field(
+        default=0,
+        metadata={"description": "Tokens per minute allowed per model (0 for no limit)."},
+    )
+
+    rate_limits: str = Field(
+        default="",
+        metadata={
+            "description": "Per-model quotas overriding the defaults, as 'model=rpm[/tpm],...'."
+        },
+    )
+
+    scheduling_priority: int = Field(
+        default=0,
+        metadata={
+            "description": "Priority of this session's API calls when they queue for the rate limiter; lower runs first."
+        },
+    )
+
     @classmethod
     def from_runnable_config(
         cls, config: Optional[RunnableConfig] = None
     ) -> "Configuration":
-        """Create a Configuration instance from a RunnableConfig."""
+        """Return the Configuration of a RunnableConfig.
+
+        A run that carries its resolved configuration in
+        ``configurable["configuration"]`` gets that object back. Otherwise the
+        values are resolved from the :func:`environment_overrides` snapshot
+        (environment variables win) and the configurable values; equal inputs
+        share one cached, immutable instance.
+        """
         configurable = (
             config["configurable"] if config and "configurable" in config else {}
         )
+        resolved = configurable.get(CONFIGURATION_KEY)
+        if isinstance(resolved, cls):
+            return resolved
+
+        values = tuple(
+            (name, configurable[name])
+            for name in cls.model_fields
+            if configurable.get(name) is not None
+        )
+        try:
+            return _resolve(cls, values)
+        except TypeError:
+            # An unhashable configurable value can't be a cache key
+            return cls(**{**dict(values), **environment_overrides()})
+
+
+CONFIGURATION_KEY = "configuration"
+
+_environment: Optional[Dict[str, str]] = None
+_environment_lock = threading.Lock()
+
+
+def _read_environment() -> Dict[str, str]:
+    return {
+        name: os.environ[name.upper()]
+        for name in Configuration.model_fields
+        if name.upper() in os.environ
+    }
+
+
+def environment_overrides() -> Dict[str, str]:
+    """Configuration values set as environment variables (``NAME.upper()``).
+
+    The variables are read once, by :func:`refresh_environment` or, if that
+    was never called, on first use. The CLI and the HTTP server call
+    :func:`refresh_environment` at startup, so later changes to
+    ``os.environ`` don't affect their runs.
+    """
+    global _environment
+    if _environment is None:
+        with _environment_lock:
+            if _environment is None:
+                _environment = _read_environment()
+    return _environment
+
 
-        # Get raw values from environment or config
-        raw_values: dict[str, Any] = {
-            name: os.environ.get(name.upper(), configurable.get(name))
-            for name in cls.model_fields.keys()
-        }
+def refresh_environment() -> Dict[str, str]:
+    """Read the environment overrides now (e.g. at startup, after loading a .env file)."""
+    global _environment
+    with _environment_lock:
+        _environment = _read_environment()
+    _resolve.cache_clear()
+    return _environment
 
-        # Filter out None values
-        values = {k: v for k, v in raw_values.items() if v is not None}
 
-        return cls(**values)
+@functools.lru_cache(maxsize=256)
+def _resolve(cls, values: Tuple[Tuple[str, Any], ...]) -> Configuration:
+    return cls(**{**dict(values), **environment_overrides()})
@@ -0,0 +1,85 @@
+"""
+Near-duplicate detection for search queries.
+
+The reflection model often proposes follow-up queries that are mere
+rephrasings of searches that already ran. Each query is turned into a set of
+shingles (normalized words and their character trigrams); queries whose
+Jaccard similarity to an executed query reaches the threshold are dropped
+before they cost a grounded search. Queries have a few dozen shingles at
+most, so the similarity is computed exactly, which keeps the decision
+deterministic. Everything runs locally, no embeddings or network calls are
+involved.
+"""
+
+import re
+from typing import Dict, FrozenSet, List, Tuple
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how in into is it its of on or "
+    "that the their there these this to was what when where which who why will with "
+    "about latest recent current".split()
+)
+
+
+def _normalize_token(token: str) -> str:
+    # Crude stemming so "benchmarks"/"benchmark" and "apple's"/"apple" match
+    for suffix in ("'s", "ies", "es", "s"):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[: -len(suffix)] + ("y" if suffix == "ies" else "")
+    return token
+
+
+def shingles(query: str) -> FrozenSet[str]:
+    """Words (minus stopwords) and their character trigrams."""
+    words = [
+        _normalize_token(word)
+        for word in re.findall(r"[a-z0-9']+", query.lower())
+        if word not in _STOPWORDS
+    ]
+    result = set(words)
+    for word in words:
+        padded = f"#{word}#"
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(result)
+
+
+def similarity(shingles_a: FrozenSet[str], shingles_b: FrozenSet[str]) -> float:
+    """Jaccard similarity of two shingle sets (0 when either is empty)."""
+    if not shingles_a or not shingles_b:
+        return 0.0
+    return len(shingles_a & shingles_b) / len(shingles_a | shingles_b)
+
+
+def deduplicate_queries(
+    candidates: List[str], executed: List[str], threshold: float
+) -> Tuple[List[str], List[Dict[str, object]]]:
+    """Drop candidates that are near-duplicates of executed queries (or of each other).
+
+    Args:
+        candidates: Proposed queries, in order
+        executed: Queries that already ran
+        threshold: Minimum similarity for a candidate to be dropped
+
+    Returns:
+        The kept queries and, for every dropped one, a record with the query,
+        the query it duplicates and their similarity.
+    """
+    seen = [(query, shingles(query)) for query in executed]
+    kept, skipped = [], []
+    for candidate in candidates:
+        candidate_shingles = shingles(candidate)
+        best_query, best = None, 0.0
+        for query, other in seen:
+            score = similarity(candidate_shingles, other)
+            if score > best:
+                best_query, best = query, score
+        if best_query is not None and best >= threshold:
+            skipped.append({
+                "query": candidate,
+                "duplicate_of": best_query,
+                "similarity": round(best, 3),
+            })
+            continue
+        kept.append(candidate)
+        seen.append((candidate, candidate_shingles))
+    return kept, skipped
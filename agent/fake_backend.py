@@ -0,0 +1,305 @@
+"""
+Offline fake of the Gemini backend for benchmarks and load tests.
+
+:class:`FakeBackend` answers every call the graph makes without a network:
+structured query lists and reflections, grounded search results with
+grounding metadata (generated, or canned payloads in the format stored by
+:mod:`agent.cache`) and final answers that cite the short URLs found in their
+prompt, so the citation and URL rewriting code does real work. Latencies are
+drawn from log-normal distributions and 503/429 errors can be injected at
+configurable rates. A call slower than its ``timeout`` raises ``TimeoutError``.
+
+Every random draw is seeded by the backend seed, the prompt and how often
+that prompt was seen before, so a run produces the same queries, latencies
+and failures regardless of how parallel branches are scheduled.
+"""
+
+import asyncio
+import json
+import math
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from agent.backends import ModelBackend
+from agent.cache import response_from_payload
+from agent.tools_and_schemas import IncrementalReflection, Reflection, SearchQueryList
+from agent.utils import SHORT_URL_PREFIX
+
+_ASPECTS = [
+    "overview", "latest statistics", "expert analysis", "history", "regulation",
+    "market share", "criticism", "future outlook", "case studies", "costs",
+    "environmental impact", "key companies", "recent news", "technical details",
+    "public opinion", "comparison with alternatives",
+]
+_SHORT_URL_PATTERN = re.compile(re.escape(SHORT_URL_PREFIX) + r"[\w-]+")
+_STREAM_CHUNK_CHARS = 16
+
+
+@dataclass(frozen=True)
+class LatencyDistribution:
+    """Log-normal latency given by its median and 95th percentile in seconds."""
+
+    median: float = 0.0
+    p95: float = 0.0
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0.0
+        if self.p95 <= self.median:
+            return self.median
+        sigma = math.log(self.p95 / self.median) / 1.6449
+        return self.median * math.exp(rng.gauss(0.0, sigma))
+
+
+class FakeAPIError(Exception):
+    """Injected API failure; ``code`` is the HTTP status it imitates."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code} {message} (injected by the fake backend)")
+        self.code = code
+
+
+def _topic(prompt: str) -> str:
+    for pattern in (r'information on "(.*?)"', r'summaries about "(.*?)"',
+                    r"Context: (.+)$", r"User Context:\n- (.+)"):
+        match = re.search(pattern, prompt, re.S)
+        if match:
+            return match.group(1).strip().splitlines()[0][:120]
+    return "the topic"
+
+
+def _message(content: str, prompt: str) -> AIMessage:
+    input_tokens, output_tokens = len(prompt) // 4, len(content) // 4
+    return AIMessage(content=content, usage_metadata={
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "total_tokens": input_tokens + output_tokens,
+    })
+
+
+def _chunks(message: AIMessage) -> List[AIMessageChunk]:
+    # The usage of the whole response rides on the last chunk, so the merged chunks add up to it
+    starts = range(0, len(message.content), _STREAM_CHUNK_CHARS)
+    return [
+        AIMessageChunk(
+            content=message.content[i:i + _STREAM_CHUNK_CHARS],
+            usage_metadata=message.usage_metadata if i == starts[-1] else None,
+        )
+        for i in starts
+    ]
+
+
+class FakeChatModel:
+    """Chat model (or structured-output runnable) of the fake backend."""
+
+    def __init__(self, backend: "FakeBackend", model: str, schema=None, include_raw: bool = False,
+                 timeout: Optional[float] = None):
+        self.backend = backend
+        self.model = model
+        self.schema = schema
+        self.include_raw = include_raw
+        self.timeout = timeout
+
+    def _result(self, prompt: str, rng: random.Random):
+        if self.schema is None:
+            return _message(self.backend.answer(prompt, rng), prompt)
+        parsed = self.backend.structured(self.schema, prompt, rng)
+        if not self.include_raw:
+            return parsed
+        raw = _message(parsed.model_dump_json(), prompt)
+        return {"raw": raw, "parsed": parsed, "parsing_error": None}
+
+    def invoke(self, prompt: str, *args, **kwargs):
+        rng = self.backend.call("chat", self.model, prompt, self.timeout)
+        return self._result(prompt, rng)
+
+    async def ainvoke(self, prompt: str, *args, **kwargs):
+        rng = await self.backend.acall("chat", self.model, prompt, self.timeout)
+        return self._result(prompt, rng)
+
+    def stream(self, prompt: str, *args, **kwargs):
+        yield from _chunks(self.invoke(prompt))
+
+    async def astream(self, prompt: str, *args, **kwargs):
+        for chunk in _chunks(await self.ainvoke(prompt)):
+            yield chunk
+
+
+class FakeBackend(ModelBackend):
+    """Deterministic offline backend.
+
+    Args:
+        search_latency: Latency of grounded searches
+        chat_latency: Latency of chat model calls
+        unavailable_rate: Probability that a call fails with a 503
+        rate_limit_rate: Probability that a call fails with a 429
+        sufficient_rate: Probability that a reflection finds the research sufficient
+        sources_per_search: Grounding chunks (and sentences) per search result
+        grounding: Canned ``{"text", "chunks", "supports"}`` payloads used for
+            search results instead of generated ones
+        seed: Seed of every random draw
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        search_latency: LatencyDistribution = LatencyDistribution(),
+        chat_latency: LatencyDistribution = LatencyDistribution(),
+        unavailable_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        sufficient_rate: float = 0.0,
+        sources_per_search: int = 3,
+        grounding: Optional[Sequence[Dict[str, Any]]] = None,
+        seed: int = 0,
+    ):
+        self.search_latency = search_latency
+        self.chat_latency = chat_latency
+        self.unavailable_rate = unavailable_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.sufficient_rate = sufficient_rate
+        self.sources_per_search = sources_per_search
+        self.grounding = list(grounding or [])
+        self.seed = seed
+        self.calls = 0
+        self.failures = 0
+        self._seen: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    # ModelBackend
+    def chat_model(self, model, temperature, schema=None, include_raw=False, timeout=None):
+        return FakeChatModel(self, model, schema, include_raw, timeout)
+
+    def search(self, model, prompt, timeout=None):
+        return self._search_response(prompt, self.call("search", model, prompt, timeout))
+
+    async def asearch(self, model, prompt, timeout=None):
+        return self._search_response(prompt, await self.acall("search", model, prompt, timeout))
+
+    # Latency and failure injection
+    def _draw(self, kind: str, model: str, prompt: str):
+        key = f"{kind}\x00{model}\x00{prompt}"
+        with self._lock:
+            attempt = self._seen.get(hash(key), 0)
+            self._seen[hash(key)] = attempt + 1
+            self.calls += 1
+        rng = random.Random(f"{self.seed}\x00{key}\x00{attempt}")
+        latency = (self.search_latency if kind == "search" else self.chat_latency).sample(rng)
+        roll = rng.random()
+        error = None
+        if roll < self.unavailable_rate:
+            error = FakeAPIError(503, "UNAVAILABLE: The model is overloaded.")
+        elif roll < self.unavailable_rate + self.rate_limit_rate:
+            error = FakeAPIError(429, "RESOURCE_EXHAUSTED: Quota exceeded.")
+        return rng, latency, error
+
+    def _fail(self, error: Optional[FakeAPIError]) -> None:
+        if error is not None:
+            with self._lock:
+                self.failures += 1
+            raise error
+
+    def call(self, kind: str, model: str, prompt: str, timeout: Optional[float] = None) -> random.Random:
+        """Simulate one blocking API call; returns the RNG for generating its response."""
+        rng, latency, error = self._draw(kind, model, prompt)
+        if timeout and latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"The fake {kind} request timed out after {timeout:g}s")
+        time.sleep(latency)
+        self._fail(error)
+        return rng
+
+    async def acall(self, kind: str, model: str, prompt: str, timeout: Optional[float] = None) -> random.Random:
+        """Async version of :meth:`call`."""
+        rng, latency, error = self._draw(kind, model, prompt)
+        if timeout and latency > timeout:
+            await asyncio.sleep(timeout)
+            raise TimeoutError(f"The fake {kind} request timed out after {timeout:g}s")
+        await asyncio.sleep(latency)
+        self._fail(error)
+        return rng
+
+    # Responses
+    def structured(self, schema, prompt: str, rng: random.Random):
+        topic = _topic(prompt)
+        if issubclass(schema, SearchQueryList):
+            match = re.search(r"more than (\d+) queries", prompt)
+            count = int(match.group(1)) if match else 1
+            aspects = rng.sample(_ASPECTS, min(count, len(_ASPECTS)))
+            return schema(
+                query=[f"{topic} {aspect}" for aspect in aspects],
+                rationale=f"Covers {len(aspects)} aspects of the question.",
+            )
+        if issubclass(schema, Reflection):
+            sufficient = rng.random() < self.sufficient_rate
+            follow_ups = [] if sufficient else [
+                f"{topic} {aspect}" for aspect in rng.sample(_ASPECTS, rng.randint(1, 3))
+            ]
+            fields = {
+                "is_sufficient": sufficient,
+                "knowledge_gap": "" if sufficient else f"More detail on {follow_ups[0]} is needed.",
+                "follow_up_queries": follow_ups,
+            }
+            if issubclass(schema, IncrementalReflection):
+                fields["findings_digest"] = f"- Findings about {topic} so far."
+            return schema(**fields)
+        raise TypeError(f"The fake backend has no canned output for {schema.__name__}")
+
+    def answer(self, prompt: str, rng: random.Random) -> str:
+        """Plain text answer that cites (some of) the short URLs in its prompt."""
+        topic = _topic(prompt)
+        urls = list(dict.fromkeys(_SHORT_URL_PATTERN.findall(prompt)))
+        sentences = []
+        for i in range(max(3, min(len(urls), 12))):
+            cited = rng.sample(urls, min(len(urls), 2)) if urls else []
+            links = "".join(f" [source{j}]({url})" for j, url in enumerate(cited))
+            sentences.append(f"Finding {i + 1} about {topic} is supported by the research.{links}")
+        paragraphs = [" ".join(sentences[i:i + 3]) for i in range(0, len(sentences), 3)]
+        return f"## {topic}\n\n" + "\n\n".join(paragraphs)
+
+    def grounding_payload(self, prompt: str, rng: random.Random) -> Dict[str, Any]:
+        """Search result text with one grounding support per sentence."""
+        if self.grounding:
+            return self.grounding[rng.randrange(len(self.grounding))]
+        topic = _topic(prompt)
+        slug = re.sub(r"\W+", "-", topic.lower()).strip("-")[:40] or "topic"
+        hosts = [f"source{rng.randrange(1000)}.example.com" for _ in range(self.sources_per_search)]
+        chunks = [
+            {"uri": f"https://{host}/{slug}/{i}", "title": host}
+            for i, host in enumerate(hosts)
+        ]
+        text, supports = "", []
+        for i in range(max(1, self.sources_per_search)):
+            sentence = f"Result {i + 1} on {topic} reports figure {rng.randrange(100, 999)}."
+            start = len(text)
+            text += sentence
+            indices = sorted({i % len(chunks), (i + 1) % len(chunks)}) if chunks else []
+            supports.append({"start_index": start, "end_index": len(text), "grounding_chunk_indices": indices})
+            text += " "
+        return {"text": text.strip(), "chunks": chunks, "supports": supports}
+
+    def _search_response(self, prompt: str, rng: random.Random):
+        payload = self.grounding_payload(prompt, rng)
+        response = response_from_payload(payload)
+        response.usage_metadata = SimpleNamespace(
+            prompt_token_count=len(prompt) // 4,
+            candidates_token_count=len(payload["text"]) // 4,
+            total_token_count=(len(prompt) + len(payload["text"])) // 4,
+        )
+        return response
+
+
+def load_grounding(path: str) -> List[Dict[str, Any]]:
+    """Read canned grounding payloads from a JSON list or a JSONL file."""
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read().strip()
+    if content.startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
@@ -12,13 +12,17 @@ from datetime import datetime
 from typing import Dict, List, Any, Optional
 
 from colorama import Fore, Back, Style, init as colorama_init
-from rich.console import Console
+from rich.console import Console, Group
 from rich.panel import Panel
 from rich.markdown import Markdown
+from rich.markup import escape
 from rich.table import Table
+from rich.live import Live
 from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TimeElapsedColumn
+from rich.spinner import Spinner
 from rich.syntax import Syntax
 from rich.box import Box, ROUNDED, DOUBLE, HEAVY
+from rich.text import Text
 from rich.theme import Theme
 
 # Initialize colorama
@@ -91,25 +95,11 @@ class OutputFormatter:
                                expand=False))
         self.console.print()
     
-    def display_progress(self, stage: str, duration=1.0):
-        """Display a progress indicator for the current stage."""
-        # Show a visually distinct stage header
-        self.console.print(f"[bold blue]▶ {stage}[/bold blue]")
-        
-        with Progress(
-            SpinnerColumn(),
-            TextColumn("[bold blue]{task.description}"),
-            BarColumn(bar_width=40, complete_style="cyan", finished_style="green"),
-            TimeElapsedColumn(),
-            console=self.console,
-            transient=True
-        ) as progress:
-            task = progress.add_task(f"[cyan]Processing...", total=100)
-            # Simulate progress
-            increment = 100 / (duration * 10)
-            for _ in range(10):
-                progress.update(task, advance=increment)
-                time.sleep(duration/10)
+    def research_progress(self, max_research_loops: int, consult_history: bool = False) -> "ResearchProgress":
+        """Return a live progress display to feed with graph stream updates."""
+        return ResearchProgress(
+            self.console, max_research_loops, self._process_text, consult_history
+        )
     
     def format_answer(self, answer_text: str) -> str:
         """Format the answer text with enhanced styling."""
@@ -235,6 +225,33 @@ class OutputFormatter:
             padding=(1, 2)
         ))
     
+    def display_history(self, hits: List[Dict[str, Any]], total: int):
+        """Display ranked research history matches in a table."""
+        if not hits:
+            self.console.print(f"[warning]No matching runs among {total} in the research history.[/warning]")
+            return
+        
+        table = Table(show_header=True, header_style="bold yellow", box=ROUNDED)
+        table.add_column("Run", style="dim", justify="right")
+        table.add_column("Date", style="timestamp", no_wrap=True)
+        table.add_column("Question", style="query", max_width=40)
+        table.add_column("Match", max_width=60)
+        table.add_column("Score", justify="right", style="info")
+        for hit in hits:
+            snippet = escape(hit["snippet"].replace("\n", " "))
+            snippet = snippet.replace("\x02", "[bold yellow]").replace("\x03", "[/bold yellow]")
+            table.add_row(
+                f"#{hit['id']}",
+                datetime.fromtimestamp(hit["created"]).strftime("%Y-%m-%d %H:%M"),
+                escape(hit["query"]),
+                snippet,
+                f"{hit['score']:.2f}",
+            )
+        self.console.print(table)
+        self.console.print(
+            f"[dim]{len(hits)} of {total} runs shown; open one with search-history --show RUN[/dim]"
+        )
+    
     def display_error(self, error_message: str):
         """Display an error message."""
         self.console.print(Panel(
@@ -244,15 +261,250 @@ class OutputFormatter:
             box=HEAVY
         ))
         
-    def display_completion(self, execution_time: float):
+    def display_completion(
+        self, execution_time: float, retries: int = 0, searches_saved: int = 0, hedges: int = 0, hedge_wins: int = 0
+    ):
         """Display completion information."""
+        notes = []
+        if retries:
+            notes.append(f"{retries} API retr{'y' if retries == 1 else 'ies'}")
+        if searches_saved:
+            notes.append(_plural(searches_saved, "duplicate search", "duplicate searches") + " skipped")
+        if hedges:
+            notes.append(_plural(hedges, "hedged search", "hedged searches") + f", {hedge_wins} won")
+        retry_note = f" ({', '.join(notes)})" if notes else ""
         self.console.print()
         self.console.print(Panel(
-            f"[success]Search completed in {execution_time:.2f} seconds[/success]", 
+            f"[success]Search completed in {execution_time:.2f} seconds{retry_note}[/success]", 
             border_style="green", 
             box=ROUNDED
         ))
 
+def _plural(count: int, singular: str, plural: str) -> str:
+    return f"{count} {singular if count == 1 else plural}"
+
+class ResearchProgress:
+    """Live view of a research run driven by ``graph.stream(..., stream_mode="updates")``.
+
+    Every streamed node update advances the display: the next stage is started
+    as soon as the previous one finishes, parallel web searches are counted as
+    they complete and each reflection loop gets its own line. Nothing sleeps;
+    the spinner only animates while real work is in flight. When the final
+    answer is streamed, the tail that fits the terminal is rendered below the
+    stages as it arrives, and the whole answer is printed once the live view
+    stops (re-rendering an answer taller than the terminal on every delta
+    would print it again each time).
+    """
+    
+    def __init__(
+        self, console: Console, max_research_loops: int, process_text=None, consult_history: bool = False
+    ):
+        self.console = console
+        self.max_research_loops = max_research_loops
+        self.consult_history = consult_history
+        self.steps: List[Dict[str, Any]] = []
+        self.loop = 0
+        self.answer = ""
+        self._process_text = process_text or (lambda text: text)
+        self._live = None
+        self._stopped = False
+    
+    def __enter__(self):
+        self._start_step(
+            "Consulting research history" if self.consult_history else "Generating search queries"
+        )
+        self._live = Live(
+            console=self.console,
+            get_renderable=self._render,
+            refresh_per_second=10,
+        )
+        self._live.__enter__()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.steps and self.steps[-1]["status"] == "running":
+            self.steps[-1]["status"] = "failed"
+        # The last live frame keeps only the stages; the answer follows in full
+        self._stopped = True
+        self._refresh()
+        self._live.__exit__(exc_type, exc, tb)
+        if self.answer:
+            self.console.print(self._answer_panel(self.answer))
+        return False
+    
+    def handle(self, update: Dict[str, Any]):
+        """Apply one ``updates`` stream chunk (``{node_name: state_update}``)."""
+        for node, value in (update or {}).items():
+            handler = getattr(self, f"_on_{node}", None)
+            if handler is not None:
+                handler(value or {})
+        self._refresh()
+    
+    def handle_custom(self, event: Dict[str, Any]):
+        """Apply one ``custom`` stream chunk, e.g. a streamed piece of the answer."""
+        if isinstance(event, dict) and event.get("answer_delta"):
+            self.answer += event["answer_delta"]
+            self._refresh()
+    
+    def resume(self, pending: List[str], research_loop_count: int):
+        """Pick up a run resumed from a checkpoint whose current step has ``pending`` tasks.
+
+        ``pending`` names every task of the step, including those that had
+        already finished: LangGraph streams their stored results again.
+        """
+        self.steps[-1]["label"] = "Resuming from checkpoint"
+        self._finish_step(_plural(research_loop_count, "research loop", "research loops") + " done")
+        self.loop = research_loop_count
+        if "web_research" in pending:
+            self._start_search_loop(pending.count("web_research"))
+        elif "reflection" in pending:
+            self.loop += 1
+            self._start_step(f"Reflecting on results (loop {self.loop})")
+        elif "finalize_answer" in pending:
+            self._start_step("Generating comprehensive answer")
+        elif "generate_query" in pending:
+            self._start_step("Generating search queries")
+        else:
+            self._start_step("Consulting research history")
+        self._refresh()
+    
+    def _on_consult_history(self, value: Dict[str, Any]):
+        matches = value.get("history_matches", [])
+        answered = [match for match in matches if match["mode"] == "answer"]
+        if answered:
+            self._finish_step(
+                f"answered by run #{answered[0]['id']} ({answered[0]['age_hours']:g}h old)"
+            )
+            return
+        if matches:
+            summaries = sum(match["summaries"] for match in matches)
+            self._finish_step(
+                f"{_plural(summaries, 'search', 'searches')} reused from "
+                f"{_plural(len(matches), 'past run', 'past runs')}"
+            )
+        else:
+            self._finish_step("no fresh match")
+        self._start_step("Generating search queries")
+    
+    def _on_generate_query(self, value: Dict[str, Any]):
+        queries = value.get("query_list", [])
+        detail = _plural(len(queries), "query", "queries")
+        covered = len(value.get("skipped_follow_up_queries", []))
+        if covered:
+            detail += f", {covered} covered by past runs"
+        self._finish_step(detail)
+        if queries:
+            self._start_search_loop(len(queries))
+        else:
+            self.loop += 1
+            self._start_step(f"Reflecting on results (loop {self.loop})")
+    
+    def _on_web_research(self, value: Dict[str, Any]):
+        current = self.steps[-1] if self.steps else None
+        if current is None or current.get("kind") != "search" or current["status"] != "running":
+            # Follow-up searches we didn't predict (e.g. a custom routing policy)
+            self._start_search_loop(0)
+            current = self.steps[-1]
+        current["done"] += 1
+        current["total"] = max(current["total"], current["done"])
+        failed = value.get("failed_searches", [])
+        current["dropped"] = current.get("dropped", 0) + len(failed)
+        queries = value.get("search_query", []) or [search["query"] for search in failed]
+        if queries:
+            current["last"] = queries[-1]
+        current["detail"] = f"{current['done']}/{current['total']} done"
+        if current["dropped"]:
+            current["detail"] += f", {current['dropped']} dropped"
+        if current["last"]:
+            current["detail"] += f" · {current['last'][:50]}"
+        if current["done"] >= current["total"]:
+            summary = _plural(current["done"], "search", "searches")
+            if current["dropped"]:
+                summary += f" ({current['dropped']} failed or timed out, dropped)"
+            self._finish_step(summary)
+            self._start_step(f"Reflecting on results (loop {self.loop})")
+    
+    def _on_reflection(self, value: Dict[str, Any]):
+        follow_ups = value.get("follow_up_queries", [])
+        loop = value.get("research_loop_count", self.loop)
+        stopped = [decision for decision in value.get("stopping_decisions", []) if decision["stop"]]
+        if stopped:
+            self._finish_step(f"stopped: {stopped[-1]['reason']}")
+        elif value.get("is_sufficient"):
+            self._finish_step("information is sufficient")
+        else:
+            detail = _plural(len(follow_ups), "follow-up query", "follow-up queries")
+            skipped = len(value.get("skipped_follow_up_queries", []))
+            if skipped:
+                detail += f", {skipped} duplicate{'' if skipped == 1 else 's'} skipped"
+            self._finish_step(detail)
+        # Mirrors evaluate_research: stop when sufficient or out of loops
+        if value.get("is_sufficient") or loop >= self.max_research_loops or not follow_ups:
+            self._start_step("Generating comprehensive answer")
+        else:
+            self._start_search_loop(len(follow_ups))
+    
+    def _on_finalize_answer(self, value: Dict[str, Any]):
+        current = self.steps[-1] if self.steps else None
+        if current is None or current["label"] != "Generating comprehensive answer":
+            self._start_step("Generating comprehensive answer")
+        self._finish_step(_plural(len(value.get("sources_gathered", [])), "source", "sources") + " cited")
+    
+    def _start_search_loop(self, total: int):
+        self.loop += 1
+        self._start_step(f"Executing web search (loop {self.loop})", kind="search", total=total)
+        self.steps[-1]["detail"] = f"0/{total} done"
+    
+    def _start_step(self, label: str, kind: str = "stage", total: int = 0):
+        self.steps.append({
+            "label": label, "kind": kind, "status": "running", "detail": "",
+            "done": 0, "total": total, "last": "", "started": time.time(),
+            "spinner": Spinner("dots", style="cyan"),
+        })
+    
+    def _finish_step(self, detail: str = ""):
+        if self.steps and self.steps[-1]["status"] == "running":
+            step = self.steps[-1]
+            step["status"] = "done"
+            step["detail"] = detail
+            step["elapsed"] = time.time() - step["started"]
+    
+    def _render(self):
+        grid = Table.grid(padding=(0, 1))
+        grid.add_column(width=2)
+        grid.add_column(style="bold blue")
+        grid.add_column(style="info")
+        grid.add_column(style="timestamp", justify="right")
+        for step in self.steps:
+            if step["status"] == "running":
+                icon = step["spinner"]
+                elapsed = time.time() - step["started"]
+            elif step["status"] == "failed":
+                icon = "[danger]✖[/danger]"
+                elapsed = time.time() - step["started"]
+            else:
+                icon = "[success]✔[/success]"
+                elapsed = step["elapsed"]
+            grid.add_row(icon, step["label"], step["detail"], f"{elapsed:.1f}s")
+        if not self.answer or self._stopped:
+            return grid
+        # Panel borders and the blank line take four rows
+        room = max(1, self.console.size.height - len(self.steps) - 4)
+        tail = "\n".join(self.answer.splitlines()[-room:])
+        return Group(grid, Text(""), self._answer_panel(tail))
+    
+    def _answer_panel(self, text: str) -> Panel:
+        return Panel(
+            Markdown(self._process_text(text)),
+            title="[bold]Search Results[/bold]",
+            border_style="green",
+            box=HEAVY,
+        )
+    
+    def _refresh(self):
+        if self._live is not None:
+            self._live.refresh()
+
 # Helper function for progress display
 def show_spinner(message: str, seconds: int = 1):
     """Show a spinner with a message for a specified number of seconds."""
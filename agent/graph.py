@@ -1,16 +1,20 @@
+import asyncio
+import contextvars
+import functools
+import itertools
 import os
 import time
-import re
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
-from agent.tools_and_schemas import SearchQueryList, Reflection
+from agent.tools_and_schemas import IncrementalReflection, SearchQueryList, Reflection
 from dotenv import load_dotenv
 from langchain_core.messages import AIMessage
+from langgraph.config import get_stream_writer
 from langgraph.types import Send
 from langgraph.graph import StateGraph
 from langgraph.graph import START, END
 from langchain_core.runnables import RunnableConfig
-from google.genai import Client
 
 from agent.state import (
     OverallState,
@@ -24,10 +28,40 @@ from agent.prompts import (
     query_writer_instructions,
     web_searcher_instructions,
     reflection_instructions,
+    incremental_reflection_instructions,
     answer_instructions,
+    partial_answer_instructions,
 )
-from langchain_google_genai import ChatGoogleGenerativeAI
+from agent.cache import (
+    cache_key,
+    get_web_research_cache,
+    payload_from_response,
+    response_from_payload,
+)
+from agent.backends import get_backend
+from agent.clients import get_genai_client
+from agent.dedup import deduplicate_queries
+from agent.hedging import get_hedger
+from agent.history import answer_update, get_research_history, seed_update
+from agent.metrics import call_span, current_node, get_run_metrics, node_span
+from agent.ratelimit import estimate_tokens, get_rate_limiter
+from agent.cassette import CassetteMissError
+from agent.retry import (
+    RetryPolicy,
+    acall_with_retry,
+    DeadlineExceededError,
+    RetryExhaustedError,
+    acall_with_timeout,
+    call_with_retry,
+    classify_error,
+    get_deadline,
+    get_retry_budget,
+)
+from agent.stopping import get_stopping_policy, research_signals
 from agent.utils import (
+    CITATION_PATTERN,
+    AnswerStreamRewriter,
+    expand_short_urls,
     get_citations,
     get_research_topic,
     insert_citation_markers,
@@ -36,18 +70,630 @@ from agent.utils import (
 
 load_dotenv()
 
-if os.getenv("GEMINI_API_KEY") is None:
-    raise ValueError("GEMINI_API_KEY is not set")
 
-# Used for Google Search API
-genai_client = Client(api_key=os.getenv("GEMINI_API_KEY"))
+# Per-run resources are looked up once per (immutable, hashable) configuration
+@functools.lru_cache(maxsize=64)
+def _retry_policy(configurable: Configuration) -> RetryPolicy:
+    return RetryPolicy(
+        max_retries=configurable.max_retries,
+        base_delay=configurable.retry_base_delay,
+    )
+
+
+def _backend(configurable: Configuration):
+    return get_backend(configurable.model_backend)
+
+
+@functools.lru_cache(maxsize=64)
+def _rate_limiter(configurable: Configuration):
+    return get_rate_limiter(
+        configurable.max_concurrent_requests,
+        configurable.requests_per_minute,
+        configurable.tokens_per_minute,
+        configurable.rate_limits,
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def _web_research_hedger(configurable: Configuration):
+    if not configurable.hedge_web_research:
+        return None
+    return get_hedger(
+        f"{configurable.model_backend}/web_research/{configurable.query_generator_model}",
+        configurable.hedge_percentile,
+        configurable.hedge_budget,
+    )
+
+
+def _session_id(config: RunnableConfig) -> str:
+    return str((config or {}).get("configurable", {}).get("thread_id", ""))
+
+
+def _token_usage(result):
+    """Prompt and completion tokens of a model response (None when not reported)."""
+    if isinstance(result, dict):
+        # Structured output with include_raw
+        result = result.get("raw")
+    usage = getattr(result, "usage_metadata", None)
+    if isinstance(usage, dict):
+        # langchain messages
+        return usage.get("input_tokens"), usage.get("output_tokens")
+    # google.genai responses
+    return (
+        getattr(usage, "prompt_token_count", None),
+        getattr(usage, "candidates_token_count", None),
+    )
+
+
+def _usage_tokens(result) -> Optional[int]:
+    """Actual token count of a model response, when the response reports one."""
+    prompt_tokens, completion_tokens = _token_usage(result)
+    if prompt_tokens is None and completion_tokens is None:
+        return None
+    return (prompt_tokens or 0) + (completion_tokens or 0)
+
+
+def _response_bytes(result) -> Optional[int]:
+    if isinstance(result, dict):
+        result = result.get("raw")
+    if hasattr(result, "model_dump_json"):
+        # Structured output without the raw message
+        return len(result.model_dump_json().encode("utf-8"))
+    text = getattr(result, "text", None)
+    if text is None and hasattr(result, "content"):
+        text = _chunk_text(result)
+    return len(text.encode("utf-8")) if isinstance(text, str) else None
+
+
+def _record_call(call, result) -> None:
+    if call is not None:
+        call.prompt_tokens, call.completion_tokens = _token_usage(result)
+        call.response_bytes = _response_bytes(result)
+
+
+def _record_queue_wait(call, started=None):
+    # ``started`` tells a hedger that the request left the queue and is being sent
+    def on_permit(permit):
+        if call is not None:
+            call.attempts += 1
+            call.queue_wait_seconds += permit.queue_wait
+        if started is not None:
+            started()
+    return on_permit
+
+
+def _record_hedge(call):
+    def on_hedge(outcome):
+        if call is not None:
+            call.hedge = outcome
+    return on_hedge
+
+
+def _call_timeout(configurable: Configuration, deadline, label: str) -> Optional[float]:
+    """Timeout of the next attempt (None for none); raises once the run deadline has passed."""
+    if deadline is None:
+        return configurable.call_timeout_seconds or None
+    deadline.check(label)
+    return deadline.timeout(configurable.call_timeout_seconds)
+
+
+def _chat_timeout(configurable: Configuration) -> Optional[float]:
+    # Chat models are shared across runs, so their HTTP timeout can't follow a run's deadline
+    return configurable.call_timeout_seconds or None
+
+
+def _call_with_retry(fn, config: RunnableConfig, configurable: Configuration, label: str, model: str, prompt: str,
+                     hedger=None, within_deadline: bool = True):
+    """Run a Gemini API call under the configured retry policy and run budget.
+
+    Every attempt waits for a permit from the process-wide rate limiter first.
+    The call itself is bounded by the HTTP timeout of the backend request
+    (``call_timeout_seconds``), so an abandoned attempt doesn't run on in the
+    background. Unless ``within_deadline`` is False, waiting for a permit,
+    starting an attempt and retrying also stop at the run deadline. With a
+    ``hedger``, a slow attempt gets a duplicate (see :mod:`agent.hedging`).
+    """
+    limiter = _rate_limiter(configurable)
+    tokens = estimate_tokens(prompt)
+    deadline = get_deadline(config) if within_deadline else None
+
+    with call_span(label, model) as call:
+        def checked():
+            if deadline is not None:
+                deadline.check(label)
+            return fn()
+
+        def limited(started=None):
+            return limiter.call(
+                checked, model, tokens, _session_id(config), configurable.scheduling_priority,
+                label, _usage_tokens, _record_queue_wait(call, started), deadline,
+            )
+
+        attempt = limited
+        if hedger is not None:
+            attempt = lambda: hedger.call(limited, _record_hedge(call))
+        result = call_with_retry(
+            attempt, _retry_policy(configurable), get_retry_budget(config), label, deadline=deadline
+        )
+        _record_call(call, result)
+    return result
+
+
+async def _acall_with_retry(fn, config: RunnableConfig, configurable: Configuration, label: str, model: str, prompt: str,
+                            hedger=None, within_deadline: bool = True):
+    """Async version of :func:`_call_with_retry`.
+
+    A task can be cancelled, so here an attempt is also cut off when the run
+    deadline passes while it is in flight.
+    """
+    limiter = _rate_limiter(configurable)
+    tokens = estimate_tokens(prompt)
+    deadline = get_deadline(config) if within_deadline else None
+
+    with call_span(label, model) as call:
+        def timed():
+            return acall_with_timeout(fn, _call_timeout(configurable, deadline, label))
+
+        def limited(started=None):
+            return limiter.acall(
+                timed, model, tokens, _session_id(config), configurable.scheduling_priority,
+                label, _usage_tokens, _record_queue_wait(call, started), deadline,
+            )
+
+        attempt = limited
+        if hedger is not None:
+            attempt = lambda: hedger.acall(limited, _record_hedge(call))
+        result = await acall_with_retry(
+            attempt, _retry_policy(configurable), get_retry_budget(config), label, deadline=deadline
+        )
+        _record_call(call, result)
+    return result
+
+
+# Prompt building and response handling shared by the sync and async nodes
+def _query_prompt(state: OverallState, configurable: Configuration) -> str:
+    # check for custom initial search query count
+    if state.get("initial_search_query_count") is None:
+        state["initial_search_query_count"] = configurable.number_of_initial_queries
+
+    return query_writer_instructions.format(
+        current_date=get_current_date(),
+        research_topic=get_research_topic(state["messages"]),
+        number_queries=state["initial_search_query_count"],
+    )
+
+
+def _web_research_prompt(state: WebSearchState) -> str:
+    return web_searcher_instructions.format(
+        current_date=get_current_date(),
+        research_topic=state["search_query"],
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def _research_cache(configurable: Configuration):
+    """The web research cache and the model name in its keys, or ``(None, None)`` when off."""
+    if not configurable.web_research_cache:
+        return None, None
+    cache = get_web_research_cache(
+        configurable.web_research_cache_path,
+        configurable.web_research_cache_ttl_hours,
+        configurable.web_research_cache_max_mb,
+    )
+    model = configurable.query_generator_model
+    if configurable.model_backend != "gemini":
+        # Results of other backends must never be served to a Gemini run
+        model = f"{configurable.model_backend}/{model}"
+    return cache, model
+
+
+def _web_research_cache_lookup(state: WebSearchState, configurable: Configuration):
+    """Return ``(cache, key, payload)``; payload is None on a miss or when caching is off."""
+    cache, model = _research_cache(configurable)
+    if cache is None:
+        return None, None, None
+    key = cache_key(state["search_query"], model)
+    return cache, key, cache.get(key)
+
+
+def _mark_cached() -> None:
+    record = current_node()
+    if record is not None:
+        record.attributes["cached"] = True
+
+
+def _web_research_update(state: WebSearchState, response) -> OverallState:
+    # resolve the urls to short urls for saving tokens and time
+    resolved_urls = resolve_urls(
+        response.candidates[0].grounding_metadata.grounding_chunks, state["id"]
+    )
+    # Gets the citations and adds them to the generated text
+    citations = get_citations(response, resolved_urls)
+    modified_text = insert_citation_markers(response.text, citations)
+    sources_gathered = [item for citation in citations for item in citation["segments"]]
+
+    return {
+        "sources_gathered": sources_gathered,
+        "search_query": [state["search_query"]],
+        "web_research_result": [modified_text],
+    }
+
+
+def _dropped_update(state: WebSearchState, error: Exception) -> OverallState:
+    # The branch ends without a result; reflection and the answer go on with the others
+    message = f"{type(error).__name__}: {error}"
+    record = current_node()
+    if record is not None:
+        record.attributes["dropped"] = message
+    return {"failed_searches": [{"query": state["search_query"], "error": message}]}
+
+
+def _drops_failure(error: Exception, configurable: Configuration) -> bool:
+    """Whether a failed search is dropped: only transient API failures and timeouts are.
+
+    Anything else (a bad request, an auth error, a bug, or a replay that
+    misses its cassette) fails the run as before.
+    """
+    if not configurable.drop_failed_searches or isinstance(error, CassetteMissError):
+        return False
+    return (
+        isinstance(error, (RetryExhaustedError, DeadlineExceededError, TimeoutError))
+        or classify_error(error) is not None
+    )
+
+
+def _launched_searches(state: OverallState) -> int:
+    # Dropped searches used up their ids too, so follow-up ids never repeat one
+    return len(state["search_query"]) + len(state.get("failed_searches") or [])
+
+
+def _reflection_prompt(state: OverallState, configurable: Configuration) -> str:
+    # Increment the research loop count
+    state["research_loop_count"] = state.get("research_loop_count", 0) + 1
+    if configurable.incremental_reflection:
+        # Only the results that arrived since the last reflection, plus the running digest
+        new_results = state["web_research_result"][state.get("reflected_result_count") or 0:]
+        return incremental_reflection_instructions.format(
+            current_date=get_current_date(),
+            research_topic=get_research_topic(state["messages"]),
+            digest=state.get("research_digest") or "No findings yet.",
+            summaries="\n\n---\n\n".join(new_results),
+        )
+    return reflection_instructions.format(
+        current_date=get_current_date(),
+        research_topic=get_research_topic(state["messages"]),
+        summaries="\n\n---\n\n".join(state["web_research_result"]),
+    )
+
+
+def _max_research_loops(state: OverallState, configurable: Configuration) -> int:
+    if state.get("max_research_loops") is not None:
+        return state["max_research_loops"]
+    return configurable.max_research_loops
+
+
+def _stopping_decision(state: OverallState, config: RunnableConfig, configurable: Configuration) -> dict:
+    """Signals of the loop that just finished and whether the research stops here."""
+    metrics = get_run_metrics(config)
+    elapsed = tokens = None
+    unreported = 0
+    if metrics is not None:
+        elapsed = time.time() - metrics.started
+        # Calls without usage are left out rather than disabling the token budget
+        tokens, unreported = metrics.reported_tokens()
+    signals = research_signals(state, elapsed, tokens, unreported)
+    deadline = get_deadline(config)
+    if signals["loop"] >= _max_research_loops(state, configurable):
+        # evaluate_research finalizes anyway, so the reflection would be wasted
+        reason = "research loop limit reached"
+    elif deadline is not None and deadline.expired():
+        reason = f"the {deadline.seconds:g}s run deadline passed"
+    elif deadline is not None and (signals["seconds_per_loop"] or 0) > deadline.remaining():
+        reason = f"another loop would pass the {deadline.seconds:g}s run deadline"
+    else:
+        reason = get_stopping_policy(configurable.stopping_policy).should_stop(signals, configurable)
+    decision = {
+        "policy": configurable.stopping_policy,
+        "stop": reason is not None,
+        "reason": reason,
+        **signals,
+    }
+    record = current_node()
+    if record is not None:
+        record.attributes["stopping"] = decision
+    return decision
+
+
+def _stopped_update(state: OverallState, decision: dict) -> ReflectionState:
+    # No follow-up queries: evaluate_research goes on to the final answer
+    return {
+        "is_sufficient": False,
+        "knowledge_gap": "",
+        "follow_up_queries": [],
+        "research_loop_count": state["research_loop_count"],
+        "number_of_ran_queries": _launched_searches(state),
+        "reflected_result_count": len(state["web_research_result"]),
+        "stopping_decisions": [decision],
+    }
+
+
+def _parsed(output: dict, what: str):
+    """The parsed structured output of an include_raw call."""
+    if output["parsed"] is None:
+        raise output.get("parsing_error") or ValueError(f"Could not parse the {what} output.")
+    return output["parsed"]
+
+
+def _reflection_model(reasoning_model: str, configurable: Configuration):
+    schema = IncrementalReflection if configurable.incremental_reflection else Reflection
+    # include_raw to get at the token usage of the call
+    return _backend(configurable).chat_model(
+        reasoning_model, 1.0, schema, include_raw=True, timeout=_chat_timeout(configurable)
+    )
+
+
+def _reflection_update(
+    state: OverallState, output: dict, prompt: str, configurable: Configuration, decision: dict
+) -> ReflectionState:
+    result = _parsed(output, "reflection")
+
+    usage = getattr(output["raw"], "usage_metadata", None) or {}
+    new_results = len(state["web_research_result"]) - (
+        (state.get("reflected_result_count") or 0) if configurable.incremental_reflection else 0
+    )
+    follow_up_queries, skipped = result.follow_up_queries, []
+    if configurable.dedup_follow_up_queries and not result.is_sufficient:
+        follow_up_queries, skipped = deduplicate_queries(
+            result.follow_up_queries,
+            state["search_query"],
+            configurable.follow_up_dedup_threshold,
+        )
+        for record in skipped:
+            record["loop"] = state["research_loop_count"]
+    update = {
+        "is_sufficient": result.is_sufficient,
+        "knowledge_gap": result.knowledge_gap,
+        "follow_up_queries": follow_up_queries,
+        "skipped_follow_up_queries": skipped,
+        "research_loop_count": state["research_loop_count"],
+        "number_of_ran_queries": _launched_searches(state),
+        "reflected_result_count": len(state["web_research_result"]),
+        "stopping_decisions": [decision],
+        "reflection_usage": [{
+            "loop": state["research_loop_count"],
+            "mode": "incremental" if configurable.incremental_reflection else "full",
+            "summaries": new_results,
+            "prompt_chars": len(prompt),
+            "input_tokens": usage.get("input_tokens"),
+            "output_tokens": usage.get("output_tokens"),
+        }],
+    }
+    if configurable.incremental_reflection:
+        digest = result.findings_digest.strip()
+        if result.knowledge_gap:
+            digest += f"\n\nOpen knowledge gap: {result.knowledge_gap}"
+        update["research_digest"] = digest
+    return update
+
+
+def _answer_prompt(state: OverallState, summaries: Optional[list] = None) -> str:
+    return answer_instructions.format(
+        current_date=get_current_date(),
+        research_topic=get_research_topic(state["messages"]),
+        summaries="\n---\n\n".join(
+            state["web_research_result"] if summaries is None else summaries
+        ),
+    )
+
+
+def _answer_groups(state: OverallState, configurable: Configuration) -> Optional[list]:
+    """Split the research results into groups for the map step, or None to skip it."""
+    size = configurable.answer_group_size
+    results = state["web_research_result"]
+    if size <= 0 or len(results) <= size:
+        return None
+    return [results[i:i + size] for i in range(0, len(results), size)]
+
+
+def _partial_answer_prompt(state: OverallState, group: list) -> str:
+    return partial_answer_instructions.format(
+        current_date=get_current_date(),
+        research_topic=get_research_topic(state["messages"]),
+        summaries="\n---\n\n".join(group),
+    )
+
+
+def _condense_research(state: OverallState, config: RunnableConfig, configurable: Configuration) -> Optional[list]:
+    """Map step: condense groups of results into cited partial answers in parallel."""
+    groups = _answer_groups(state, configurable)
+    if groups is None:
+        return None
+    # The cheap query generator model is enough to condense summaries
+    llm = _backend(configurable).chat_model(
+        configurable.query_generator_model, 0, timeout=_chat_timeout(configurable)
+    )
+
+    def condense(group):
+        prompt = _partial_answer_prompt(state, group)
+        result = _call_with_retry(
+            lambda: llm.invoke(prompt),
+            config,
+            configurable,
+            "finalize_answer.map",
+            configurable.query_generator_model,
+            prompt,
+            within_deadline=False,
+        )
+        return _chunk_text(result)
+
+    with ThreadPoolExecutor(max_workers=max(1, configurable.answer_map_parallelism)) as pool:
+        # Each worker runs in a copy of this context so its calls are recorded on this node
+        futures = [
+            pool.submit(contextvars.copy_context().run, condense, group) for group in groups
+        ]
+        return [future.result() for future in futures]
+
+
+async def _acondense_research(state: OverallState, config: RunnableConfig, configurable: Configuration) -> Optional[list]:
+    """Async version of :func:`_condense_research`."""
+    groups = _answer_groups(state, configurable)
+    if groups is None:
+        return None
+    llm = _backend(configurable).chat_model(
+        configurable.query_generator_model, 0, timeout=_chat_timeout(configurable)
+    )
+    semaphore = asyncio.Semaphore(max(1, configurable.answer_map_parallelism))
+
+    async def condense(group):
+        prompt = _partial_answer_prompt(state, group)
+        async with semaphore:
+            result = await _acall_with_retry(
+                lambda: llm.ainvoke(prompt),
+                config,
+                configurable,
+                "finalize_answer.map",
+                configurable.query_generator_model,
+                prompt,
+                within_deadline=False,
+            )
+        return _chunk_text(result)
+
+    return list(await asyncio.gather(*(condense(group) for group in groups)))
+
+
+def _answer_update(state: OverallState, result) -> OverallState:
+    # Remove citations from the final answer
+    result.content = CITATION_PATTERN.sub("", result.content)
+    # Replace the short urls with the original urls in one scan and collect the used sources
+    result.content, unique_sources = expand_short_urls(
+        result.content, state["sources_gathered"]
+    )
+
+    return {
+        "messages": [AIMessage(content=result.content)],
+        "sources_gathered": unique_sources,
+    }
+
+
+def _chunk_text(chunk) -> str:
+    content = chunk.content
+    if isinstance(content, str):
+        return content
+    return "".join(
+        part.get("text", "") if isinstance(part, dict) else str(part) for part in content
+    )
+
+
+def _start_stream(stream):
+    """Pull the first chunk so connection errors surface inside the retry loop."""
+    first = next(stream)
+    return itertools.chain([first], stream)
+
+
+async def _astart_stream(stream):
+    first = await stream.__anext__()
+
+    async def chained():
+        yield first
+        async for chunk in stream:
+            yield chunk
+
+    return chained()
+
+
+class _AnswerStream:
+    """Cleans up streamed answer text on the fly and emits it as ``answer_delta`` events."""
+
+    def __init__(self, state: OverallState):
+        self.rewriter = AnswerStreamRewriter(state["sources_gathered"])
+        self.writer = get_stream_writer()
+        self.parts = []
+        # The chunks merged into one message, which adds up their usage
+        self.message = None
+
+    def add(self, chunk):
+        self.message = chunk if self.message is None else self.message + chunk
+        self.feed(_chunk_text(chunk))
+
+    def feed(self, text: str, final: bool = False):
+        delta = self.rewriter.feed(text)
+        if final:
+            delta += self.rewriter.flush()
+        if delta:
+            self.parts.append(delta)
+            self.writer({"answer_delta": delta})
+
+    def update(self) -> OverallState:
+        record = current_node()
+        if record is not None and record.calls:
+            # The call record was closed when the stream started
+            call = record.calls[-1]
+            call.prompt_tokens, call.completion_tokens = _token_usage(self.message)
+            call.response_bytes = sum(len(part.encode("utf-8")) for part in self.parts)
+        return {
+            "messages": [AIMessage(content="".join(self.parts))],
+            "sources_gathered": self.rewriter.used_sources(),
+        }
+
+
+def _consult_history(state: OverallState, configurable: Configuration) -> OverallState:
+    decision = get_research_history(configurable.research_history_path).consult(
+        get_research_topic(state["messages"]),
+        configurable.history_max_age_hours,
+        configurable.history_answer_threshold,
+        configurable.history_seed_threshold,
+        _max_research_loops(state, configurable),
+    )
+    if "answer" in decision:
+        return answer_update(decision["answer"])
+    return seed_update(decision["seed"])
+
+
+def _query_model(configurable: Configuration):
+    # include_raw so the call's token usage is recorded like the reflection's
+    return _backend(configurable).chat_model(
+        configurable.query_generator_model, 1.0, SearchQueryList, include_raw=True,
+        timeout=_chat_timeout(configurable),
+    )
+
+
+def _query_update(state: OverallState, queries: list, configurable: Configuration) -> QueryGenerationState:
+    seeded = state.get("search_query") or []
+    if not seeded or not configurable.dedup_follow_up_queries:
+        return {"query_list": queries}
+    # Searches seeded from the research history are not run again
+    kept, skipped = deduplicate_queries(queries, seeded, configurable.follow_up_dedup_threshold)
+    for record in skipped:
+        record["loop"] = 0
+    return {"query_list": kept, "skipped_follow_up_queries": skipped}
 
-# Maximum number of retries for API calls
-MAX_RETRIES = 3
-# Delay between retries (in seconds)
-RETRY_DELAY = 5
 
 # Nodes
+def consult_history(state: OverallState, config: RunnableConfig) -> OverallState:
+    """LangGraph node that looks up fresh prior runs of similar questions.
+
+    A prior run of practically the same question (and at least as many research
+    loops) answers the question directly; otherwise the searches of similar
+    prior runs are added to the state as if this run had made them.
+
+    Args:
+        state: Current graph state containing the User's question
+        config: Configuration for the runnable, including the history settings
+
+    Returns:
+        Dictionary with state update: the answer, or the seeded search queries,
+        results and sources, plus the history_matches that were used
+    """
+    return _consult_history(state, Configuration.from_runnable_config(config))
+
+
+async def aconsult_history(state: OverallState, config: RunnableConfig) -> OverallState:
+    """Async version of :func:`consult_history`; the lookup runs in a worker thread."""
+    return await asyncio.to_thread(
+        _consult_history, state, Configuration.from_runnable_config(config)
+    )
+
+
 def generate_query(state: OverallState, config: RunnableConfig) -> QueryGenerationState:
     """LangGraph node that generates a search queries based on the User's question.
 
@@ -62,63 +708,61 @@ def generate_query(state: OverallState, config: RunnableConfig) -> QueryGenerati
         Dictionary with state update, including search_query key containing the generated query
     """
     configurable = Configuration.from_runnable_config(config)
+    formatted_prompt = _query_prompt(state, configurable)
 
-    # check for custom initial search query count
-    if state.get("initial_search_query_count") is None:
-        state["initial_search_query_count"] = configurable.number_of_initial_queries
+    # Gemini 2.0 Flash, shared across calls and retries
+    structured_llm = _query_model(configurable)
+    # Generate the search queries
+    output = _call_with_retry(
+        lambda: structured_llm.invoke(formatted_prompt),
+        config,
+        configurable,
+        "generate_query",
+        configurable.query_generator_model,
+        formatted_prompt,
+    )
+    return _query_update(state, _parsed(output, "query list").query, configurable)
 
-    # Format the prompt
-    current_date = get_current_date()
-    formatted_prompt = query_writer_instructions.format(
-        current_date=current_date,
-        research_topic=get_research_topic(state["messages"]),
-        number_queries=state["initial_search_query_count"],
+
+async def agenerate_query(state: OverallState, config: RunnableConfig) -> QueryGenerationState:
+    """Async version of :func:`generate_query`."""
+    configurable = Configuration.from_runnable_config(config)
+    formatted_prompt = _query_prompt(state, configurable)
+
+    structured_llm = _query_model(configurable)
+    output = await _acall_with_retry(
+        lambda: structured_llm.ainvoke(formatted_prompt),
+        config,
+        configurable,
+        "generate_query",
+        configurable.query_generator_model,
+        formatted_prompt,
     )
-    
-    # Add retry logic for API calls
-    retries = 0
-    result = None
-    
-    while retries <= MAX_RETRIES:
-        try:
-            # init Gemini 2.0 Flash
-            llm = ChatGoogleGenerativeAI(
-                model=configurable.query_generator_model,
-                temperature=1.0,
-                max_retries=2,
-                api_key=os.getenv("GEMINI_API_KEY"),
-            )
-            structured_llm = llm.with_structured_output(SearchQueryList)
-            
-            # Generate the search queries
-            result = structured_llm.invoke(formatted_prompt)
-            break  # Success, exit the retry loop
-        except Exception as e:
-            error_message = str(e)
-            retries += 1
-            
-            # Check if it's a server overload error (503)
-            if "503 UNAVAILABLE" in error_message and "model is overloaded" in error_message:
-                if retries <= MAX_RETRIES:
-                    print(f"Gemini API is overloaded. Retrying ({retries}/{MAX_RETRIES}) in {RETRY_DELAY} seconds...")
-                    time.sleep(RETRY_DELAY * retries)  # Exponential backoff
-                else:
-                    raise Exception(f"Gemini API is overloaded after {MAX_RETRIES} retries. Please try again later.")
-            else:
-                # For other errors, don't retry
-                raise
-    
-    if result is None:
-        raise Exception("Failed to get a response from the Gemini API.")
-        
-    return {"query_list": result.query}
+    return _query_update(state, _parsed(output, "query list").query, configurable)
+
+
+def start_research(state: OverallState, config: RunnableConfig) -> str:
+    """LangGraph routing function that consults the research history first when enabled."""
+    if Configuration.from_runnable_config(config).consult_history:
+        return "consult_history"
+    return "generate_query"
+
+
+def after_history(state: OverallState) -> str:
+    """LangGraph routing function that ends the run when the history answered it."""
+    if any(match["mode"] == "answer" for match in state.get("history_matches") or []):
+        return END
+    return "generate_query"
 
 
 def continue_to_web_research(state: QueryGenerationState):
     """LangGraph node that sends the search queries to the web research node.
 
     This is used to spawn n number of web research nodes, one for each search query.
+    When the research history already covered every query, it goes straight to reflection.
     """
+    if not state["query_list"]:
+        return "reflection"
     return [
         Send("web_research", {"search_query": search_query, "id": int(idx)})
         for idx, search_query in enumerate(state["query_list"])
@@ -135,63 +779,78 @@ def web_research(state: WebSearchState, config: RunnableConfig) -> OverallState:
         config: Configuration for the runnable, including search API settings
 
     Returns:
-        Dictionary with state update, including sources_gathered, research_loop_count, and web_research_results
+        Dictionary with state update, including sources_gathered, research_loop_count, and web_research_results.
+        A search that still fails after its retries, or runs out of time, only adds to failed_searches
+        when drop_failed_searches is on, so the run goes on with the other branches.
     """
     # Configure
     configurable = Configuration.from_runnable_config(config)
-    formatted_prompt = web_searcher_instructions.format(
-        current_date=get_current_date(),
-        research_topic=state["search_query"],
-    )
+    formatted_prompt = _web_research_prompt(state)
 
-    # Add retry logic for API calls
-    retries = 0
-    response = None
-    
-    while retries <= MAX_RETRIES:
-        try:
-            # Uses the google genai client as the langchain client doesn't return grounding metadata
-            response = genai_client.models.generate_content(
-                model=configurable.query_generator_model,
-                contents=formatted_prompt,
-                config={
-                    "tools": [{"google_search": {}}],
-                    "temperature": 0,
-                },
-            )
-            break  # Success, exit the retry loop
-        except Exception as e:
-            error_message = str(e)
-            retries += 1
-            
-            # Check if it's a server overload error (503)
-            if "503 UNAVAILABLE" in error_message and "model is overloaded" in error_message:
-                if retries <= MAX_RETRIES:
-                    print(f"Gemini API is overloaded. Retrying ({retries}/{MAX_RETRIES}) in {RETRY_DELAY} seconds...")
-                    time.sleep(RETRY_DELAY * retries)  # Exponential backoff
-                else:
-                    raise Exception(f"Gemini API is overloaded after {MAX_RETRIES} retries. Please try again later.")
-            else:
-                # For other errors, don't retry
-                raise
-    
-    if response is None:
-        raise Exception("Failed to get a response from the Gemini API.")
-        
-    # resolve the urls to short urls for saving tokens and time
-    resolved_urls = resolve_urls(
-        response.candidates[0].grounding_metadata.grounding_chunks, state["id"]
-    )
-    # Gets the citations and adds them to the generated text
-    citations = get_citations(response, resolved_urls)
-    modified_text = insert_citation_markers(response.text, citations)
-    sources_gathered = [item for citation in citations for item in citation["segments"]]
+    # Reuse a fresh cached result for the same query if there is one
+    cache, key, payload = _web_research_cache_lookup(state, configurable)
+    if payload is not None:
+        # Cache hit: skip the network call, short urls are resolved for this run's id below
+        _mark_cached()
+        return _web_research_update(state, response_from_payload(payload))
 
-    return {
-        "sources_gathered": sources_gathered,
-        "search_query": [state["search_query"]],
-        "web_research_result": [modified_text],
-    }
+    # Grounded Google Search through the configured backend
+    backend = _backend(configurable)
+    deadline = get_deadline(config)
+    try:
+        response = _call_with_retry(
+            lambda: backend.search(
+                configurable.query_generator_model,
+                formatted_prompt,
+                _call_timeout(configurable, deadline, "web_research"),
+            ),
+            config,
+            configurable,
+            "web_research",
+            configurable.query_generator_model,
+            formatted_prompt,
+            _web_research_hedger(configurable),
+        )
+    except Exception as e:
+        if not _drops_failure(e, configurable):
+            raise
+        return _dropped_update(state, e)
+    if cache is not None:
+        cache.put(key, payload_from_response(response))
+
+    return _web_research_update(state, response)
+
+
+async def aweb_research(state: WebSearchState, config: RunnableConfig) -> OverallState:
+    """Async version of :func:`web_research` using the backend's async search."""
+    configurable = Configuration.from_runnable_config(config)
+    formatted_prompt = _web_research_prompt(state)
+
+    # The cache is a SQLite database: keep its reads and writes off the event loop
+    cache, key, payload = await asyncio.to_thread(_web_research_cache_lookup, state, configurable)
+    if payload is not None:
+        _mark_cached()
+        return _web_research_update(state, response_from_payload(payload))
+
+    backend = _backend(configurable)
+    try:
+        response = await _acall_with_retry(
+            lambda: backend.asearch(configurable.query_generator_model, formatted_prompt),
+            config,
+            configurable,
+            "web_research",
+            configurable.query_generator_model,
+            formatted_prompt,
+            _web_research_hedger(configurable),
+        )
+    except Exception as e:
+        if not _drops_failure(e, configurable):
+            raise
+        return _dropped_update(state, e)
+    if cache is not None:
+        await asyncio.to_thread(cache.put, key, payload_from_response(response))
+
+    return _web_research_update(state, response)
 
 
 def reflection(state: OverallState, config: RunnableConfig) -> ReflectionState:
@@ -199,7 +858,8 @@ def reflection(state: OverallState, config: RunnableConfig) -> ReflectionState:
 
     Analyzes the current summary to identify areas for further research and generates
     potential follow-up queries. Uses structured output to extract
-    the follow-up query in JSON format.
+    the follow-up query in JSON format. The stopping policy sees the latest
+    loop's signals first; when it ends the research, the model isn't called.
 
     Args:
         state: Current graph state containing the running summary and research topic
@@ -209,58 +869,44 @@ def reflection(state: OverallState, config: RunnableConfig) -> ReflectionState:
         Dictionary with state update, including search_query key containing the generated follow-up query
     """
     configurable = Configuration.from_runnable_config(config)
-    # Increment the research loop count and get the reasoning model
-    state["research_loop_count"] = state.get("research_loop_count", 0) + 1
     reasoning_model = state.get("reasoning_model") or configurable.reasoning_model
+    formatted_prompt = _reflection_prompt(state, configurable)
+    decision = _stopping_decision(state, config, configurable)
+    if decision["stop"]:
+        return _stopped_update(state, decision)
 
-    # Format the prompt
-    current_date = get_current_date()
-    formatted_prompt = reflection_instructions.format(
-        current_date=current_date,
-        research_topic=get_research_topic(state["messages"]),
-        summaries="\n\n---\n\n".join(state["web_research_result"]),
+    # Reasoning Model, shared across calls and retries
+    llm = _reflection_model(reasoning_model, configurable)
+    output = _call_with_retry(
+        lambda: llm.invoke(formatted_prompt),
+        config,
+        configurable,
+        "reflection",
+        reasoning_model,
+        formatted_prompt,
     )
-    
-    # Add retry logic for API calls
-    retries = 0
-    result = None
-    
-    while retries <= MAX_RETRIES:
-        try:
-            # init Reasoning Model
-            llm = ChatGoogleGenerativeAI(
-                model=reasoning_model,
-                temperature=1.0,
-                max_retries=2,
-                api_key=os.getenv("GEMINI_API_KEY"),
-            )
-            result = llm.with_structured_output(Reflection).invoke(formatted_prompt)
-            break  # Success, exit the retry loop
-        except Exception as e:
-            error_message = str(e)
-            retries += 1
-            
-            # Check if it's a server overload error (503)
-            if "503 UNAVAILABLE" in error_message and "model is overloaded" in error_message:
-                if retries <= MAX_RETRIES:
-                    print(f"Gemini API is overloaded. Retrying ({retries}/{MAX_RETRIES}) in {RETRY_DELAY} seconds...")
-                    time.sleep(RETRY_DELAY * retries)  # Exponential backoff
-                else:
-                    raise Exception(f"Gemini API is overloaded after {MAX_RETRIES} retries. Please try again later.")
-            else:
-                # For other errors, don't retry
-                raise
-    
-    if result is None:
-        raise Exception("Failed to get a response from the Gemini API.")
+    return _reflection_update(state, output, formatted_prompt, configurable, decision)
 
-    return {
-        "is_sufficient": result.is_sufficient,
-        "knowledge_gap": result.knowledge_gap,
-        "follow_up_queries": result.follow_up_queries,
-        "research_loop_count": state["research_loop_count"],
-        "number_of_ran_queries": len(state["search_query"]),
-    }
+
+async def areflection(state: OverallState, config: RunnableConfig) -> ReflectionState:
+    """Async version of :func:`reflection`."""
+    configurable = Configuration.from_runnable_config(config)
+    reasoning_model = state.get("reasoning_model") or configurable.reasoning_model
+    formatted_prompt = _reflection_prompt(state, configurable)
+    decision = _stopping_decision(state, config, configurable)
+    if decision["stop"]:
+        return _stopped_update(state, decision)
+
+    llm = _reflection_model(reasoning_model, configurable)
+    output = await _acall_with_retry(
+        lambda: llm.ainvoke(formatted_prompt),
+        config,
+        configurable,
+        "reflection",
+        reasoning_model,
+        formatted_prompt,
+    )
+    return _reflection_update(state, output, formatted_prompt, configurable, decision)
 
 
 def evaluate_research(
@@ -280,12 +926,12 @@ def evaluate_research(
         String literal indicating the next node to visit ("web_research" or "finalize_summary")
     """
     configurable = Configuration.from_runnable_config(config)
-    max_research_loops = (
-        state.get("max_research_loops")
-        if state.get("max_research_loops") is not None
-        else configurable.max_research_loops
-    )
-    if state["is_sufficient"] or state["research_loop_count"] >= max_research_loops:
+    if (
+        state["is_sufficient"]
+        or state["research_loop_count"] >= _max_research_loops(state, configurable)
+        # Every follow-up was a duplicate of a query that already ran
+        or not state["follow_up_queries"]
+    ):
         return "finalize_answer"
     else:
         return [
@@ -315,99 +961,184 @@ def finalize_answer(state: OverallState, config: RunnableConfig):
     """
     configurable = Configuration.from_runnable_config(config)
     reasoning_model = state.get("reasoning_model") or configurable.reasoning_model
+    # Optionally condense large research sets first, the reasoning model then combines the parts
+    formatted_prompt = _answer_prompt(state, _condense_research(state, config, configurable))
 
-    # Format the prompt
-    current_date = get_current_date()
-    formatted_prompt = answer_instructions.format(
-        current_date=current_date,
-        research_topic=get_research_topic(state["messages"]),
-        summaries="\n---\n\n".join(state["web_research_result"]),
+    # Reasoning Model, default to Gemini 2.5 Flash
+    llm = _backend(configurable).chat_model(reasoning_model, 0, timeout=_chat_timeout(configurable))
+
+    if configurable.stream_answer:
+        # Tokens are cleaned up and emitted as they arrive; only the start of the stream is retried
+        chunks = _call_with_retry(
+            lambda: _start_stream(iter(llm.stream(formatted_prompt))),
+            config,
+            configurable,
+            "finalize_answer",
+            reasoning_model,
+            formatted_prompt,
+            within_deadline=False,
+        )
+        answer = _AnswerStream(state)
+        for chunk in chunks:
+            answer.add(chunk)
+        answer.feed("", final=True)
+        return answer.update()
+
+    result = _call_with_retry(
+        lambda: llm.invoke(formatted_prompt),
+        config,
+        configurable,
+        "finalize_answer",
+        reasoning_model,
+        formatted_prompt,
+        within_deadline=False,
     )
+    return _answer_update(state, result)
 
-    # Add retry logic for API calls
-    retries = 0
-    result = None
-    
-    while retries <= MAX_RETRIES:
-        try:
-            # init Reasoning Model, default to Gemini 2.5 Flash
-            llm = ChatGoogleGenerativeAI(
-                model=reasoning_model,
-                temperature=0,
-                max_retries=2,
-                api_key=os.getenv("GEMINI_API_KEY"),
-            )
-            result = llm.invoke(formatted_prompt)
-            break  # Success, exit the retry loop
-        except Exception as e:
-            error_message = str(e)
-            retries += 1
-            
-            # Check if it's a server overload error (503)
-            if "503 UNAVAILABLE" in error_message and "model is overloaded" in error_message:
-                if retries <= MAX_RETRIES:
-                    print(f"Gemini API is overloaded. Retrying ({retries}/{MAX_RETRIES}) in {RETRY_DELAY} seconds...")
-                    time.sleep(RETRY_DELAY * retries)  # Exponential backoff
-                else:
-                    raise Exception(f"Gemini API is overloaded after {MAX_RETRIES} retries. Please try again later.")
-            else:
-                # For other errors, don't retry
-                raise
-    
-    if result is None:
-        raise Exception("Failed to get a response from the Gemini API.")
 
-    # Remove citations from the final answer
-    result.content = re.sub(r"\[\[?.*?\]?\]", "", result.content)
-    # Replace the short urls with the original urls and add all used urls to the sources_gathered
-    unique_sources = []
-    for source in state["sources_gathered"]:
-        if source["short_url"] in result.content:
-            result.content = result.content.replace(
-                source["short_url"], source["value"]
-            )
-            unique_sources.append(source)
+async def afinalize_answer(state: OverallState, config: RunnableConfig):
+    """Async version of :func:`finalize_answer`."""
+    configurable = Configuration.from_runnable_config(config)
+    reasoning_model = state.get("reasoning_model") or configurable.reasoning_model
+    formatted_prompt = _answer_prompt(
+        state, await _acondense_research(state, config, configurable)
+    )
 
-    return {
-        "messages": [AIMessage(content=result.content)],
-        "sources_gathered": unique_sources,
-    }
+    llm = _backend(configurable).chat_model(reasoning_model, 0, timeout=_chat_timeout(configurable))
 
+    if configurable.stream_answer:
+        chunks = await _acall_with_retry(
+            lambda: _astart_stream(llm.astream(formatted_prompt).__aiter__()),
+            config,
+            configurable,
+            "finalize_answer",
+            reasoning_model,
+            formatted_prompt,
+            within_deadline=False,
+        )
+        answer = _AnswerStream(state)
+        async for chunk in chunks:
+            answer.add(chunk)
+        answer.feed("", final=True)
+        return answer.update()
 
-# Create our Agent Graph
-builder = StateGraph(OverallState, config_schema=Configuration)
+    result = await _acall_with_retry(
+        lambda: llm.ainvoke(formatted_prompt),
+        config,
+        configurable,
+        "finalize_answer",
+        reasoning_model,
+        formatted_prompt,
+        within_deadline=False,
+    )
+    return _answer_update(state, result)
 
-# Define the nodes we will cycle between
-builder.add_node("generate_query", generate_query)
-builder.add_node("web_research", web_research)
-builder.add_node("reflection", reflection)
-builder.add_node("finalize_answer", finalize_answer)
 
-# Set the entrypoint as `generate_query`
-# This means that this node is the first one called
-builder.add_edge(START, "generate_query")
-# Add conditional edge to continue with search queries in a parallel branch
-builder.add_conditional_edges(
-    "generate_query", continue_to_web_research, ["web_research"]
-)
-# Reflect on the web research
-builder.add_edge("web_research", "reflection")
-# Evaluate the research
-builder.add_conditional_edges(
-    "reflection", evaluate_research, ["web_research", "finalize_answer"]
-)
-# Finalize the answer
-builder.add_edge("finalize_answer", END)
+def _branch(state) -> Optional[dict]:
+    """Identifies parallel web_research branches in the metrics."""
+    if "search_query" in state and "id" in state:
+        return {"id": state["id"], "query": state["search_query"]}
+    return None
+
+
+def _instrumented(name: str, node):
+    """Wrap a node so every execution is recorded by the run's metrics."""
+    if asyncio.iscoroutinefunction(node):
+        @functools.wraps(node)
+        async def wrapper(state, config: RunnableConfig):
+            with node_span(name, config, _branch(state)):
+                return await node(state, config)
+    else:
+        @functools.wraps(node)
+        def wrapper(state, config: RunnableConfig):
+            with node_span(name, config, _branch(state)):
+                return node(state, config)
+    return wrapper
 
-graph = builder.compile(name="pro-search-agent")
 
-def create_graph_for_direct_use():
+def build_graph(
+    generate_query_node,
+    web_research_node,
+    reflection_node,
+    finalize_answer_node,
+    consult_history_node=consult_history,
+    checkpointer=None,
+):
+    """Wire the agent graph from the given node implementations and compile it.
+
+    Args:
+        checkpointer: Optional LangGraph checkpointer saving the state of every
+            superstep under the run's ``thread_id`` (see :mod:`agent.checkpoint`)
+    """
+    # Create our Agent Graph
+    builder = StateGraph(OverallState, config_schema=Configuration)
+
+    # Define the nodes we will cycle between
+    builder.add_node("consult_history", _instrumented("consult_history", consult_history_node))
+    builder.add_node("generate_query", _instrumented("generate_query", generate_query_node))
+    builder.add_node("web_research", _instrumented("web_research", web_research_node))
+    builder.add_node("reflection", _instrumented("reflection", reflection_node))
+    builder.add_node("finalize_answer", _instrumented("finalize_answer", finalize_answer_node))
+
+    # Set the entrypoint as `generate_query`, optionally preceded by a look at past runs
+    builder.add_conditional_edges(START, start_research, ["consult_history", "generate_query"])
+    builder.add_conditional_edges("consult_history", after_history, ["generate_query", END])
+    # Add conditional edge to continue with search queries in a parallel branch
+    builder.add_conditional_edges(
+        "generate_query", continue_to_web_research, ["web_research", "reflection"]
+    )
+    # Reflect on the web research
+    builder.add_edge("web_research", "reflection")
+    # Evaluate the research
+    builder.add_conditional_edges(
+        "reflection", evaluate_research, ["web_research", "finalize_answer"]
+    )
+    # Finalize the answer
+    builder.add_edge("finalize_answer", END)
+
+    return builder.compile(name="pro-search-agent", checkpointer=checkpointer)
+
+
+@functools.lru_cache(maxsize=None)
+def create_graph_for_direct_use(checkpointer=None):
     """Creates and returns the compiled search agent graph for direct use.
     
     This function is used by CLI tools and other direct integrations that
     don't need the full web server but just want to use the agent directly.
+    The graph is compiled on the first call and reused afterwards.
+    
+    Args:
+        checkpointer: Optional checkpointer that makes runs resumable
     
     Returns:
         The compiled StateGraph instance ready for invocation.
     """
-    return graph
+    return build_graph(
+        generate_query, web_research, reflection, finalize_answer, consult_history, checkpointer
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def create_async_graph_for_direct_use():
+    """Creates and returns the compiled graph built from the async nodes.
+
+    Use it with ``ainvoke`` / ``astream`` so that many research sessions can
+    run concurrently on a single event loop without blocking threads.
+
+    Returns:
+        The compiled StateGraph instance with async nodes.
+    """
+    return build_graph(
+        agenerate_query, aweb_research, areflection, afinalize_answer, aconsult_history
+    )
+
+
+def __getattr__(name):
+    # `graph`, `async_graph` and `genai_client` are built on first access
+    if name == "graph":
+        return create_graph_for_direct_use()
+    if name == "async_graph":
+        return create_async_graph_for_direct_use()
+    if name == "genai_client":
+        return get_genai_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,291 @@
+"""
+Hedged requests for straggling web searches.
+
+The reflection after a ``web_research`` fan-out can't start before the slowest
+branch returns, so one grounded search stuck on a slow server holds up the
+whole loop. With hedging on, a search that hasn't returned by a percentile of
+the recently observed search latency gets a duplicate request, and whichever
+finishes first is used (the other one is cancelled in the async graph and
+ignored in the sync graph).
+
+A :class:`HedgeBudget` caps the extra cost: every request earns a fraction of
+a hedge (``hedge_budget``, e.g. 0.1 for at most one hedge per ten requests),
+so a general slowdown can't double the load on the API. Until enough
+latencies have been observed no request is hedged.
+
+Latencies and the hedge delay count from when a request is actually sent.
+The hedged function gets a ``started`` callback to call at that point (e.g.
+when the rate limiter grants its permit), so time spent queued locally
+neither looks like a slow server nor sets off hedges that would only queue
+up behind it.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import contextvars
+import math
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# Latencies kept per hedger, and needed before the percentile is trusted
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+# Hedges that may be saved up while requests are fast
+MAX_BUDGET_BURST = 5.0
+# Threads of the sync graph's hedges; the budget keeps them a small share of the requests
+MAX_HEDGE_THREADS = 8
+
+PRIMARY = "primary"
+HEDGE = "hedge"
+
+_hedgers: Dict[Tuple, "Hedger"] = {}
+_hedgers_lock = threading.Lock()
+_executors: Dict[str, concurrent.futures.ThreadPoolExecutor] = {}
+
+
+class LatencyTracker:
+    """Rolling window of observed latencies."""
+
+    def __init__(self, window: int = LATENCY_WINDOW, min_samples: int = MIN_SAMPLES):
+        self.min_samples = min_samples
+        self._samples: collections.deque = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """The ``percent``-th percentile (nearest rank), or None with too few samples."""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        rank = math.ceil(percent / 100 * len(ordered))
+        return ordered[min(len(ordered), max(1, rank)) - 1]
+
+
+class HedgeBudget:
+    """Allows at most ``ratio`` hedges per request, with a small burst allowance."""
+
+    def __init__(self, ratio: float, burst: float = MAX_BUDGET_BURST):
+        self.ratio = ratio
+        self.burst = max(1.0, burst)
+        self._balance = 1.0
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        """Credit one request."""
+        with self._lock:
+            self._balance = min(self.burst, self._balance + self.ratio)
+
+    def try_spend(self) -> bool:
+        """Take one hedge if the budget allows it."""
+        with self._lock:
+            if self._balance >= 1.0:
+                self._balance -= 1.0
+                return True
+            return False
+
+
+class Hedger:
+    """Hedges calls of one kind (e.g. web searches with one model).
+
+    Args:
+        percentile: Latency percentile after which a duplicate request is sent
+        budget_ratio: Hedges allowed per request
+    """
+
+    def __init__(self, percentile: float, budget_ratio: float):
+        self.percentile = percentile
+        self.latencies = LatencyTracker()
+        self.budget = HedgeBudget(budget_ratio)
+        self.requests = 0
+        self.hedged = 0
+        self.won = 0
+        self.denied = 0
+        self._lock = threading.Lock()
+
+    def delay(self) -> Optional[float]:
+        """Seconds after which a request gets a hedge, or None while there are too few samples."""
+        return self.latencies.percentile(self.percentile)
+
+    def call(self, fn: Callable[[Callable[[], None]], Any], on_hedge: Optional[Callable[[str], None]] = None) -> Any:
+        """Run ``fn`` in a worker thread, hedged with a second call from a separate pool if it is slow.
+
+        ``fn`` is called with a ``started`` callback that it calls once the
+        request is sent; the hedge delay counts from then. ``on_hedge`` is
+        called with ``"won"``, ``"lost"`` or ``"denied"`` when a hedge was
+        sent (or the budget refused one).
+        """
+        delay = self._start()
+        attempt = _Attempt(threading.Event())
+        if delay is None:
+            return attempt.run(self, fn)
+
+        primary = _thread_pool(PRIMARY).submit(contextvars.copy_context().run, attempt.run, self, fn)
+        futures = {primary: PRIMARY}
+        # Only a request in flight is hedged, however long it waited for a permit
+        attempt.started.wait()
+        if attempt.sent is None:
+            # It finished (or failed) without being sent
+            return primary.result()
+        done, _ = concurrent.futures.wait(futures, timeout=attempt.time_left(delay))
+        if not done and self._hedge(on_hedge):
+            hedge = _Attempt(threading.Event())
+            # A pool of its own, so the hedge doesn't queue behind the stragglers it races
+            futures[_thread_pool(HEDGE).submit(contextvars.copy_context().run, hedge.run, self, fn)] = HEDGE
+        # A losing thread runs to completion; its result is ignored
+        pending, error = dict(futures), None
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                role = pending.pop(future)
+                if future.exception() is None:
+                    if len(futures) > 1:
+                        self._finish(role, on_hedge)
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    async def acall(self, fn: Callable[[Callable[[], None]], Awaitable[Any]],
+                    on_hedge: Optional[Callable[[str], None]] = None) -> Any:
+        """Async version of :meth:`call`; the losing request is cancelled."""
+        delay = self._start()
+        attempt = _Attempt(asyncio.Event())
+        if delay is None:
+            return await attempt.arun(self, fn)
+
+        primary = asyncio.ensure_future(attempt.arun(self, fn))
+        tasks = {primary: PRIMARY}
+        try:
+            await attempt.started.wait()
+            if attempt.sent is None:
+                return await primary
+            done, _ = await asyncio.wait(tasks, timeout=attempt.time_left(delay))
+            if not done and self._hedge(on_hedge):
+                tasks[asyncio.ensure_future(_Attempt(asyncio.Event()).arun(self, fn))] = HEDGE
+            pending, error = dict(tasks), None
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    role = pending.pop(task)
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            self._finish(role, on_hedge)
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters of the hedger since it was created."""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "hedge_won": self.won,
+                "hedge_lost": self.hedged - self.won,
+                "budget_denied": self.denied,
+                "delay_seconds": self.delay(),
+            }
+
+    def _start(self) -> Optional[float]:
+        self.budget.deposit()
+        with self._lock:
+            self.requests += 1
+        return self.delay()
+
+    def _hedge(self, on_hedge) -> bool:
+        allowed = self.budget.try_spend()
+        with self._lock:
+            if allowed:
+                self.hedged += 1
+            else:
+                self.denied += 1
+        if not allowed and on_hedge is not None:
+            on_hedge("denied")
+        return allowed
+
+    def _finish(self, winner: str, on_hedge) -> None:
+        if winner == HEDGE:
+            with self._lock:
+                self.won += 1
+        if on_hedge is not None:
+            on_hedge("won" if winner == HEDGE else "lost")
+
+
+class _Attempt:
+    """One request of a hedged call, timed from when it was sent."""
+
+    def __init__(self, started):
+        # A threading.Event, or an asyncio.Event in the async version
+        self.started = started
+        self.sent: Optional[float] = None
+
+    def start(self) -> None:
+        if self.sent is None:
+            self.sent = time.monotonic()
+        self.started.set()
+
+    def time_left(self, delay: float) -> float:
+        """Seconds until the request has been in flight for ``delay`` seconds."""
+        if self.sent is None:
+            return 0.0
+        return max(0.0, delay - (time.monotonic() - self.sent))
+
+    def run(self, hedger: Hedger, fn):
+        try:
+            result = fn(self.start)
+            if self.sent is not None:
+                hedger.latencies.record(time.monotonic() - self.sent)
+            return result
+        finally:
+            # A request that finished (or failed) without being sent doesn't block the caller
+            self.started.set()
+
+    async def arun(self, hedger: Hedger, fn):
+        try:
+            result = await fn(self.start)
+            if self.sent is not None:
+                hedger.latencies.record(time.monotonic() - self.sent)
+            return result
+        finally:
+            self.started.set()
+
+
+def _thread_pool(role: str) -> concurrent.futures.ThreadPoolExecutor:
+    executor = _executors.get(role)
+    if executor is None:
+        with _hedgers_lock:
+            executor = _executors.get(role)
+            if executor is None:
+                executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=MAX_HEDGE_THREADS if role == HEDGE else None,
+                    thread_name_prefix=f"hedge-{role}",
+                )
+                _executors[role] = executor
+    return executor
+
+
+def get_hedger(name: str, percentile: float, budget_ratio: float) -> Hedger:
+    """Return the process-wide hedger for the calls called ``name`` with these settings.
+
+    Args:
+        name: Kind of call whose latencies are comparable (e.g. backend, node and model)
+        percentile: Latency percentile after which a duplicate request is sent
+        budget_ratio: Hedges allowed per request
+    """
+    key = (name, percentile, budget_ratio)
+    hedger = _hedgers.get(key)
+    if hedger is None:
+        with _hedgers_lock:
+            hedger = _hedgers.get(key)
+            if hedger is None:
+                hedger = Hedger(percentile, budget_ratio)
+                _hedgers[key] = hedger
+    return hedger
@@ -0,0 +1,293 @@
+"""
+Searchable history of finished research runs.
+
+Every finished run (question, answer, cited sources and the summary of each
+web search) is stored in a local SQLite database with an FTS5 index over the
+question, the answer and the research summaries, so thousands of past runs
+can be searched with ranked (BM25) full-text lookups.
+
+The graph can consult the history before generating queries: a fresh run for
+practically the same question answers the new one directly, and fresh runs on
+similar questions seed the research with their search summaries so that only
+what they didn't cover is searched again.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from agent.dedup import shingles, similarity
+from agent.utils import SHORT_URL_PREFIX
+
+DEFAULT_HISTORY_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "agentblack", "history.sqlite"
+)
+# Prior runs whose summaries may seed a new run
+SEED_RUNS = 2
+# Column weights of the question, answer and research summaries in the ranking
+_BM25_WEIGHTS = (10.0, 2.0, 1.0)
+_SNIPPET_START, _SNIPPET_END = "\x02", "\x03"
+
+_histories: Dict[str, "ResearchHistory"] = {}
+_histories_lock = threading.Lock()
+
+
+def fts_query(text: str) -> str:
+    """FTS5 query matching any word of ``text`` (ranked by BM25)."""
+    words = re.findall(r"\w+", text.lower())
+    return " OR ".join(f'"{word}"' for word in dict.fromkeys(words))
+
+
+def _sources_in(text: str, sources: List[Dict[str, Any]], key: str) -> List[Dict[str, Any]]:
+    unique = {}
+    for source in sources:
+        if isinstance(source, dict) and source.get(key):
+            unique.setdefault(source[key], source)
+    if not unique:
+        return []
+    # Whole urls only, longest first: ".../id/1-1" must not be found inside ".../id/1-12"
+    alternatives = sorted(unique, key=len, reverse=True)
+    pattern = re.compile(f"(?:{'|'.join(map(re.escape, alternatives))})(?![\\w-])")
+    found = {match.group(0) for match in pattern.finditer(text)}
+    return [source for url, source in unique.items() if url in found]
+
+
+def searches_from_state(state: Dict[str, Any], skip: int = 0) -> List[Dict[str, Any]]:
+    """The query, summary and cited sources of every web search of a finished run.
+
+    Args:
+        state: Final graph state
+        skip: Number of leading results that were seeded from the history
+    """
+    sources = state.get("sources_gathered", [])
+    return [
+        {"query": query, "summary": summary, "sources": _sources_in(summary, sources, "short_url")}
+        for query, summary in list(
+            zip(state.get("search_query", []), state.get("web_research_result", []))
+        )[skip:]
+    ]
+
+
+class ResearchHistory:
+    """SQLite store of finished runs with an FTS5 index."""
+
+    def __init__(self, path: str = DEFAULT_HISTORY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                " id INTEGER PRIMARY KEY,"
+                " created REAL NOT NULL,"
+                " query TEXT NOT NULL,"
+                " answer TEXT NOT NULL,"
+                " sources TEXT NOT NULL,"
+                " searches TEXT NOT NULL,"
+                " research_loops INTEGER NOT NULL,"
+                " max_research_loops INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS runs_fts USING fts5("
+                " query, answer, research, tokenize='porter unicode61')"
+            )
+
+    def add_run(
+        self,
+        query: str,
+        answer: str,
+        sources: List[Dict[str, Any]],
+        searches: List[Dict[str, Any]],
+        research_loops: int = 0,
+        max_research_loops: int = 0,
+    ) -> int:
+        """Store a finished run and return its id."""
+        research = "\n\n".join(f"{s['query']}\n{s['summary']}" for s in searches)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO runs (created, query, answer, sources, searches, research_loops,"
+                " max_research_loops) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), query, answer, json.dumps(sources), json.dumps(searches),
+                 research_loops, max_research_loops),
+            )
+            run_id = cursor.lastrowid
+            self._conn.execute(
+                "INSERT INTO runs_fts (rowid, query, answer, research) VALUES (?, ?, ?, ?)",
+                (run_id, query, answer, research),
+            )
+        return run_id
+
+    def add_state(self, query: str, state: Dict[str, Any], max_research_loops: int = 0) -> Optional[int]:
+        """Store the final state of a run; runs answered from the history are not stored again."""
+        matches = state.get("history_matches") or []
+        if any(match["mode"] == "answer" for match in matches):
+            return None
+        answer = state["messages"][-1].content if state.get("messages") else ""
+        seeded = sum(match["summaries"] for match in matches)
+        return self.add_run(
+            query,
+            answer,
+            _sources_in(answer, state.get("sources_gathered", []), "value"),
+            searches_from_state(state, seeded),
+            state.get("research_loop_count") or 0,
+            max_research_loops,
+        )
+
+    def search(self, text: str, limit: int = 10, max_age_hours: float = 0) -> List[Dict[str, Any]]:
+        """Runs matching ``text``, best first.
+
+        Args:
+            text: Free text; runs matching any of its words are ranked by BM25
+            limit: Maximum number of runs returned
+            max_age_hours: Only runs at most this old (0 for any age)
+
+        Returns:
+            ``{"id", "created", "query", "snippet", "score"}`` dictionaries; the
+            snippet marks matches with ``\\x02``/``\\x03``.
+        """
+        match = fts_query(text)
+        if not match:
+            return []
+        oldest = time.time() - max_age_hours * 3600 if max_age_hours > 0 else 0
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT runs.id, runs.created, runs.query,"
+                " snippet(runs_fts, 1, ?, ?, '…', 16), bm25(runs_fts, ?, ?, ?) AS score"
+                " FROM runs_fts JOIN runs ON runs.id = runs_fts.rowid"
+                " WHERE runs_fts MATCH ? AND runs.created >= ?"
+                " ORDER BY score LIMIT ?",
+                (_SNIPPET_START, _SNIPPET_END, *_BM25_WEIGHTS, match, oldest, limit),
+            ).fetchall()
+        return [
+            {"id": row[0], "created": row[1], "query": row[2], "snippet": row[3], "score": -row[4]}
+            for row in rows
+        ]
+
+    def get(self, run_id: int) -> Optional[Dict[str, Any]]:
+        """The stored run with id ``run_id``."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, created, query, answer, sources, searches, research_loops,"
+                " max_research_loops FROM runs WHERE id = ?",
+                (run_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "created": row[1],
+            "query": row[2],
+            "answer": row[3],
+            "sources": json.loads(row[4]),
+            "searches": json.loads(row[5]),
+            "research_loops": row[6],
+            "max_research_loops": row[7],
+        }
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    def consult(
+        self,
+        question: str,
+        max_age_hours: float,
+        answer_threshold: float,
+        seed_threshold: float,
+        max_research_loops: int = 0,
+    ) -> Dict[str, Any]:
+        """Decide how fresh prior runs can serve ``question``.
+
+        Candidates come from the full-text index; their questions are compared
+        with the shingle similarity used for follow-up deduplication.
+
+        Returns:
+            ``{"answer": run}`` when a run at least as deep as this one asked
+            practically the same question, otherwise ``{"seed": [runs]}`` with
+            up to ``SEED_RUNS`` similar runs (possibly none). Every run carries
+            its ``similarity``.
+        """
+        question_shingles = shingles(question)
+        candidates = []
+        for hit in self.search(question, limit=20, max_age_hours=max_age_hours):
+            score = similarity(question_shingles, shingles(hit["query"]))
+            if score >= seed_threshold:
+                candidates.append((score, hit["id"]))
+        candidates.sort(key=lambda candidate: -candidate[0])
+
+        seeds = []
+        for score, run_id in candidates:
+            run = self.get(run_id)
+            run["similarity"] = round(score, 3)
+            if score >= answer_threshold and run["max_research_loops"] >= max_research_loops:
+                return {"answer": run}
+            if len(seeds) < SEED_RUNS:
+                seeds.append(run)
+        return {"seed": seeds}
+
+
+def seed_update(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """State update that adds the searches of prior runs to a new run.
+
+    Short URLs are renamed per run (``h<run id>-...``) so they can't collide
+    with the ids of the new run's searches.
+    """
+    queries, results, sources, matches = [], [], [], []
+    for run in runs:
+        prefix = f"{SHORT_URL_PREFIX}h{run['id']}-"
+        for search in run["searches"]:
+            queries.append(search["query"])
+            results.append(search["summary"].replace(SHORT_URL_PREFIX, prefix))
+            sources.extend(
+                {**source, "short_url": source["short_url"].replace(SHORT_URL_PREFIX, prefix)}
+                for source in search["sources"]
+            )
+        matches.append(_match(run, "seed", len(run["searches"])))
+    return {
+        "search_query": queries,
+        "web_research_result": results,
+        "sources_gathered": sources,
+        "history_matches": matches,
+    }
+
+
+def _match(run: Dict[str, Any], mode: str, summaries: int = 0) -> Dict[str, Any]:
+    return {
+        "id": run["id"],
+        "query": run["query"],
+        "mode": mode,
+        "similarity": run["similarity"],
+        "age_hours": round((time.time() - run["created"]) / 3600, 1),
+        "summaries": summaries,
+    }
+
+
+def answer_update(run: Dict[str, Any]) -> Dict[str, Any]:
+    """State update that answers a new run with a prior run's answer."""
+    from langchain_core.messages import AIMessage
+
+    return {
+        "messages": [AIMessage(content=run["answer"])],
+        "sources_gathered": run["sources"],
+        "history_matches": [_match(run, "answer")],
+    }
+
+
+def get_research_history(path: str = "") -> ResearchHistory:
+    """Return the process-wide history for ``path`` (the default location if empty)."""
+    path = path or DEFAULT_HISTORY_PATH
+    history = _histories.get(path)
+    if history is None:
+        with _histories_lock:
+            history = _histories.get(path)
+            if history is None:
+                history = ResearchHistory(path)
+                _histories[path] = history
+    return history
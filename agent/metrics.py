@@ -0,0 +1,323 @@
+"""
+Per-node instrumentation of research runs.
+
+Every graph node runs inside :func:`node_span`, which records one entry per
+node execution (so each parallel ``web_research`` branch gets its own) with
+its wall time and the model calls it made: model, queue wait at the rate
+limiter, retries, prompt/completion tokens and response size. The entries
+are collected by the run's :class:`RunMetrics` (passed in
+``configurable["metrics"]``) and turned into a JSON run report.
+
+When OpenTelemetry is installed and :func:`configure_tracing` was called,
+the same data is also exported as spans (one per node with a child span per
+model call) to an OTLP collector.
+"""
+
+import contextlib
+import contextvars
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+_current_node: contextvars.ContextVar[Optional["NodeRecord"]] = contextvars.ContextVar(
+    "current_node", default=None
+)
+_tracer = None
+# Map steps append calls to the same node record from several threads
+_lock = threading.Lock()
+
+
+class CallRecord:
+    """One model call, including all of its retries."""
+
+    def __init__(self, label: str, model: str):
+        self.label = label
+        self.model = model
+        self.started = time.time()
+        self.attempts = 0
+        self.queue_wait_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.response_bytes: Optional[int] = None
+        # "won", "lost" or "denied" when the call was slow enough to hedge
+        self.hedge: Optional[str] = None
+        self.error: Optional[str] = None
+
+    @property
+    def retries(self) -> int:
+        # A hedge takes a rate limiter permit like a retry but isn't one
+        return max(0, self.attempts - 1 - (self.hedge in ("won", "lost")))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "label": self.label,
+            "model": self.model,
+            "wall_seconds": round(self.wall_seconds, 4),
+            "queue_wait_seconds": round(self.queue_wait_seconds, 4),
+            "retries": self.retries,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "response_bytes": self.response_bytes,
+            "hedge": self.hedge,
+            "error": self.error,
+        }
+
+
+class NodeRecord:
+    """One execution of a graph node."""
+
+    def __init__(self, node: str, branch: Optional[Dict[str, Any]], started: float):
+        self.node = node
+        self.branch = branch
+        self.started = started
+        self.wall_seconds = 0.0
+        self.calls: List[CallRecord] = []
+        self.attributes: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        record = {
+            "node": self.node,
+            "start_offset_seconds": round(self.started - origin, 4),
+            "wall_seconds": round(self.wall_seconds, 4),
+            "calls": [call.to_dict() for call in self.calls],
+        }
+        if self.branch:
+            record["branch"] = self.branch
+        record.update(self.attributes)
+        if self.error:
+            record["error"] = self.error
+        return record
+
+
+_USAGE_KEYS = ("prompt_tokens", "completion_tokens", "response_bytes")
+
+
+def _add_known(total: Optional[int], value: Optional[int]) -> Optional[int]:
+    # Once one figure is unknown the total is too
+    if total is None or value is None:
+        return None
+    return total + value
+
+
+class RunMetrics:
+    """Collects the node records of one research run."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.nodes: List[NodeRecord] = []
+        self._lock = threading.Lock()
+        # Root span of the run when tracing is on; node spans are its children
+        self._span = None
+
+    def add(self, record: NodeRecord) -> None:
+        with self._lock:
+            self.nodes.append(record)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Totals per node name: executions, wall time, queue wait, retries, hedges, tokens and bytes.
+
+        A token or byte total is None when a call that got a response didn't
+        report that figure, rather than a sum that silently leaves it out.
+        Calls that failed without a response add nothing.
+        """
+        summary: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            nodes = list(self.nodes)
+        for record in nodes:
+            entry = summary.setdefault(record.node, {
+                "executions": 0,
+                "wall_seconds": 0.0,
+                "max_wall_seconds": 0.0,
+                "queue_wait_seconds": 0.0,
+                "calls": 0,
+                "retries": 0,
+                "hedges": 0,
+                "hedge_wins": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "response_bytes": 0,
+            })
+            entry["executions"] += 1
+            entry["wall_seconds"] += record.wall_seconds
+            entry["max_wall_seconds"] = max(entry["max_wall_seconds"], record.wall_seconds)
+            for call in record.calls:
+                entry["calls"] += 1
+                entry["queue_wait_seconds"] += call.queue_wait_seconds
+                entry["retries"] += call.retries
+                entry["hedges"] += call.hedge in ("won", "lost")
+                entry["hedge_wins"] += call.hedge == "won"
+                if call.error is None:
+                    for key in _USAGE_KEYS:
+                        entry[key] = _add_known(entry[key], getattr(call, key))
+        for entry in summary.values():
+            for key in ("wall_seconds", "max_wall_seconds", "queue_wait_seconds"):
+                entry[key] = round(entry[key], 4)
+        return summary
+
+    def tokens_used(self) -> Optional[int]:
+        """Prompt and completion tokens of the run so far, or None if any call's usage is unknown."""
+        total: Optional[int] = 0
+        for entry in self.summary().values():
+            total = _add_known(_add_known(total, entry["prompt_tokens"]), entry["completion_tokens"])
+        return total
+
+    def reported_tokens(self) -> Tuple[int, int]:
+        """Prompt and completion tokens that calls reported, and how many calls reported none.
+
+        Unlike :meth:`tokens_used` this is a lower bound that is always known;
+        failed calls count in neither figure.
+        """
+        tokens = unreported = 0
+        with self._lock:
+            calls = [call for record in self.nodes for call in record.calls if call.error is None]
+        for call in calls:
+            figures = (call.prompt_tokens, call.completion_tokens)
+            unreported += None in figures
+            tokens += sum(figure for figure in figures if figure is not None)
+        return tokens, unreported
+
+    def finish(self) -> None:
+        """End the run's root span, if one was started."""
+        with self._lock:
+            span, self._span = self._span, None
+        if span is not None:
+            span.end()
+
+    def report(self, **extra: Any) -> Dict[str, Any]:
+        """The JSON run report: ``extra`` fields, per-node totals and every node record."""
+        self.finish()
+        with self._lock:
+            nodes = sorted(self.nodes, key=lambda record: record.started)
+        return {
+            **extra,
+            "started": self.started,
+            "wall_seconds": round(time.time() - self.started, 4),
+            "summary": self.summary(),
+            "nodes": [record.to_dict(self.started) for record in nodes],
+        }
+
+
+def get_run_metrics(config: Optional[dict]) -> Optional[RunMetrics]:
+    """Return the run's metrics collector from a RunnableConfig, if one was provided."""
+    if not config:
+        return None
+    return config.get("configurable", {}).get("metrics")
+
+
+def current_node() -> Optional[NodeRecord]:
+    """The record of the node executing in this context, if it is being recorded."""
+    return _current_node.get()
+
+
+@contextlib.contextmanager
+def node_span(node: str, config: Optional[dict], branch: Optional[Dict[str, Any]] = None):
+    """Record one node execution (and export it as a span when tracing is on)."""
+    metrics = get_run_metrics(config)
+    if metrics is None and _tracer is None:
+        yield None
+        return
+
+    record = NodeRecord(node, branch, time.time())
+    token = _current_node.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record.wall_seconds = time.perf_counter() - start
+        _current_node.reset(token)
+        if metrics is not None:
+            metrics.add(record)
+        if _tracer is not None:
+            _export_span(record, metrics)
+
+
+@contextlib.contextmanager
+def call_span(label: str, model: str):
+    """Record one model call of the current node; yields None when nothing is recorded."""
+    record = _current_node.get()
+    if record is None:
+        yield None
+        return
+
+    call = CallRecord(label, model)
+    with _lock:
+        record.calls.append(call)
+    start = time.perf_counter()
+    try:
+        yield call
+    except BaseException as e:
+        call.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        call.wall_seconds = time.perf_counter() - start
+
+
+def configure_tracing(endpoint: str = "", service_name: str = "agentblack-search") -> None:
+    """Export node spans to an OTLP/HTTP collector (``endpoint`` defaults to the SDK's).
+
+    Raises:
+        ImportError: If the OpenTelemetry SDK and OTLP exporter are not installed
+    """
+    global _tracer
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError as e:
+        raise ImportError(
+            "OpenTelemetry export needs: pip install opentelemetry-sdk "
+            "opentelemetry-exporter-otlp-proto-http"
+        ) from e
+
+    exporter = OTLPSpanExporter(endpoint=endpoint) if endpoint else OTLPSpanExporter()
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("agent.graph")
+
+
+def shutdown_tracing() -> None:
+    """Flush pending spans before the process exits."""
+    if _tracer is not None:
+        from opentelemetry import trace
+
+        trace.get_tracer_provider().shutdown()
+
+
+def _export_span(record: NodeRecord, metrics: Optional[RunMetrics]) -> None:
+    # Spans are emitted after the fact with the recorded timestamps, so the node
+    # code doesn't need to know about tracing
+    from opentelemetry import trace
+
+    parent = None
+    if metrics is not None:
+        with metrics._lock:
+            if metrics._span is None:
+                metrics._span = _tracer.start_span(
+                    "research run", start_time=int(metrics.started * 1e9)
+                )
+            parent = trace.set_span_in_context(metrics._span)
+    start_ns = int(record.started * 1e9)
+    span = _tracer.start_span(f"node {record.node}", context=parent, start_time=start_ns)
+    for key, value in {**(record.branch or {}), **record.attributes}.items():
+        if isinstance(value, (str, bool, int, float)):
+            span.set_attribute(f"agent.{key}", value)
+    if record.error:
+        span.set_attribute("error", record.error)
+
+    context = trace.set_span_in_context(span)
+    for call in record.calls:
+        call_start_ns = int(call.started * 1e9)
+        child = _tracer.start_span(f"gemini {call.label}", context=context, start_time=call_start_ns)
+        for key, value in call.to_dict().items():
+            if value is not None and key != "label":
+                child.set_attribute(f"gemini.{key}", value)
+        child.end(end_time=call_start_ns + int(call.wall_seconds * 1e9))
+    span.end(end_time=start_ns + int(record.wall_seconds * 1e9))
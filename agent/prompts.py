@@ -79,6 +79,60 @@ Summaries:
 {summaries}
 """
 
+incremental_reflection_instructions = """You are an expert research assistant analyzing summaries about "{research_topic}".
+
+You are continuing an ongoing research process. Earlier findings have been condensed into a digest, and only the summaries from the latest round of research are shown in full.
+
+Instructions:
+- Identify knowledge gaps or areas that need deeper exploration and generate a follow-up query. (1 or multiple).
+- If the digest together with the new summaries is sufficient to answer the user's question, don't generate a follow-up query.
+- If there is a knowledge gap, generate a follow-up query that would help expand your understanding.
+- Focus on technical details, implementation specifics, or emerging trends that weren't fully covered.
+- Don't repeat research that the digest shows has already been done.
+
+Requirements:
+- Ensure the follow-up query is self-contained and includes necessary context for web search.
+- Keep the findings digest compact: short bullet points of the key facts found so far (old and new), at most about 200 words. Don't include links.
+
+Output Format:
+- Format your response as a JSON object with these exact keys:
+   - "is_sufficient": true or false
+   - "knowledge_gap": Describe what information is missing or needs clarification
+   - "follow_up_queries": Write a specific question to address this gap
+   - "findings_digest": The updated digest of everything found so far
+
+Example:
+```json
+{{
+    "is_sufficient": true, // or false
+    "knowledge_gap": "The summary lacks information about performance metrics and benchmarks", // "" if is_sufficient is true
+    "follow_up_queries": ["What are typical performance benchmarks and metrics used to evaluate [specific technology]?"], // [] if is_sufficient is true
+    "findings_digest": "- [specific technology] was released in 2024\n- Adoption is growing in cloud workloads"
+}}
+```
+
+Digest of earlier findings:
+{digest}
+
+New Summaries:
+{summaries}
+"""
+
+partial_answer_instructions = """Condense the provided research summaries into a partial answer to the user's question.
+
+Instructions:
+- The current date is {current_date}.
+- These summaries are one part of a larger research effort; other parts are condensed separately and combined afterwards.
+- Keep every fact that is relevant to the user's question, and drop repetition and filler.
+- Keep the citations: every fact must keep its markdown link(s) exactly as written in the summaries, e.g. [source](https://vertexaisearch.cloud.google.com/id/1-0).
+- Don't add information that is not in the summaries.
+
+User Context:
+- {research_topic}
+
+Summaries:
+{summaries}"""
+
 answer_instructions = """Generate a high-quality answer to the user's question based on the provided summaries.
 
 Instructions:
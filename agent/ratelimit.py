@@ -0,0 +1,418 @@
+"""
+Process-wide rate limiting and scheduling for Gemini API calls.
+
+Every model call made by the graph asks a shared :class:`RateLimiter` for a
+permit first. A permit is granted when a concurrency slot is free and the
+model's token buckets (requests per minute and tokens per minute) have room,
+so a "hard" run fanning out many searches, or a batch with many sessions,
+queues locally instead of bursting past the quota and setting off 429/503
+retry storms.
+
+Queued calls are granted in order of priority, then graph stage (later
+stages first, so sessions already in flight finish before new ones start),
+then by start-time fair queueing across sessions: each session's calls are
+tagged with a virtual time that advances by one per call, so a session with a
+dozen queued searches can't starve one that has a single call waiting.
+"""
+
+import asyncio
+import itertools
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from agent.retry import RATE_LIMITED, Deadline, DeadlineExceededError, classify_error
+
+DEFAULT_MAX_CONCURRENCY = 8
+# Buckets hold this many seconds' worth of quota, which bounds bursts
+BURST_SECONDS = 6.0
+# Tokens reserved for the response on top of the prompt estimate
+OUTPUT_TOKEN_ALLOWANCE = 512
+
+# Lower runs first; later stages of the graph are preferred
+NODE_PRIORITIES = {
+    "finalize_answer": 0,
+    "finalize_answer.map": 1,
+    "reflection": 1,
+    "web_research": 2,
+    "generate_query": 3,
+}
+
+_limiters: Dict[Tuple, "RateLimiter"] = {}
+_limiters_lock = threading.Lock()
+
+
+def estimate_tokens(prompt: str) -> int:
+    """Rough token count of a call: about four characters per prompt token plus the response."""
+    return len(prompt) // 4 + OUTPUT_TOKEN_ALLOWANCE
+
+
+@dataclass(frozen=True)
+class ModelLimits:
+    """Per-minute quotas of one model; 0 means unlimited."""
+
+    requests_per_minute: float = 0
+    tokens_per_minute: float = 0
+
+
+def parse_rate_limits(spec: str) -> Dict[str, ModelLimits]:
+    """Parse ``"model=rpm[/tpm],..."`` (e.g. ``"gemini-2.5-pro=150/2000000"``)."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, values = item.partition("=")
+        rpm, _, tpm = values.partition("/")
+        try:
+            limits[model.strip()] = ModelLimits(float(rpm or 0), float(tpm or 0))
+        except ValueError:
+            raise ValueError(f"Invalid rate limit {item!r}, expected model=rpm[/tpm]") from None
+    return limits
+
+
+class TokenBucket:
+    """Continuously refilled bucket; a call may overdraw it once the bucket is full."""
+
+    def __init__(self, per_minute: float, burst_seconds: float = BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` can be taken (0 if it can be taken now)."""
+        self._refill(now)
+        # Requests larger than the bucket only wait for a full bucket
+        needed = min(amount, self.capacity)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.level = min(self.capacity, self.level - amount)
+
+    def drain(self, now: float) -> None:
+        """Empty the bucket, e.g. after the server reported a rate limit."""
+        self._refill(now)
+        self.level = min(self.level, 0.0)
+
+
+class _Waiter:
+    __slots__ = ("key", "model", "tokens", "session", "wake", "enqueued", "granted")
+
+    def __init__(self, key, model, tokens, session, wake):
+        self.key = key
+        self.model = model
+        self.tokens = tokens
+        self.session = session
+        self.wake = wake
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+
+class Permit:
+    """A granted slot for one API call; release it when the call is done."""
+
+    def __init__(self, limiter: "RateLimiter", model: str, tokens: int, queue_wait: float):
+        self.limiter = limiter
+        self.model = model
+        self.tokens = tokens
+        self.queue_wait = queue_wait
+        self._released = False
+
+    def release(self, used_tokens: Optional[int] = None, error: Optional[BaseException] = None) -> None:
+        """Free the slot and settle the token reservation with the actual usage, if known."""
+        if not self._released:
+            self._released = True
+            self.limiter._release(self, used_tokens, error)
+
+
+class RateLimiter:
+    """Concurrency limit plus per-model RPM/TPM buckets with fair queueing.
+
+    Args:
+        max_concurrency: Maximum number of calls in flight (0 for no limit)
+        default_limits: Quotas of models without an entry in ``model_limits``
+        model_limits: Quotas per model name
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        default_limits: ModelLimits = ModelLimits(),
+        model_limits: Optional[Dict[str, ModelLimits]] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.default_limits = default_limits
+        self.model_limits = dict(model_limits or {})
+        self.in_flight = 0
+        self.granted = 0
+        self.queue_wait_seconds = 0.0
+        self.rate_limited = 0
+        self._waiting: List[_Waiter] = []
+        self._buckets: Dict[str, Tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self._virtual_time = 0.0
+        self._session_tags: Dict[str, float] = {}
+        self._seq = itertools.count()
+        self._timer: Optional[threading.Timer] = None
+        self._timer_at = 0.0
+        self._lock = threading.Lock()
+
+    # Acquiring permits
+    def acquire(self, model: str, tokens: int, session: str = "", priority: int = 0, label: str = "",
+                deadline: Optional[Deadline] = None) -> Permit:
+        """Block until a call to ``model`` using about ``tokens`` tokens may start.
+
+        Args:
+            model: Name of the model being called
+            tokens: Estimated tokens of the call (see :func:`estimate_tokens`)
+            session: Id of the research session making the call
+            priority: Lower values are served first
+            label: Graph node making the call, ranks calls of equal priority
+            deadline: Optional run deadline; a call still queued when it passes
+                leaves the queue with :class:`agent.retry.DeadlineExceededError`
+        """
+        event = threading.Event()
+        waiter = self._enqueue(model, tokens, session, priority, label, event.set)
+        if not event.wait(deadline.remaining() if deadline is not None else None):
+            if not self._abandon(waiter):
+                raise _queue_deadline_error(deadline, label)
+        return self._permit(waiter)
+
+    async def aacquire(self, model: str, tokens: int, session: str = "", priority: int = 0, label: str = "",
+                       deadline: Optional[Deadline] = None) -> Permit:
+        """Async version of :meth:`acquire`."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enqueue(model, tokens, session, priority, label, wake)
+        try:
+            await asyncio.wait_for(future, deadline.remaining() if deadline is not None else None)
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                self._permit(waiter).release()
+            raise _queue_deadline_error(deadline, label) from None
+        except asyncio.CancelledError:
+            if self._abandon(waiter):
+                self._permit(waiter).release()
+            raise
+        return self._permit(waiter)
+
+    def call(self, fn: Callable[[], Any], model: str, tokens: int, session: str = "", priority: int = 0,
+             label: str = "", usage: Optional[Callable[[Any], Optional[int]]] = None,
+             on_permit: Optional[Callable[[Permit], None]] = None, deadline: Optional[Deadline] = None) -> Any:
+        """Run ``fn`` under a permit.
+
+        ``usage`` extracts the actual token count from the result, and
+        ``on_permit`` is called with the permit (e.g. to record its queue wait).
+        The permit is held until ``fn`` returns, and waiting for it stops at
+        ``deadline``.
+        """
+        permit = self.acquire(model, tokens, session, priority, label, deadline)
+        if on_permit is not None:
+            on_permit(permit)
+        try:
+            result = fn()
+        except Exception as e:
+            permit.release(error=e)
+            raise
+        permit.release(usage(result) if usage else None)
+        return result
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]], model: str, tokens: int, session: str = "", priority: int = 0,
+                    label: str = "", usage: Optional[Callable[[Any], Optional[int]]] = None,
+                    on_permit: Optional[Callable[[Permit], None]] = None,
+                    deadline: Optional[Deadline] = None) -> Any:
+        """Async version of :meth:`call`."""
+        permit = await self.aacquire(model, tokens, session, priority, label, deadline)
+        if on_permit is not None:
+            on_permit(permit)
+        try:
+            result = await fn()
+        except BaseException as e:
+            permit.release(error=e)
+            raise
+        permit.release(usage(result) if usage else None)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters of the limiter since it was created."""
+        with self._lock:
+            return {
+                "granted": self.granted,
+                "in_flight": self.in_flight,
+                "queued": len(self._waiting),
+                "queue_wait_seconds": round(self.queue_wait_seconds, 3),
+                "rate_limited": self.rate_limited,
+            }
+
+    # Scheduling
+    def _enqueue(self, model, tokens, session, priority, label, wake) -> _Waiter:
+        with self._lock:
+            # Start-time fair queueing: a session's next call starts after its previous one
+            tag = max(self._virtual_time, self._session_tags.get(session, 0.0)) + 1.0
+            self._session_tags[session] = tag
+            key = (priority, NODE_PRIORITIES.get(label, 0), tag, next(self._seq))
+            waiter = _Waiter(key, model, tokens, session, wake)
+            self._waiting.append(waiter)
+            granted = self._dispatch()
+        for w in granted:
+            w.wake()
+        return waiter
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Take a waiter that gave up out of the queue; True if it was granted meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiting.remove(waiter)
+            return False
+
+    def _permit(self, waiter: _Waiter) -> Permit:
+        queue_wait = time.monotonic() - waiter.enqueued
+        with self._lock:
+            self.queue_wait_seconds += queue_wait
+        return Permit(self, waiter.model, waiter.tokens, queue_wait)
+
+    def _release(self, permit: Permit, used_tokens: Optional[int], error: Optional[BaseException]) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            requests, tokens = self._model_buckets(permit.model)
+            if tokens is not None and used_tokens is not None:
+                tokens.take(used_tokens - permit.tokens)
+            if error is not None and classify_error(error) == RATE_LIMITED:
+                # The server disagrees with our accounting: hold back every caller of this model
+                self.rate_limited += 1
+                now = time.monotonic()
+                for bucket in (requests, tokens):
+                    if bucket is not None:
+                        bucket.drain(now)
+            granted = self._dispatch()
+        for w in granted:
+            w.wake()
+
+    def _model_buckets(self, model: str) -> Tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        buckets = self._buckets.get(model)
+        if buckets is None:
+            limits = self.model_limits.get(model, self.default_limits)
+            buckets = (
+                TokenBucket(limits.requests_per_minute) if limits.requests_per_minute > 0 else None,
+                TokenBucket(limits.tokens_per_minute) if limits.tokens_per_minute > 0 else None,
+            )
+            self._buckets[model] = buckets
+        return buckets
+
+    def _dispatch(self) -> List[_Waiter]:
+        """Grant every waiter that may start now, in fair order. Caller holds ``_lock``."""
+        now = time.monotonic()
+        granted, blocked = [], set()
+        next_check = None
+        for waiter in sorted(self._waiting, key=lambda w: w.key):
+            if self.max_concurrency > 0 and self.in_flight >= self.max_concurrency:
+                break
+            if waiter.model in blocked:
+                # Don't let later calls to the same model overtake the one that is waiting
+                continue
+            requests, tokens = self._model_buckets(waiter.model)
+            wait = max(
+                requests.wait_time(1, now) if requests is not None else 0.0,
+                tokens.wait_time(waiter.tokens, now) if tokens is not None else 0.0,
+            )
+            if wait > 0:
+                blocked.add(waiter.model)
+                next_check = wait if next_check is None else min(next_check, wait)
+                continue
+            if requests is not None:
+                requests.take(1)
+            if tokens is not None:
+                tokens.take(waiter.tokens)
+            self.in_flight += 1
+            self.granted += 1
+            self._virtual_time = max(self._virtual_time, waiter.key[2])
+            waiter.granted = True
+            self._waiting.remove(waiter)
+            granted.append(waiter)
+
+        if granted and len(self._session_tags) > 256:
+            # Tags at or behind the virtual time behave exactly like a missing tag
+            self._session_tags = {
+                s: t for s, t in self._session_tags.items() if t > self._virtual_time
+            }
+        if next_check is not None:
+            self._schedule(now + next_check)
+        return granted
+
+    def _schedule(self, at: float) -> None:
+        """Re-run the dispatcher at ``at`` (monotonic time) when buckets have refilled."""
+        if self._timer is not None and self._timer_at <= at:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_at = at
+        self._timer = threading.Timer(max(0.0, at - time.monotonic()) + 0.001, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+            granted = self._dispatch()
+        for w in granted:
+            w.wake()
+
+
+def _queue_deadline_error(deadline: Deadline, label: str) -> DeadlineExceededError:
+    return DeadlineExceededError(
+        f"The run deadline of {deadline.seconds:g}s passed while {label or 'a call'} waited for a permit"
+    )
+
+
+def get_rate_limiter(
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    requests_per_minute: float = 0,
+    tokens_per_minute: float = 0,
+    rate_limits: str = "",
+) -> RateLimiter:
+    """Return the process-wide limiter for these settings, shared by every graph and session."""
+    key = (max_concurrency, requests_per_minute, tokens_per_minute, rate_limits)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                limiter = RateLimiter(
+                    max_concurrency,
+                    ModelLimits(requests_per_minute, tokens_per_minute),
+                    parse_rate_limits(rate_limits),
+                )
+                _limiters[key] = limiter
+    return limiter
+
+
+def share_limits(configurable, parts: int) -> Dict[str, Any]:
+    """Configuration values that give each of ``parts`` processes an equal share of the quota.
+
+    Limiters are per process, so processes running against the same API quota
+    split the concurrency limit and every per-minute quota between them.
+
+    Args:
+        configurable: The :class:`agent.configuration.Configuration` to split
+        parts: Number of processes sharing the quota
+    """
+    parts = max(1, parts)
+    concurrency = configurable.max_concurrent_requests
+    return {
+        "max_concurrent_requests": max(1, concurrency // parts) if concurrency > 0 else 0,
+        "requests_per_minute": configurable.requests_per_minute / parts,
+        "tokens_per_minute": configurable.tokens_per_minute / parts,
+        "rate_limits": ",".join(
+            f"{model}={limits.requests_per_minute / parts:g}/{limits.tokens_per_minute / parts:g}"
+            for model, limits in parse_rate_limits(configurable.rate_limits).items()
+        ),
+    }
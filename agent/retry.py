@@ -0,0 +1,394 @@
+"""
+Retry and backoff for Gemini API calls.
+
+Every model call in the agent goes through :func:`call_with_retry` (or
+:func:`acall_with_retry` in the async graph), which classifies failures (rate
+limits, overloaded/unavailable servers, timeouts and dropped connections),
+waits using exponential backoff with full jitter, honours server supplied retry
+hints and draws from a :class:`RetryBudget` shared by the whole run so that a
+single research session can't stall for minutes.
+
+Calls can also be bounded in time: each attempt by a per-call timeout (the
+HTTP timeout of the request, or :func:`acall_with_timeout` for a task), and
+the run as a whole by a :class:`Deadline` that no retry may wait past.
+"""
+
+import asyncio
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# Defaults used when no configuration is available
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 30.0
+DEFAULT_BUDGET_RETRIES = 20
+DEFAULT_BUDGET_SECONDS = 60.0
+
+# Error categories that are worth retrying
+RATE_LIMITED = "rate_limited"
+UNAVAILABLE = "unavailable"
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+
+_STATUS_CATEGORIES = {
+    429: RATE_LIMITED,
+    500: UNAVAILABLE,
+    502: UNAVAILABLE,
+    503: UNAVAILABLE,
+    504: TIMEOUT,
+}
+
+# google.rpc status names, as in ``google.genai.errors.APIError.status``
+_STATUS_NAME_CATEGORIES = {
+    "RESOURCE_EXHAUSTED": RATE_LIMITED,
+    "UNAVAILABLE": UNAVAILABLE,
+    "INTERNAL": UNAVAILABLE,
+    "DEADLINE_EXCEEDED": TIMEOUT,
+}
+
+# Exception classes matched by name to avoid importing their packages:
+# httpx / httpcore / aiohttp, google.api_core and langchain model errors
+_CONNECTION_ERROR_NAMES = {
+    "ConnectError", "ReadError", "WriteError", "RemoteProtocolError",
+    "ServerDisconnectedError", "ClientConnectionError",
+}
+_ERROR_NAME_CATEGORIES = {
+    "ResourceExhausted": RATE_LIMITED,
+    "TooManyRequests": RATE_LIMITED,
+    "ModelRateLimitError": RATE_LIMITED,
+    "ServiceUnavailable": UNAVAILABLE,
+    "InternalServerError": UNAVAILABLE,
+    "BadGateway": UNAVAILABLE,
+    "DeadlineExceeded": TIMEOUT,
+    "GatewayTimeout": TIMEOUT,
+}
+
+# Last resort for errors that only carry a message: a leading HTTP status, or
+# a quoted status field of a JSON error body
+_MESSAGE_PATTERNS = [
+    (re.compile(r"^\s*429\b|['\"]status['\"]\s*:\s*['\"]RESOURCE_EXHAUSTED['\"]"), RATE_LIMITED),
+    (re.compile(r"^\s*50[023]\b|['\"]status['\"]\s*:\s*['\"](UNAVAILABLE|INTERNAL)['\"]"), UNAVAILABLE),
+    (re.compile(r"^\s*504\b|['\"]status['\"]\s*:\s*['\"]DEADLINE_EXCEEDED['\"]"), TIMEOUT),
+]
+
+_RETRY_DELAY_PATTERN = re.compile(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", re.I)
+
+
+class RetryExhaustedError(Exception):
+    """Raised when a retryable error persists after all allowed retries."""
+
+    def __init__(self, message: str, category: str):
+        super().__init__(message)
+        self.category = category
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a call can't finish (or be retried) before the run's deadline."""
+
+
+def classify_error(error: BaseException) -> Optional[str]:
+    """Return the retry category of an error, or None if it should not be retried.
+
+    Errors are classified by their type and the API status they carry (an
+    HTTP status code or a ``google.rpc`` status name), also on the errors
+    they were raised from, e.g. the ``google.genai`` error inside a langchain
+    one. Only errors that carry neither are matched on their message, and then
+    only on a leading status code or a quoted ``status`` field.
+    """
+    if isinstance(error, (RetryExhaustedError, DeadlineExceededError)):
+        # Already retried as far as allowed further down the stack, or out of time
+        return None
+    seen = set()
+    cause: Optional[BaseException] = error
+    while cause is not None and id(cause) not in seen:
+        seen.add(id(cause))
+        category = _classify_exception(cause)
+        if category is not None:
+            return category
+        cause = cause.__cause__
+
+    message = str(error)
+    for pattern, category in _MESSAGE_PATTERNS:
+        if pattern.search(message):
+            return category
+    return None
+
+
+def _classify_exception(error: BaseException) -> Optional[str]:
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if code is None:
+        code = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(code, int) and code in _STATUS_CATEGORIES:
+        return _STATUS_CATEGORIES[code]
+    status = getattr(error, "status", None)
+    if isinstance(status, str) and status in _STATUS_NAME_CATEGORIES:
+        return _STATUS_NAME_CATEGORIES[status]
+
+    if isinstance(error, TimeoutError):
+        return TIMEOUT
+    if isinstance(error, ConnectionError):
+        return CONNECTION
+    for cls in type(error).__mro__:
+        name = cls.__name__
+        if name in _ERROR_NAME_CATEGORIES:
+            return _ERROR_NAME_CATEGORIES[name]
+        if "Timeout" in name:
+            return TIMEOUT
+        if name in _CONNECTION_ERROR_NAMES:
+            return CONNECTION
+    return None
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Extract a server supplied retry hint (Retry-After header or RetryInfo)."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        try:
+            value = headers.get("retry-after")
+        except Exception:
+            value = None
+        if value:
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                pass
+
+    match = _RETRY_DELAY_PATTERN.search(str(getattr(error, "details", "") or "") + str(error))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Per-call retry settings."""
+
+    max_retries: int = DEFAULT_MAX_RETRIES
+    base_delay: float = DEFAULT_BASE_DELAY
+    max_delay: float = DEFAULT_MAX_DELAY
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter for the given (1-based) attempt."""
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+
+class RetryBudget:
+    """Retry allowance shared by every call made during one run.
+
+    Tracks how many retries were made (overall and per category) and how long
+    was spent waiting, and refuses further retries once either limit is hit.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = DEFAULT_BUDGET_RETRIES,
+        max_wait_seconds: float = DEFAULT_BUDGET_SECONDS,
+    ):
+        self.max_retries = max_retries
+        self.max_wait_seconds = max_wait_seconds
+        self.retries = 0
+        self.wait_seconds = 0.0
+        self.by_category: Dict[str, int] = {}
+        self.by_label: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def try_spend(self, delay: float, category: str, label: str = "") -> bool:
+        """Reserve one retry waiting ``delay`` seconds. Returns False if exhausted."""
+        with self._lock:
+            if self.retries >= self.max_retries:
+                return False
+            if self.wait_seconds + delay > self.max_wait_seconds:
+                return False
+            self.retries += 1
+            self.wait_seconds += delay
+            self.by_category[category] = self.by_category.get(category, 0) + 1
+            if label:
+                self.by_label[label] = self.by_label.get(label, 0) + 1
+            return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the retry counters as a plain dictionary."""
+        with self._lock:
+            return {
+                "retries": self.retries,
+                "retry_wait_seconds": round(self.wait_seconds, 3),
+                "retries_by_category": dict(self.by_category),
+                "retries_by_node": dict(self.by_label),
+            }
+
+
+class Deadline:
+    """Wall-clock limit of one run, shared by every call it makes."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires
+
+    def check(self, label: str = "") -> None:
+        """Raise :class:`DeadlineExceededError` if the deadline has passed."""
+        if self.expired():
+            raise DeadlineExceededError(
+                f"The run deadline of {self.seconds:g}s passed{' before ' + label if label else ''}"
+            )
+
+    def timeout(self, call_timeout: float = 0) -> float:
+        """Timeout of the next call: the per-call timeout (0 for none), capped by the time left."""
+        # A timeout of 0 would mean none at all
+        remaining = max(0.001, self.remaining())
+        return min(call_timeout, remaining) if call_timeout > 0 else remaining
+
+
+def _default_notify(label: str, category: str, attempt: int, max_retries: int, delay: float):
+    print(
+        f"Gemini API call{' in ' + label if label else ''} failed ({category}). "
+        f"Retrying ({attempt}/{max_retries}) in {delay:.1f} seconds..."
+    )
+
+
+def next_delay(
+    error: BaseException,
+    attempt: int,
+    policy: RetryPolicy,
+    budget: Optional[RetryBudget],
+    label: str = "",
+) -> float:
+    """Decide whether to retry ``error`` and how long to wait first.
+
+    Returns the delay in seconds, or re-raises the error (or a
+    :class:`RetryExhaustedError`) when the call should not be retried.
+    """
+    category = classify_error(error)
+    if category is None:
+        # For other errors, don't retry
+        raise error
+
+    if attempt > policy.max_retries:
+        raise RetryExhaustedError(
+            f"Gemini API call failed ({category}) after {policy.max_retries} retries. "
+            "Please try again later.",
+            category,
+        ) from error
+
+    hint = retry_after_seconds(error)
+    delay = hint if hint is not None else policy.backoff(attempt)
+    if budget is not None and not budget.try_spend(delay, category, label):
+        raise RetryExhaustedError(
+            f"Gemini API call failed ({category}) and the run's retry budget is exhausted.",
+            category,
+        ) from error
+    return delay
+
+
+def _check_retry_time(error: Exception, delay: float, deadline: Optional[Deadline], label: str) -> None:
+    if deadline is not None and delay >= deadline.remaining():
+        raise DeadlineExceededError(
+            f"{label or 'Gemini API call'} failed and the run deadline of {deadline.seconds:g}s "
+            f"leaves no time to retry: {error}"
+        ) from error
+
+
+def call_with_retry(
+    fn: Callable[[], Any],
+    policy: Optional[RetryPolicy] = None,
+    budget: Optional[RetryBudget] = None,
+    label: str = "",
+    notify: Optional[Callable[..., None]] = _default_notify,
+    deadline: Optional[Deadline] = None,
+) -> Any:
+    """Call ``fn`` and retry transient failures.
+
+    Args:
+        fn: Zero-argument callable performing the API call
+        policy: Per-call retry settings
+        budget: Optional retry budget shared across the run
+        label: Name of the caller, used in messages and retry statistics
+        notify: Callback invoked before each retry, or None to stay quiet
+        deadline: Optional run deadline; a retry that would start after it
+            raises :class:`DeadlineExceededError` instead
+
+    Returns:
+        Whatever ``fn`` returns.
+    """
+    policy = policy or RetryPolicy()
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            attempt += 1
+            delay = next_delay(e, attempt, policy, budget, label)
+            _check_retry_time(e, delay, deadline, label)
+            if notify is not None:
+                notify(label, classify_error(e), attempt, policy.max_retries, delay)
+            time.sleep(delay)
+
+
+async def acall_with_retry(
+    fn: Callable[[], Awaitable[Any]],
+    policy: Optional[RetryPolicy] = None,
+    budget: Optional[RetryBudget] = None,
+    label: str = "",
+    notify: Optional[Callable[..., None]] = _default_notify,
+    deadline: Optional[Deadline] = None,
+) -> Any:
+    """Async version of :func:`call_with_retry`; waits with ``asyncio.sleep``.
+
+    ``fn`` must return a new awaitable on every call.
+    """
+    policy = policy or RetryPolicy()
+    attempt = 0
+    while True:
+        try:
+            return await fn()
+        except Exception as e:
+            attempt += 1
+            delay = next_delay(e, attempt, policy, budget, label)
+            _check_retry_time(e, delay, deadline, label)
+            if notify is not None:
+                notify(label, classify_error(e), attempt, policy.max_retries, delay)
+            await asyncio.sleep(delay)
+
+
+def get_retry_budget(config: Optional[dict]) -> Optional[RetryBudget]:
+    """Return the run's retry budget from a RunnableConfig, if one was provided."""
+    if not config:
+        return None
+    return config.get("configurable", {}).get("retry_budget")
+
+
+def run_deadline(seconds: float) -> Optional[Deadline]:
+    """A deadline ``seconds`` from now for a new run, or None if ``seconds`` is 0."""
+    return Deadline(seconds) if seconds > 0 else None
+
+
+def get_deadline(config: Optional[dict]) -> Optional[Deadline]:
+    """Return the run's deadline from a RunnableConfig, if one was provided."""
+    if not config:
+        return None
+    return config.get("configurable", {}).get("deadline")
+
+
+async def acall_with_timeout(fn: Callable[[], Awaitable[Any]], timeout: Optional[float]) -> Any:
+    """Await ``fn()``, cancelling it and raising ``TimeoutError`` after ``timeout`` seconds.
+
+    Blocking calls have no equivalent: a thread can't be interrupted, so they
+    rely on the HTTP timeout of the request instead.
+    """
+    if not timeout:
+        return await fn()
+    try:
+        return await asyncio.wait_for(fn(), timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"The call timed out after {timeout:g}s") from None
@@ -0,0 +1,592 @@
+"""
+Local HTTP/JSON research service.
+
+``main.py serve`` keeps one process warm (imports, the compiled async graph,
+model clients, caches and the shared rate limiter) and exposes research over
+HTTP:
+
+- ``POST /research`` with ``{"query": ..., "difficulty": ..., "model": ...,
+  "config": {...}}`` submits a run and returns ``202`` with its id; ``config``
+  may only set the per-run fields in ``REQUEST_CONFIG_FIELDS`` (paths, the
+  backend, quotas and caching stay under the control of the server)
+- ``GET /research/<id>`` returns its status (and the result when finished);
+  ``?wait=SECONDS`` long-polls until it finishes (at most ``MAX_WAIT_SECONDS``)
+- ``GET /research/<id>/events`` streams its progress as server-sent events
+  (``node``, ``answer_delta``, then ``done``, ``error`` or ``cancelled``);
+  reconnecting with ``Last-Event-ID`` resumes where the stream left off
+- ``DELETE /research/<id>`` (or ``POST /research/<id>/cancel``) cancels it
+- ``GET /health`` reports the load
+
+Runs execute as tasks on one background event loop, at most ``workers`` at a
+time. Admission control keeps at most ``max_queue`` runs waiting: beyond
+that a submit gets ``429`` with a ``Retry-After`` estimated from recent run
+times, and ``503`` while the service shuts down.
+"""
+
+import asyncio
+import json
+import math
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from agent.batch import unique_sources
+from agent.metrics import RunMetrics
+from agent.retry import RetryBudget, run_deadline
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_QUEUE = 32
+# Finished runs kept for polling
+DEFAULT_RETENTION = 1000
+# Assumed run time until some runs have finished
+DEFAULT_RUN_SECONDS = 30.0
+MAX_BODY_BYTES = 64 * 1024
+# Longest ``?wait=`` a status request may block a handler thread for
+MAX_WAIT_SECONDS = 60.0
+SSE_KEEPALIVE_SECONDS = 15.0
+DIFFICULTIES = ("easy", "medium", "hard")
+FINAL_STATUSES = ("done", "error", "cancelled")
+
+# Configuration fields a request may set; everything else is the server's
+REQUEST_CONFIG_FIELDS = frozenset({
+    "query_generator_model",
+    "reflection_model",
+    "answer_model",
+    "number_of_initial_queries",
+    "max_research_loops",
+    "stopping_policy",
+    "min_new_sources",
+    "max_summary_overlap",
+    "research_time_budget_seconds",
+    "research_token_budget",
+    "run_deadline_seconds",
+    "stream_answer",
+    "incremental_reflection",
+    "answer_group_size",
+    "dedup_follow_up_queries",
+    "follow_up_dedup_threshold",
+})
+
+# State update keys that are small enough to include in progress events
+_EVENT_FIELDS = (
+    "query_list",
+    "search_query",
+    "follow_up_queries",
+    "is_sufficient",
+    "research_loop_count",
+    "skipped_follow_up_queries",
+    "history_matches",
+    "stopping_decisions",
+    "failed_searches",
+)
+
+
+class ServiceBusy(Exception):
+    """The queue is full; retry after ``retry_after`` seconds."""
+
+    def __init__(self, retry_after: int, message: str = "Too many queued research runs"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ServiceUnavailable(Exception):
+    """The service is shutting down."""
+
+
+def _summarize_update(value: Dict[str, Any]) -> Dict[str, Any]:
+    summary = {key: value[key] for key in _EVENT_FIELDS if key in value}
+    if "sources_gathered" in value:
+        summary["sources"] = len(value["sources_gathered"])
+    return summary
+
+
+def _record_history(configurable, query: str, final_state: Dict[str, Any]) -> None:
+    from agent.history import get_research_history
+
+    get_research_history(configurable.research_history_path).add_state(
+        query, final_state, configurable.max_research_loops
+    )
+
+
+class Job:
+    """One submitted research run and its event log."""
+
+    def __init__(self, query: str, difficulty: str, config: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.query = query
+        self.difficulty = difficulty
+        self.config = config
+        self.status = "queued"
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.events: List[Dict[str, Any]] = []
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        record = {
+            "id": self.id,
+            "query": self.query,
+            "difficulty": self.difficulty,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "events": len(self.events),
+        }
+        if self.result is not None:
+            record["result"] = self.result
+        if self.error is not None:
+            record["error"] = self.error
+        return record
+
+
+class ResearchService:
+    """Runs research jobs on a warm async graph with bounded concurrency.
+
+    Args:
+        configure: Returns the base configurable values for a difficulty and
+            an optional model (``main.configure_for_difficulty``)
+        base_config: Values applied to every run (e.g. the model backend)
+        workers: Maximum number of runs executing at the same time
+        max_queue: Maximum number of runs waiting for a worker
+        retention: Number of finished runs kept for polling
+        default_difficulty: Difficulty of runs that don't specify one
+    """
+
+    def __init__(
+        self,
+        configure: Callable[[str, Optional[str]], Dict[str, Any]],
+        base_config: Optional[Dict[str, Any]] = None,
+        workers: int = DEFAULT_WORKERS,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        retention: int = DEFAULT_RETENTION,
+        default_difficulty: str = "medium",
+    ):
+        self.configure = configure
+        self.base_config = dict(base_config or {})
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.retention = retention
+        self.default_difficulty = default_difficulty
+        self.accepting = False
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._pending: deque = deque()
+        self._running = 0
+        self._durations: deque = deque(maxlen=50)
+        self._counts = {status: 0 for status in FINAL_STATUSES}
+        self._cond = threading.Condition()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._graph = None
+
+    # Lifecycle
+    def start(self) -> None:
+        """Compile the graph, warm up the model backend and start the event loop."""
+        from agent.backends import get_backend
+        from agent.configuration import Configuration
+        from agent.graph import create_async_graph_for_direct_use
+
+        self._graph = create_async_graph_for_direct_use()
+        config = {**self.configure(self.default_difficulty, None), **self.base_config}
+        get_backend(Configuration.from_runnable_config({"configurable": config}).model_backend)
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="research-service", daemon=True
+        )
+        self._thread.start()
+        self.accepting = True
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stop accepting runs, cancel the unfinished ones and stop the event loop."""
+        with self._cond:
+            self.accepting = False
+            jobs = [job for job in self._jobs.values() if job.status not in FINAL_STATUSES]
+        for job in jobs:
+            self.cancel(job.id)
+        deadline = time.time() + timeout
+        with self._cond:
+            while self._running and time.time() < deadline:
+                self._cond.wait(deadline - time.time())
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+
+    # Client operations
+    def submit(
+        self,
+        query: str,
+        difficulty: Optional[str] = None,
+        model: Optional[str] = None,
+        overrides: Optional[Dict[str, Any]] = None,
+    ) -> Job:
+        """Queue a research run.
+
+        Raises:
+            ValueError: On an empty query, an unknown difficulty, overrides
+                outside ``REQUEST_CONFIG_FIELDS`` or invalid configuration values
+            ServiceBusy: When the queue is full
+            ServiceUnavailable: When the service is not accepting runs
+        """
+        from agent.configuration import Configuration
+
+        if not query or not query.strip():
+            raise ValueError("'query' must be a non-empty string")
+        difficulty = difficulty or self.default_difficulty
+        if difficulty not in DIFFICULTIES:
+            raise ValueError(f"'difficulty' must be one of {', '.join(DIFFICULTIES)}")
+        refused = sorted(set(overrides or {}) - REQUEST_CONFIG_FIELDS)
+        if refused:
+            raise ValueError(
+                f"Configuration fields that can't be set per request: {', '.join(refused)} "
+                f"(allowed: {', '.join(sorted(REQUEST_CONFIG_FIELDS))})"
+            )
+        config = {**self.configure(difficulty, model), **self.base_config, **(overrides or {})}
+        # Invalid values fail the submit rather than the run
+        Configuration.from_runnable_config({"configurable": config})
+        job = Job(query.strip(), difficulty, config)
+        with self._cond:
+            if not self.accepting:
+                raise ServiceUnavailable("The research service is shutting down")
+            if len(self._pending) >= self.max_queue and self._running >= self.workers:
+                raise ServiceBusy(self._retry_after())
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._evict()
+        self._loop.call_soon_threadsafe(self._dispatch)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """Wait up to ``timeout`` seconds for the run to finish."""
+        deadline = time.time() + timeout
+        with self._cond:
+            job = self._jobs.get(job_id)
+            while job is not None and job.status not in FINAL_STATUSES:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return job
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a queued or running run; finished runs are left as they are."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINAL_STATUSES:
+                return job
+            if job.status == "queued":
+                self._pending.remove(job)
+                self._finish(job, "cancelled")
+                return job
+        # Running: the task records the cancellation itself
+        self._loop.call_soon_threadsafe(lambda: job.task and job.task.cancel())
+        return job
+
+    def events(self, job_id: str, after: int = -1) -> Iterator[Optional[Dict[str, Any]]]:
+        """Yield the run's events after index ``after`` until it finishes.
+
+        ``None`` is yielded when no event arrived for ``SSE_KEEPALIVE_SECONDS``.
+        """
+        position = after + 1
+        while True:
+            with self._cond:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    return
+                if position >= len(job.events) and job.status not in FINAL_STATUSES:
+                    self._cond.wait(SSE_KEEPALIVE_SECONDS)
+                new_events = job.events[position:]
+                finished = job.status in FINAL_STATUSES
+            if not new_events and not finished:
+                yield None
+            for event in new_events:
+                yield event
+            position += len(new_events)
+            if finished and position >= len(job.events):
+                return
+
+    def health(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "status": "ok" if self.accepting else "stopping",
+                "workers": self.workers,
+                "running": self._running,
+                "queued": len(self._pending),
+                "max_queue": self.max_queue,
+                "finished": dict(self._counts),
+                "mean_run_seconds": round(self._mean_duration(), 3),
+            }
+
+    # Scheduling (event loop thread)
+    def _dispatch(self) -> None:
+        with self._cond:
+            while self._pending and self._running < self.workers:
+                job = self._pending.popleft()
+                job.status = "running"
+                job.started = time.time()
+                self._running += 1
+                job.task = self._loop.create_task(self._run(job))
+            self._cond.notify_all()
+
+    async def _run(self, job: Job) -> None:
+        from langchain_core.messages import HumanMessage
+        from agent.configuration import Configuration
+
+        configurable = Configuration.from_runnable_config({"configurable": job.config})
+        retry_budget = RetryBudget(max_wait_seconds=configurable.retry_budget_seconds)
+        metrics = RunMetrics()
+        run_config = {"configurable": {
+            **job.config,
+            "configuration": configurable,
+            "retry_budget": retry_budget,
+            "deadline": run_deadline(configurable.run_deadline_seconds),
+            "metrics": metrics,
+            "thread_id": job.id,
+        }}
+        state = {
+            "messages": [HumanMessage(content=job.query)],
+            "reasoning_model": job.config.get("reasoning_model"),
+        }
+        try:
+            final_state = None
+            async for mode, chunk in self._graph.astream(
+                state, run_config, stream_mode=["updates", "values", "custom"]
+            ):
+                if mode == "updates":
+                    for node, value in (chunk or {}).items():
+                        self._emit(job, "node", {"node": node, **_summarize_update(value or {})})
+                elif mode == "custom":
+                    if isinstance(chunk, dict) and chunk.get("answer_delta"):
+                        self._emit(job, "answer_delta", {"text": chunk["answer_delta"]})
+                else:
+                    final_state = chunk
+            run_metrics = retry_budget.snapshot()
+            run_metrics["reflection_usage"] = final_state.get("reflection_usage", [])
+            run_metrics["searches_saved"] = len(final_state.get("skipped_follow_up_queries", []))
+            run_metrics["stopping_decisions"] = final_state.get("stopping_decisions", [])
+            run_metrics["failed_searches"] = final_state.get("failed_searches", [])
+            run_metrics["history_matches"] = final_state.get("history_matches", [])
+            run_metrics["nodes"] = metrics.summary()
+            result = {
+                "answer": final_state["messages"][-1].content if final_state.get("messages") else "",
+                "sources": unique_sources(final_state.get("sources_gathered", [])),
+                "run_metrics": run_metrics,
+            }
+            if configurable.research_history:
+                try:
+                    # A blocking SQLite write: keep it off the event loop the other runs share
+                    await asyncio.to_thread(
+                        _record_history, configurable, job.query, final_state
+                    )
+                except sqlite3.Error as e:
+                    result["history_error"] = str(e)
+            self._complete(job, "done", result=result)
+        except asyncio.CancelledError:
+            self._complete(job, "cancelled")
+        except Exception as e:
+            self._complete(job, "error", error=f"{type(e).__name__}: {e}")
+        finally:
+            metrics.finish()
+
+    def _emit(self, job: Job, kind: str, data: Dict[str, Any]) -> None:
+        with self._cond:
+            job.events.append({"id": len(job.events), "event": kind, "data": data})
+            self._cond.notify_all()
+
+    def _complete(self, job: Job, status: str, result=None, error=None) -> None:
+        with self._cond:
+            self._running -= 1
+            self._durations.append(time.time() - job.started)
+            job.result, job.error = result, error
+            self._finish(job, status)
+        self._dispatch()
+
+    def _finish(self, job: Job, status: str) -> None:
+        # Caller holds the condition
+        job.status = status
+        job.finished = time.time()
+        data = {"status": status}
+        if job.result is not None:
+            data.update(job.result)
+        if job.error is not None:
+            data["error"] = job.error
+        job.events.append({"id": len(job.events), "event": status, "data": data})
+        self._counts[status] += 1
+        self._cond.notify_all()
+
+    def _mean_duration(self) -> float:
+        if not self._durations:
+            return DEFAULT_RUN_SECONDS
+        return sum(self._durations) / len(self._durations)
+
+    def _retry_after(self) -> int:
+        # Roughly when a queue slot frees up: the runs ahead drain `workers` at a time
+        waves = math.ceil((len(self._pending) - self.max_queue + 1) / self.workers)
+        return max(1, math.ceil(max(1, waves) * self._mean_duration()))
+
+    def _evict(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINAL_STATUSES]
+        for job_id in finished[: max(0, len(finished) - self.retention)]:
+            del self._jobs[job_id]
+
+
+class ResearchRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end of the :class:`ResearchService` at ``self.server.service``."""
+
+    server_version = "agentblack-search"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def service(self) -> ResearchService:
+        return self.server.service
+
+    def log_message(self, format, *args):
+        if not getattr(self.server, "quiet", False):
+            super().log_message(format, *args)
+
+    # Routing
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        if parts == ["health"]:
+            return self._send_json(HTTPStatus.OK, self.service.health())
+        if len(parts) == 2 and parts[0] == "research":
+            wait = parse_qs(url.query).get("wait")
+            try:
+                timeout = float(wait[0]) if wait else 0.0
+            except ValueError:
+                timeout = math.nan
+            if math.isnan(timeout):
+                return self._send_error(HTTPStatus.BAD_REQUEST, "'wait' must be a number of seconds")
+            timeout = min(timeout, MAX_WAIT_SECONDS)
+            job = self.service.wait(parts[1], timeout) if timeout > 0 else self.service.get(parts[1])
+            if job is None:
+                return self._send_error(HTTPStatus.NOT_FOUND, "Unknown research run")
+            return self._send_json(HTTPStatus.OK, job.to_dict())
+        if len(parts) == 3 and parts[0] == "research" and parts[2] == "events":
+            return self._stream_events(parts[1])
+        return self._send_error(HTTPStatus.NOT_FOUND, "Not found")
+
+    def do_POST(self):
+        parts = [part for part in urlparse(self.path).path.split("/") if part]
+        if parts == ["research"]:
+            return self._submit()
+        if len(parts) == 3 and parts[0] == "research" and parts[2] == "cancel":
+            return self._cancel(parts[1])
+        return self._send_error(HTTPStatus.NOT_FOUND, "Not found")
+
+    def do_DELETE(self):
+        parts = [part for part in urlparse(self.path).path.split("/") if part]
+        if len(parts) == 2 and parts[0] == "research":
+            return self._cancel(parts[1])
+        return self._send_error(HTTPStatus.NOT_FOUND, "Not found")
+
+    # Endpoints
+    def _submit(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return self._send_error(HTTPStatus.BAD_REQUEST, "Content-Length must be a non-negative integer")
+        if length > MAX_BODY_BYTES:
+            return self._send_error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large")
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as e:
+            return self._send_error(HTTPStatus.BAD_REQUEST, f"Invalid JSON: {e}")
+        if not isinstance(body, dict):
+            return self._send_error(HTTPStatus.BAD_REQUEST, "The body must be a JSON object")
+        overrides = body.get("config")
+        if overrides is None:
+            overrides = {}
+        if not isinstance(overrides, dict):
+            return self._send_error(HTTPStatus.BAD_REQUEST, "'config' must be a JSON object")
+        query = body.get("query")
+        try:
+            job = self.service.submit(
+                query if isinstance(query, str) else "", body.get("difficulty"), body.get("model"), overrides
+            )
+        except ValueError as e:
+            return self._send_error(HTTPStatus.BAD_REQUEST, str(e))
+        except ServiceBusy as e:
+            return self._send_error(
+                HTTPStatus.TOO_MANY_REQUESTS, str(e), {"Retry-After": str(e.retry_after)}
+            )
+        except ServiceUnavailable as e:
+            return self._send_error(HTTPStatus.SERVICE_UNAVAILABLE, str(e), {"Retry-After": "30"})
+        record = job.to_dict()
+        record["links"] = {
+            "status": f"/research/{job.id}",
+            "events": f"/research/{job.id}/events",
+        }
+        return self._send_json(HTTPStatus.ACCEPTED, record, {"Location": f"/research/{job.id}"})
+
+    def _cancel(self, job_id: str):
+        job = self.service.cancel(job_id)
+        if job is None:
+            return self._send_error(HTTPStatus.NOT_FOUND, "Unknown research run")
+        return self._send_json(HTTPStatus.ACCEPTED, job.to_dict())
+
+    def _stream_events(self, job_id: str):
+        if self.service.get(job_id) is None:
+            return self._send_error(HTTPStatus.NOT_FOUND, "Unknown research run")
+        try:
+            after = int(self.headers.get("Last-Event-ID", -1))
+        except ValueError:
+            after = -1
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for event in self.service.events(job_id, after):
+                if event is None:
+                    self.wfile.write(b": keep-alive\n\n")
+                else:
+                    self.wfile.write(
+                        f"id: {event['id']}\nevent: {event['event']}\n"
+                        f"data: {json.dumps(event['data'], default=str)}\n\n".encode("utf-8")
+                    )
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away; the run itself continues
+            pass
+
+    # Responses
+    def _send_json(self, status: HTTPStatus, payload: Any, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: HTTPStatus, message: str, headers: Optional[Dict[str, str]] = None):
+        self._send_json(status, {"error": message}, headers)
+
+
+def create_server(service: ResearchService, host: str, port: int, quiet: bool = False) -> ThreadingHTTPServer:
+    """Bind the HTTP front end of ``service`` (start it with ``serve_forever``)."""
+    server = ThreadingHTTPServer((host, port), ResearchRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.quiet = quiet
+    return server
@@ -21,12 +21,22 @@ class OverallState(TypedDict):
     max_research_loops: int
     research_loop_count: int
     reasoning_model: str
+    research_digest: str
+    reflected_result_count: int
+    reflection_usage: Annotated[list, operator.add]
+    skipped_follow_up_queries: Annotated[list, operator.add]
+    history_matches: Annotated[list, operator.add]
+    stopping_decisions: Annotated[list, operator.add]
+    failed_searches: Annotated[list, operator.add]
 
 
 class ReflectionState(TypedDict):
     is_sufficient: bool
     knowledge_gap: str
-    follow_up_queries: Annotated[list, operator.add]
+    # Replaced by every reflection rather than added to: evaluate_research
+    # sends exactly the latest loop's follow-ups (an empty list, e.g. after
+    # deduplication or a stopping decision, ends the research)
+    follow_up_queries: list
     research_loop_count: int
     number_of_ran_queries: int
 
@@ -0,0 +1,165 @@
+"""
+Stopping policies for the research loop.
+
+Before each reflection the graph measures what the latest loop of web
+searches added: how many source URLs no earlier result had cited, how much
+of the new summaries' vocabulary already appeared in earlier summaries, and
+how much of the run's time and token budget is left. A stopping policy turns
+these signals into a decision; when it stops, the run goes straight to the
+final answer and the reflection call is skipped as well.
+
+Policies are registered by name and selected with the ``stopping_policy``
+setting: ``"fixed"`` (the default) only stops on ``is_sufficient`` and
+``max_research_loops``, the opt-in ``"marginal_gain"`` also stops loops that
+are unlikely to add information or don't fit the budget.
+
+The token budget counts the usage the API reported for every call so far
+(query generation, searches and reflections). Calls that reported no usage
+are left out of that estimate, so it can fall short of the real bill; the
+signals record how many such calls there were as ``unreported_token_calls``.
+"""
+
+import re
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional
+
+from agent.dedup import shingles
+from agent.utils import SHORT_URL_PREFIX
+
+_SHORT_URL_PATTERN = re.compile(re.escape(SHORT_URL_PREFIX) + r"[\w-]+")
+_LINK_PATTERN = re.compile(r"\[[^\]]*\]\([^)]*\)")
+
+
+def cited_urls(results: Iterable[str], sources: List[Dict[str, Any]]) -> set:
+    """Original URLs of the sources cited (by short URL) in ``results``."""
+    by_short_url = {
+        source["short_url"]: source["value"]
+        for source in sources
+        if isinstance(source, dict) and source.get("short_url")
+    }
+    return {
+        by_short_url.get(short_url, short_url)
+        for text in results
+        for short_url in _SHORT_URL_PATTERN.findall(text)
+    }
+
+
+def summary_overlap(new: List[str], earlier: List[str]) -> Optional[float]:
+    """Share of the new summaries' shingles that earlier summaries already contain."""
+    if not new or not earlier:
+        return None
+    new_shingles = shingles(_LINK_PATTERN.sub(" ", " ".join(new)))
+    if not new_shingles:
+        return None
+    earlier_shingles = shingles(_LINK_PATTERN.sub(" ", " ".join(earlier)))
+    return len(new_shingles & earlier_shingles) / len(new_shingles)
+
+
+def research_signals(
+    state: Dict[str, Any],
+    elapsed_seconds: Optional[float],
+    tokens_used: Optional[int],
+    unreported_token_calls: int = 0,
+) -> Dict[str, Any]:
+    """Marginal gain and budget signals of the loop that just finished.
+
+    Args:
+        state: Graph state at reflection time (``research_loop_count`` already
+            counts the loop that just finished)
+        elapsed_seconds: Run time so far, when known
+        tokens_used: Prompt and completion tokens the calls so far reported, when known
+        unreported_token_calls: Calls so far that reported no token usage
+    """
+    results = state["web_research_result"]
+    previous = state.get("reflected_result_count") or 0
+    earlier, new = results[:previous], results[previous:]
+    sources = state.get("sources_gathered", [])
+    earlier_urls = cited_urls(earlier, sources)
+    new_urls = cited_urls(new, sources) - earlier_urls
+    loop = state["research_loop_count"]
+    overlap = summary_overlap(new, earlier)
+    return {
+        "loop": loop,
+        "new_results": len(new),
+        "new_sources": len(new_urls),
+        "total_sources": len(earlier_urls) + len(new_urls),
+        "summary_overlap": round(overlap, 3) if overlap is not None else None,
+        "elapsed_seconds": round(elapsed_seconds, 3) if elapsed_seconds is not None else None,
+        "tokens_used": tokens_used,
+        "unreported_token_calls": unreported_token_calls,
+        # What one more loop (searches plus reflection) is expected to cost
+        "seconds_per_loop": round(elapsed_seconds / loop, 3) if elapsed_seconds and loop else None,
+        "tokens_per_loop": tokens_used // loop if tokens_used and loop else None,
+    }
+
+
+class StoppingPolicy(ABC):
+    """Decides from the loop signals whether to stop researching.
+
+    ``should_stop`` returns the reason for stopping, or None to let the
+    reflection decide. ``configurable`` is the run's
+    :class:`agent.configuration.Configuration`.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def should_stop(self, signals: Dict[str, Any], configurable) -> Optional[str]:
+        """The reason to stop after the loop described by ``signals``, or None."""
+
+
+class FixedLoopsPolicy(StoppingPolicy):
+    """Never stops early: only ``is_sufficient`` and ``max_research_loops`` end the research."""
+
+    name = "fixed"
+
+    def should_stop(self, signals, configurable):
+        return None
+
+
+class MarginalGainPolicy(StoppingPolicy):
+    """Stops when the last loop added little or another loop wouldn't fit the budget."""
+
+    name = "marginal_gain"
+
+    def should_stop(self, signals, configurable):
+        # The first loop has nothing to compare with
+        if signals["loop"] > 1:
+            if signals["new_sources"] < configurable.min_new_sources:
+                return f"the last loop found {signals['new_sources']} new sources"
+            overlap = signals["summary_overlap"]
+            if overlap is not None and overlap >= configurable.max_summary_overlap:
+                return f"new summaries overlap {overlap:.0%} with earlier ones"
+        budget = configurable.research_time_budget_seconds
+        if budget > 0 and signals["seconds_per_loop"] is not None:
+            if signals["elapsed_seconds"] + signals["seconds_per_loop"] > budget:
+                return f"another loop would exceed the {budget:g}s time budget"
+        budget = configurable.research_token_budget
+        if budget > 0 and signals["tokens_per_loop"] is not None:
+            if signals["tokens_used"] + signals["tokens_per_loop"] > budget:
+                return f"another loop would exceed the {budget} token budget"
+        return None
+
+
+_policies: Dict[str, StoppingPolicy] = {
+    FixedLoopsPolicy.name: FixedLoopsPolicy(),
+    MarginalGainPolicy.name: MarginalGainPolicy(),
+}
+_lock = threading.Lock()
+
+
+def register_stopping_policy(name: str, policy: StoppingPolicy) -> None:
+    """Make ``policy`` available as ``stopping_policy=name``."""
+    with _lock:
+        _policies[name] = policy
+
+
+def get_stopping_policy(name: str) -> StoppingPolicy:
+    """Return the policy registered as ``name``."""
+    policy = _policies.get(name)
+    if policy is None:
+        raise ValueError(
+            f"Unknown stopping policy {name!r} (available: {', '.join(sorted(_policies))})"
+        )
+    return policy
@@ -21,3 +21,9 @@ class Reflection(BaseModel):
     follow_up_queries: List[str] = Field(
         description="A list of follow-up queries to address the knowledge gap."
     )
+
+
+class IncrementalReflection(Reflection):
+    findings_digest: str = Field(
+        description="A compact digest of all key findings so far, including the latest summaries."
+    )
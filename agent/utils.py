@@ -1,3 +1,4 @@
+import re
 from typing import Any, Dict, List
 from langchain_core.messages import AnyMessage, AIMessage, HumanMessage
 
@@ -52,12 +53,34 @@ def insert_citation_markers(text, citations_list):
     """
     # Sort citations by end_index in descending order.
     # If end_index is the same, secondary sort by start_index descending.
-    # This ensures that insertions at the end of the string don't affect
-    # the indices of earlier parts of the string that still need to be processed.
+    # This is the order markers were historically inserted in, back to front.
     sorted_citations = sorted(
         citations_list, key=lambda c: (c["end_index"], c["start_index"]), reverse=True
     )
 
+    text_length = len(text)
+    if any(not 0 <= c["end_index"] <= text_length for c in sorted_citations):
+        # Out of range indices depend on the markers already inserted, keep the old behaviour
+        return _insert_citation_markers_back_to_front(text, sorted_citations)
+
+    # Walk the insertion points front to back and assemble the result in one join.
+    # Markers sharing an end_index end up in the reverse of the insertion order,
+    # exactly as repeated insertion at the same index would leave them.
+    pieces = []
+    position = 0
+    for citation_info in reversed(sorted_citations):
+        end_idx = citation_info["end_index"]
+        pieces.append(text[position:end_idx])
+        for segment in citation_info["segments"]:
+            pieces.append(f" [{segment['label']}]({segment['short_url']})")
+        position = end_idx
+    pieces.append(text[position:])
+
+    return "".join(pieces)
+
+
+def _insert_citation_markers_back_to_front(text, sorted_citations):
+    """Insert markers one at a time from the end of the text (O(n·k) copying)."""
     modified_text = text
     for citation_info in sorted_citations:
         # These indices refer to positions in the *original* text,
@@ -164,3 +187,122 @@ def get_citations(response, resolved_urls_map):
                     pass
         citations.append(citation)
     return citations
+
+
+SHORT_URL_PREFIX = "https://vertexaisearch.cloud.google.com/id/"
+CITATION_PATTERN = re.compile(r"\[\[?.*?\]?\]")
+
+
+class ShortUrlExpander:
+    """
+    Replaces short urls with their original urls in a single scan of the text.
+
+    The deduplicated short urls are compiled into one alternation, longest
+    first so that ``.../id/1-12`` is never mistaken for ``.../id/1-1``.
+    Every short url that was replaced is remembered so the sources actually
+    used by an answer can be reported.
+    """
+
+    def __init__(self, sources_gathered: List[Dict[str, Any]]):
+        self.sources_by_short_url: Dict[str, Dict[str, Any]] = {}
+        for source in sources_gathered:
+            short_url = source.get("short_url")
+            if short_url and short_url not in self.sources_by_short_url:
+                self.sources_by_short_url[short_url] = source
+        self.used_short_urls = set()
+        self._pattern = None
+        if self.sources_by_short_url:
+            alternatives = sorted(self.sources_by_short_url, key=len, reverse=True)
+            self._pattern = re.compile("|".join(map(re.escape, alternatives)))
+
+    def expand(self, text: str) -> str:
+        """Return ``text`` with every known short url replaced."""
+        if self._pattern is None:
+            return text
+        return self._pattern.sub(self._replace, text)
+
+    def used_sources(self) -> List[Dict[str, Any]]:
+        """Sources whose short url was replaced, in the order they were gathered."""
+        return [
+            source
+            for short_url, source in self.sources_by_short_url.items()
+            if short_url in self.used_short_urls
+        ]
+
+    def _replace(self, match) -> str:
+        short_url = match.group(0)
+        self.used_short_urls.add(short_url)
+        return self.sources_by_short_url[short_url]["value"]
+
+
+def expand_short_urls(text: str, sources_gathered: List[Dict[str, Any]]):
+    """
+    Replace the short urls in ``text`` with the original urls.
+
+    Returns:
+        tuple: The expanded text and the list of sources that were used.
+    """
+    expander = ShortUrlExpander(sources_gathered)
+    return expander.expand(text), expander.used_sources()
+
+
+class AnswerStreamRewriter:
+    """
+    Applies the final answer clean-up to a token stream.
+
+    The final answer has its bracketed citation labels removed and its short
+    urls replaced with the original urls. Doing that on a stream means a
+    citation or a short url may be split across chunks, so the rewriter keeps
+    a small rolling buffer: text is only released once no pending ``[`` on the
+    current line and no partially received short url can still change it.
+    """
+
+    def __init__(self, sources_gathered: List[Dict[str, Any]]):
+        self.expander = ShortUrlExpander(sources_gathered)
+        self._buffer = ""
+
+    def feed(self, text: str) -> str:
+        """Add streamed text and return the part of the answer that is final."""
+        self._buffer += text
+        cut = self._safe_length()
+        ready, self._buffer = self._buffer[:cut], self._buffer[cut:]
+        return self._rewrite(ready)
+
+    def flush(self) -> str:
+        """Return whatever is still buffered once the stream has ended."""
+        ready, self._buffer = self._buffer, ""
+        return self._rewrite(ready)
+
+    def used_sources(self) -> List[Dict[str, Any]]:
+        """Sources whose short url appeared in the answer."""
+        return self.expander.used_sources()
+
+    def _safe_length(self) -> int:
+        buffer = self._buffer
+        cut = len(buffer)
+        # Citations never span lines; on the last line a citation that ends the
+        # buffer may still grow ("[a]" -> "[a]]") and an unclosed "[" may still
+        # become one
+        line_start = buffer.rfind("\n") + 1
+        last = None
+        for last in CITATION_PATTERN.finditer(buffer, line_start):
+            pass
+        if last is not None and last.end() == len(buffer):
+            cut = last.start()
+        else:
+            bracket = buffer.find("[", last.end() if last is not None else line_start)
+            if bracket != -1:
+                cut = bracket
+        # A short url may still be growing (".../id/1-1" vs ".../id/1-12")
+        url_start = buffer.rfind(SHORT_URL_PREFIX)
+        if url_start != -1 and re.fullmatch(r"[\d-]*", buffer[url_start + len(SHORT_URL_PREFIX):]):
+            cut = min(cut, url_start)
+        else:
+            for size in range(min(len(SHORT_URL_PREFIX) - 1, len(buffer)), 0, -1):
+                if buffer.endswith(SHORT_URL_PREFIX[:size]):
+                    cut = min(cut, len(buffer) - size)
+                    break
+        return cut
+
+    def _rewrite(self, text: str) -> str:
+        return self.expander.expand(CITATION_PATTERN.sub("", text))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Cold-start benchmark for the CLI.
+
+Runs fresh interpreters and measures the wall time of:
+
+- ``main.py --help``
+- an argument error (``main.py --difficulty impossible``)
+- a real search up to the moment it first touches the network (the first DNS
+  lookup or socket connect is intercepted, so no request is actually sent)
+
+Usage:
+    python benchmarks/startup.py --repeat 5 --json startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Child process for the "first network call" scenario: the first DNS lookup or
+# connect prints the elapsed time since interpreter start and aborts the run.
+FIRST_CALL_SNIPPET = r"""
+import os, socket, sys, time
+start = float(os.environ["STARTUP_BENCH_T0"])
+
+def first_network_call(*args, **kwargs):
+    sys.__stdout__.write("FIRST_NETWORK_CALL %.6f\n" % (time.time() - start))
+    sys.__stdout__.flush()
+    os._exit(0)
+
+socket.getaddrinfo = first_network_call
+socket.create_connection = first_network_call
+socket.socket.connect = first_network_call
+sys.argv = ["main.py", "startup benchmark", "--difficulty", "easy", "--no-cache"]
+sys.path.insert(0, os.getcwd())
+import main
+main.main()
+"""
+
+
+def _run(args, env=None):
+    start = time.time()
+    proc = subprocess.run(
+        [sys.executable, *args],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        env={**os.environ, **(env or {})},
+    )
+    return time.time() - start, proc
+
+
+def measure_help():
+    elapsed, _ = _run(["main.py", "--help"])
+    return elapsed
+
+
+def measure_argument_error():
+    elapsed, _ = _run(["main.py", "--difficulty", "impossible"])
+    return elapsed
+
+
+def measure_first_network_call():
+    t0 = time.time()
+    _, proc = _run(
+        ["-c", FIRST_CALL_SNIPPET],
+        env={"STARTUP_BENCH_T0": repr(t0), "GEMINI_API_KEY": os.getenv("GEMINI_API_KEY", "benchmark")},
+    )
+    for line in proc.stdout.splitlines():
+        if line.startswith("FIRST_NETWORK_CALL"):
+            return float(line.split()[1])
+    raise RuntimeError(f"search never reached the network:\n{proc.stdout}\n{proc.stderr}")
+
+
+SCENARIOS = {
+    "help": measure_help,
+    "argument_error": measure_argument_error,
+    "first_network_call": measure_first_network_call,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure CLI cold-start latency.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per scenario (default: 5)")
+    parser.add_argument("--json", type=str, metavar="FILE", help="Also write the results to FILE")
+    args = parser.parse_args()
+
+    results = {}
+    for name, measure in SCENARIOS.items():
+        samples = [measure() for _ in range(args.repeat)]
+        results[name] = {
+            "median_seconds": round(statistics.median(samples), 4),
+            "min_seconds": round(min(samples), 4),
+            "max_seconds": round(max(samples), 4),
+            "samples": [round(sample, 4) for sample in samples],
+        }
+        print(f"{name:<20} median {results[name]['median_seconds']:.3f}s  "
+              f"min {results[name]['min_seconds']:.3f}s  max {results[name]['max_seconds']:.3f}s")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+"""
+Offline benchmark suite on the fake model backend.
+
+Needs no API key or network: every model call goes to
+:class:`agent.fake_backend.FakeBackend` with log-normal latencies (scaled by
+``--latency-scale``) and optional 503/429 injection, seeded so that repeated
+runs do the same work.
+
+Scenarios:
+
+- ``e2e``: sequential runs of the sync graph for easy/medium/hard, with the
+  run latency and the per-node wall time taken from the run reports
+- ``throughput``: ``--concurrency`` concurrent sessions on the async graph
+  per difficulty, reported as queries per second
+- ``citations``: ``insert_citation_markers`` and ``get_citations`` on
+  synthetic grounded responses with many supports
+- ``formatter``: rendering a long cited answer and its sources table
+
+Usage:
+    python benchmarks/suite.py --repeat 5 --json bench.json
+    python benchmarks/suite.py --only e2e --latency-scale 1 --failure-rate 0.05
+    python benchmarks/suite.py --only e2e --latency-scale 0.1 --hedge 90
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from langchain_core.messages import HumanMessage  # noqa: E402
+from rich.console import Console  # noqa: E402
+
+from agent.backends import register_backend  # noqa: E402
+from agent.configuration import Configuration  # noqa: E402
+from agent.cache import response_from_payload  # noqa: E402
+from agent.fake_backend import FakeBackend, LatencyDistribution  # noqa: E402
+from agent.formatting import OutputFormatter, custom_theme  # noqa: E402
+from agent.graph import create_async_graph_for_direct_use, create_graph_for_direct_use  # noqa: E402
+from agent.metrics import RunMetrics  # noqa: E402
+from agent.retry import RetryBudget  # noqa: E402
+from agent.utils import get_citations, insert_citation_markers, resolve_urls  # noqa: E402
+from main import configure_for_difficulty  # noqa: E402
+
+DIFFICULTIES = ["easy", "medium", "hard"]
+# Roughly what grounded searches and chat calls take against the real API
+SEARCH_LATENCY = LatencyDistribution(median=2.5, p95=6.0)
+CHAT_LATENCY = LatencyDistribution(median=1.0, p95=3.0)
+QUERIES = [
+    "How are solid-state batteries changing electric vehicles",
+    "What drove inflation in Europe over the last two years",
+    "Current state of fusion energy research",
+    "Impact of large language models on software engineering jobs",
+    "How effective are heat pumps in cold climates",
+]
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _stats(samples):
+    return {
+        "median_seconds": round(statistics.median(samples), 4),
+        "p95_seconds": round(_percentile(samples, 0.95), 4),
+        "min_seconds": round(min(samples), 4),
+        "max_seconds": round(max(samples), 4),
+    }
+
+
+def _config(difficulty, args):
+    config = configure_for_difficulty(difficulty)
+    config.update(
+        model_backend="benchmark",
+        web_research_cache=False,
+        research_history=False,
+        # Backoff waits shrink with the simulated latencies
+        retry_base_delay=max(0.001, args.latency_scale),
+    )
+    if args.hedge is not None:
+        config.update(hedge_web_research=True, hedge_percentile=args.hedge, hedge_budget=args.hedge_budget)
+    return config
+
+
+def _run_config(config, session):
+    return {"configurable": {
+        **config,
+        "configuration": Configuration.from_runnable_config({"configurable": config}),
+        "retry_budget": RetryBudget(),
+        "metrics": RunMetrics(),
+        "thread_id": session,
+    }}
+
+
+def _node_means(reports):
+    totals = {}
+    for summary in reports:
+        for node, entry in summary.items():
+            total = totals.setdefault(
+                node, {"wall_seconds": 0.0, "executions": 0, "retries": 0, "hedges": 0, "hedge_wins": 0}
+            )
+            total["wall_seconds"] += entry["wall_seconds"]
+            total["executions"] += entry["executions"]
+            for key in ("retries", "hedges", "hedge_wins"):
+                total[key] += entry[key]
+    return {
+        node: {
+            "mean_wall_seconds_per_run": round(total["wall_seconds"] / len(reports), 4),
+            "executions_per_run": round(total["executions"] / len(reports), 2),
+            "retries": total["retries"],
+            "hedges": total["hedges"],
+            "hedge_wins": total["hedge_wins"],
+        }
+        for node, total in totals.items()
+    }
+
+
+def bench_e2e(args):
+    graph = create_graph_for_direct_use()
+    results = {}
+    for difficulty in DIFFICULTIES:
+        config = _config(difficulty, args)
+        samples, summaries = [], []
+        for i in range(args.repeat):
+            run_config = _run_config(config, f"e2e-{difficulty}-{i}")
+            state = {
+                "messages": [HumanMessage(content=QUERIES[i % len(QUERIES)])],
+                "reasoning_model": config["reasoning_model"],
+            }
+            start = time.perf_counter()
+            graph.invoke(state, run_config)
+            samples.append(time.perf_counter() - start)
+            summaries.append(run_config["configurable"]["metrics"].summary())
+        results[difficulty] = {**_stats(samples), "nodes": _node_means(summaries)}
+        print(f"e2e {difficulty:<7} median {results[difficulty]['median_seconds']:.3f}s  "
+              f"p95 {results[difficulty]['p95_seconds']:.3f}s")
+        for node, entry in results[difficulty]["nodes"].items():
+            hedges = f"  hedges {entry['hedges']} ({entry['hedge_wins']} won)" if entry["hedges"] else ""
+            print(f"    {node:<16} {entry['mean_wall_seconds_per_run']:.3f}s/run  "
+                  f"x{entry['executions_per_run']}  retries {entry['retries']}{hedges}")
+    return results
+
+
+async def _throughput(graph, difficulty, args):
+    config = _config(difficulty, args)
+    total = args.concurrency * args.repeat
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            state = {
+                "messages": [HumanMessage(content=f"{QUERIES[i % len(QUERIES)]} ({i})")],
+                "reasoning_model": config["reasoning_model"],
+            }
+            start = time.perf_counter()
+            await graph.ainvoke(state, _run_config(config, f"tp-{difficulty}-{i}"))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    return {"queries": total, "queries_per_second": round(total / elapsed, 3), **_stats(latencies)}
+
+
+def bench_throughput(args):
+    graph = create_async_graph_for_direct_use()
+    results = {}
+    for difficulty in DIFFICULTIES:
+        results[difficulty] = asyncio.run(_throughput(graph, difficulty, args))
+        print(f"throughput {difficulty:<7} {results[difficulty]['queries_per_second']:.2f} q/s  "
+              f"({results[difficulty]['queries']} queries, concurrency {args.concurrency}, "
+              f"median {results[difficulty]['median_seconds']:.3f}s)")
+    return results
+
+
+def _grounded_response(sentences, sources, rng):
+    text, supports = "", []
+    for i in range(sentences):
+        start = len(text)
+        text += f"Sentence {i} states a finding with value {rng.randrange(1000)}. "
+        indices = rng.sample(range(sources), min(3, sources))
+        supports.append({"start_index": start, "end_index": len(text) - 1, "grounding_chunk_indices": indices})
+    chunks = [
+        {"uri": f"https://redirect.example.com/{i}", "title": f"site{i}.example.com"}
+        for i in range(sources)
+    ]
+    return response_from_payload({"text": text, "chunks": chunks, "supports": supports})
+
+
+def _time(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return _stats(samples)
+
+
+def bench_citations(args):
+    rng = random.Random(0)
+    results = {}
+    for sentences in (50, 500, 5000):
+        response = _grounded_response(sentences, 20, rng)
+        chunks = response.candidates[0].grounding_metadata.grounding_chunks
+        resolved = resolve_urls(chunks, 0)
+        citations = get_citations(response, resolved)
+        results[f"get_citations_{sentences}"] = _time(
+            lambda: get_citations(response, resolved), args.repeat
+        )
+        results[f"insert_citation_markers_{sentences}"] = _time(
+            lambda: insert_citation_markers(response.text, citations), args.repeat
+        )
+    for name, entry in results.items():
+        print(f"{name:<32} median {entry['median_seconds'] * 1000:.3f}ms")
+    return results
+
+
+def bench_formatter(args):
+    rng = random.Random(0)
+    sources = [
+        {"label": f"site{i}", "short_url": f"https://vertexaisearch.cloud.google.com/id/0-{i}",
+         "value": f"https://site{i}.example.com/article/{i}"}
+        for i in range(40)
+    ]
+    paragraphs = []
+    for section in range(8):
+        lines = [
+            f"- Point {i} with a \"quoted phrase\" and a link [site{j}]({sources[j]['value']})."
+            for i, j in ((i, rng.randrange(len(sources))) for i in range(12))
+        ]
+        paragraphs.append(f"## Section {section}\n\n" + "\n".join(lines))
+    answer = "Summary of the findings.\n\n" + "\n\n".join(paragraphs)
+
+    formatter = OutputFormatter()
+    formatter.console = Console(file=io.StringIO(), width=100, theme=custom_theme, force_terminal=True)
+
+    def render():
+        formatter.console.file = io.StringIO()
+        formatter.format_answer(answer)
+        formatter.display_sources(sources)
+
+    results = {"format_answer_and_sources": _time(render, args.repeat)}
+    print(f"formatter {'format_answer_and_sources':<22} median "
+          f"{results['format_answer_and_sources']['median_seconds'] * 1000:.1f}ms")
+    return results
+
+
+SCENARIOS = {
+    "e2e": bench_e2e,
+    "throughput": bench_throughput,
+    "citations": bench_citations,
+    "formatter": bench_formatter,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks on the fake model backend.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (default: 5)")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Concurrent sessions in the throughput scenario (default: 8)")
+    parser.add_argument("--latency-scale", type=float, default=0.01,
+                        help="Multiplier on realistic API latencies (default: 0.01, 1 for real time)")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="Share of calls failing with 503 and, separately, with 429 (default: 0)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the fake backend (default: 0)")
+    parser.add_argument("--hedge", type=float, metavar="PERCENTILE",
+                        help="Hedge web searches slower than this latency percentile (default: off)")
+    parser.add_argument("--hedge-budget", type=float, default=0.1,
+                        help="Hedged requests allowed per web search with --hedge (default: 0.1)")
+    parser.add_argument("--only", choices=sorted(SCENARIOS), action="append",
+                        help="Run only this scenario (can be repeated)")
+    parser.add_argument("--json", type=str, metavar="FILE", help="Also write the results to FILE")
+    args = parser.parse_args()
+
+    scale = args.latency_scale
+    backend = FakeBackend(
+        search_latency=LatencyDistribution(SEARCH_LATENCY.median * scale, SEARCH_LATENCY.p95 * scale),
+        chat_latency=LatencyDistribution(CHAT_LATENCY.median * scale, CHAT_LATENCY.p95 * scale),
+        unavailable_rate=args.failure_rate,
+        rate_limit_rate=args.failure_rate,
+        seed=args.seed,
+    )
+    register_backend("benchmark", backend)
+
+    results = {}
+    for name in args.only or list(SCENARIOS):
+        results[name] = SCENARIOS[name](args)
+    results["backend"] = {"calls": backend.calls, "injected_failures": backend.failures}
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "python": sys.version.split()[0],
+                "settings": vars(args),
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,10 @@ Command-line interface for the search agent.
 
 Usage:
     python main.py "your search query" --difficulty [easy|medium|hard] --model [model_name]
+    python main.py --batch queries.jsonl --output results.jsonl --concurrency 8
+    python main.py --batch queries.jsonl --output results.sqlite --workers 4
+    python main.py search-history "quantum error correction"
+    python main.py serve --port 8765 --workers 4
 
 Example:
     python main.py "recent developments in quantum computing" --difficulty medium --model gemini-2.5-pro-preview-05-06
@@ -11,24 +15,33 @@ Example:
 
 import os
 import sys
+import asyncio
 import argparse
 import time
+import json
+import uuid
 from pathlib import Path
 from dotenv import load_dotenv
-from langchain_core.messages import HumanMessage
 import re
 
-# Import the agent components
-from agent import create_graph_for_direct_use, OutputFormatter, show_spinner, extract_citation_urls
-from agent.configuration import Configuration
+# Import the lightweight agent components; the graph, the Gemini SDKs and Rich
+# are imported on first use so `--help` and argument errors return immediately
+from agent.retry import RetryBudget, RetryPolicy, call_with_retry, run_deadline
+from agent.batch import DEFAULT_CONCURRENCY, load_batch_queries, run_batch, run_batch_processes
 
 # Load environment variables
 load_dotenv()
 
 # Maximum number of retries for API calls
 MAX_RETRIES = 3
-# Delay between retries (in seconds)
-RETRY_DELAY = 5
+
+def parse_duration(text):
+    """Parse a duration such as ``90``, ``60s``, ``2m`` or ``1h`` into seconds."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*(ms|s|m|h)?\s*", text)
+    if match is None:
+        raise argparse.ArgumentTypeError(f"invalid duration {text!r} (e.g. 90, 60s, 2m)")
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[match.group(2) or "s"]
+    return float(match.group(1)) * scale
 
 def setup_argparse():
     """Set up command-line argument parsing."""
@@ -39,7 +52,8 @@ def setup_argparse():
     parser.add_argument(
         "query", 
         type=str, 
-        help="The search query to run"
+        nargs="?",
+        help="The search query to run (omit when using --batch)"
     )
     
     parser.add_argument(
@@ -76,8 +90,312 @@ def setup_argparse():
         help=f"Maximum number of retries for API calls (default: {MAX_RETRIES})"
     )
     
+    parser.add_argument(
+        "--deadline",
+        type=parse_duration,
+        metavar="DURATION",
+        help="Stop researching after this long (e.g. 60s, 2m) and answer with the results that arrived in time"
+    )
+    
+    parser.add_argument(
+        "--call-timeout",
+        type=parse_duration,
+        metavar="DURATION",
+        help="Abandon and retry an API call attempt that takes longer than this (default: 120s, 0 for no limit)"
+    )
+    
+    parser.add_argument(
+        "--backend",
+        choices=["gemini", "fake"],
+        default="gemini",
+        help="Model backend: the Gemini API, or an offline fake for demos and load tests (default: gemini)"
+    )
+    
+    parser.add_argument(
+        "--record",
+        type=str,
+        metavar="DIR",
+        help="Record every model and search interaction to a cassette in DIR"
+    )
+    
+    parser.add_argument(
+        "--replay",
+        type=str,
+        metavar="DIR",
+        help="Serve model and search responses from the cassette in DIR instead of the network"
+    )
+    
+    parser.add_argument(
+        "--replay-time-scale",
+        type=float,
+        default=1.0,
+        metavar="X",
+        help="Multiplier on recorded latencies when replaying: 1 for the original timing, 0 for none (default: 1)"
+    )
+    
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always run fresh web searches instead of reusing cached results"
+    )
+    
+    parser.add_argument(
+        "--no-dedup",
+        action="store_true",
+        help="Run every follow-up query, even ones that rephrase a query that already ran"
+    )
+    
+    parser.add_argument(
+        "--rpm",
+        type=float,
+        metavar="N",
+        help="Limit Gemini requests per minute per model (default: no limit)"
+    )
+    
+    parser.add_argument(
+        "--tpm",
+        type=float,
+        metavar="N",
+        help="Limit Gemini tokens per minute per model (default: no limit)"
+    )
+    
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream the final answer to the terminal as it is generated"
+    )
+    
+    parser.add_argument(
+        "--hedge",
+        type=float,
+        nargs="?",
+        const=95.0,
+        metavar="PERCENTILE",
+        help="Send a duplicate of any web search slower than this percentile of recent searches and use the first response (default percentile: 95)"
+    )
+    
+    parser.add_argument(
+        "--hedge-budget",
+        type=float,
+        metavar="RATIO",
+        help="Duplicate searches allowed per web search with --hedge (default: 0.1)"
+    )
+    
+    parser.add_argument(
+        "--incremental-reflection",
+        action="store_true",
+        help="Reflect on a running digest plus only the newest results instead of every summary"
+    )
+    
+    parser.add_argument(
+        "--metrics-out",
+        type=str,
+        metavar="FILE",
+        help="Write a JSON run report with per-node latency, queue wait, retries, tokens and response sizes (JSONL, one report per query, in batch mode)"
+    )
+    
+    parser.add_argument(
+        "--otel",
+        action="store_true",
+        help="Export node spans to an OpenTelemetry collector (OTEL_EXPORTER_OTLP_ENDPOINT, default http://localhost:4318)"
+    )
+    
+    parser.add_argument(
+        "--consult-history",
+        action="store_true",
+        help="Answer from, or start with the searches of, fresh past runs of similar questions"
+    )
+    
+    parser.add_argument(
+        "--no-history",
+        action="store_true",
+        help="Don't store this run in the searchable research history"
+    )
+    
+    parser.add_argument(
+        "--thread-id",
+        type=str,
+        metavar="ID",
+        help="Checkpoint the run under ID after every step so it can be resumed (needs langgraph-checkpoint-sqlite)"
+    )
+    
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue the interrupted run saved under --thread-id instead of starting a new one"
+    )
+    
+    parser.add_argument(
+        "--checkpoint-db",
+        type=str,
+        metavar="FILE",
+        help="SQLite file for checkpoints (default: ~/.cache/agentblack/checkpoints.sqlite)"
+    )
+    
+    parser.add_argument(
+        "--batch",
+        type=str,
+        metavar="FILE",
+        help="Run every query in FILE (JSONL or one query per line) instead of a single query"
+    )
+    
+    parser.add_argument(
+        "--output",
+        type=str,
+        metavar="FILE",
+        help="JSONL file (or .sqlite/.db database) for batch results (default: <batch file>.results.jsonl); finished queries are skipped on restart"
+    )
+    
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f"Maximum number of concurrent research sessions in batch mode, per worker process (default: {DEFAULT_CONCURRENCY})"
+    )
+    
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Shard the batch across this many worker processes that split the API quota; results stay in input order (default: 1)"
+    )
+    
+    return parser
+
+def setup_history_argparse():
+    """Set up argument parsing for the search-history subcommand."""
+    parser = argparse.ArgumentParser(
+        prog="main.py search-history",
+        description="Search the answers and research of past runs."
+    )
+    parser.add_argument("text", type=str, nargs="?", help="Words to search for")
+    parser.add_argument("--limit", type=int, default=10, help="Maximum number of runs listed (default: 10)")
+    parser.add_argument("--max-age-hours", type=float, default=0, help="Only runs at most this old")
+    parser.add_argument("--show", type=int, metavar="RUN", help="Show the answer and sources of a run")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    parser.add_argument(
+        "--db",
+        type=str,
+        metavar="FILE",
+        help="Research history database (default: ~/.cache/agentblack/history.sqlite)"
+    )
+    parser.add_argument("--no-color", action="store_true", help="Disable colored output")
+    return parser
+
+def search_history_main(argv):
+    """Entry point of ``main.py search-history``."""
+    parser = setup_history_argparse()
+    args = parser.parse_args(argv)
+    if args.text is None and args.show is None:
+        parser.error("give words to search for or --show RUN")
+    
+    from agent import OutputFormatter
+    from agent.history import get_research_history
+    
+    formatter = OutputFormatter(no_color=args.no_color)
+    history = get_research_history(args.db or "")
+    if args.show is not None:
+        run = history.get(args.show)
+        if run is None:
+            parser.error(f"no run #{args.show} in the research history")
+        if args.json:
+            print(json.dumps(run, indent=2, ensure_ascii=False))
+            return 0
+        formatter.console.print(f"[bold]Run #{run['id']}:[/bold] [query]{run['query']}[/query]")
+        formatter.format_answer(run["answer"])
+        formatter.display_sources(run["sources"])
+        return 0
+    
+    hits = history.search(args.text, args.limit, args.max_age_hours)
+    if args.json:
+        print(json.dumps(hits, indent=2, ensure_ascii=False))
+    else:
+        formatter.display_history(hits, history.count())
+    return 0
+
+def setup_serve_argparse():
+    """Set up argument parsing for the serve subcommand."""
+    from agent.server import DEFAULT_MAX_QUEUE, DEFAULT_WORKERS
+    
+    parser = argparse.ArgumentParser(
+        prog="main.py serve",
+        description="Serve research over a local HTTP/JSON API."
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Maximum number of research runs executing at the same time (default: {DEFAULT_WORKERS})"
+    )
+    parser.add_argument(
+        "--queue",
+        type=int,
+        default=DEFAULT_MAX_QUEUE,
+        help=f"Maximum number of runs waiting for a worker before submits get 429 (default: {DEFAULT_MAX_QUEUE})"
+    )
+    parser.add_argument(
+        "--difficulty",
+        choices=["easy", "medium", "hard"],
+        default="medium",
+        help="Difficulty of runs that don't choose one (default: medium)"
+    )
+    parser.add_argument("--model", type=str, help="Reasoning model of runs that don't choose one")
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="gemini",
+        help="Model backend: 'gemini' or 'fake' for offline runs (default: gemini)"
+    )
+    parser.add_argument("--no-cache", action="store_true", help="Don't reuse cached web research results")
+    parser.add_argument("--no-history", action="store_true", help="Don't store finished runs in the research history")
+    parser.add_argument("--quiet", action="store_true", help="Don't log every HTTP request")
     return parser
 
+def serve_main(argv):
+    """Entry point of ``main.py serve``."""
+    parser = setup_serve_argparse()
+    args = parser.parse_args(argv)
+    from agent.configuration import refresh_environment
+    # Every run of the server sees the environment it was started with
+    refresh_environment()
+    if args.backend == "gemini":
+        validate_environment()
+    
+    from agent.server import ResearchService, create_server
+    
+    base_config = {"model_backend": args.backend}
+    if args.no_cache:
+        base_config["web_research_cache"] = False
+    if args.no_history:
+        base_config["research_history"] = False
+    service = ResearchService(
+        lambda difficulty, model: configure_for_difficulty(difficulty, model or args.model),
+        base_config,
+        workers=args.workers,
+        max_queue=args.queue,
+        default_difficulty=args.difficulty,
+    )
+    try:
+        server = create_server(service, args.host, args.port, quiet=args.quiet)
+    except OSError as e:
+        parser.error(f"can't listen on {args.host}:{args.port}: {e}")
+    service.start()
+    print(
+        f"Serving research on http://{args.host}:{server.server_address[1]} "
+        f"({args.workers} workers, queue of {args.queue}); Ctrl+C to stop",
+        flush=True,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+    return 0
+
 def configure_for_difficulty(difficulty, custom_model=None):
     """Configure the agent based on difficulty level."""
     config = {}
@@ -104,6 +422,41 @@ def configure_for_difficulty(difficulty, custom_model=None):
     
     return config
 
+def configure_cassette(args, config):
+    """Route model calls through a recording or replaying backend."""
+    from agent.backends import get_backend, register_backend
+    from agent.cassette import RecordingBackend, ReplayBackend
+    
+    if args.replay:
+        backend = ReplayBackend(args.replay, args.replay_time_scale)
+    else:
+        backend = RecordingBackend(get_backend(args.backend), args.record)
+    register_backend(backend.name, backend)
+    config["model_backend"] = backend.name
+    # Every search must reach the cassette, so cached results are not used
+    config["web_research_cache"] = False
+
+def check_thread(args, parser):
+    """Check --thread-id/--resume against the saved checkpoint; returns the query to run."""
+    from agent.checkpoint import is_resumable, saved_query
+    
+    graph = open_checkpointed_graph(args.checkpoint_db)
+    query = saved_query(graph, args.thread_id)
+    if args.resume:
+        if query is None:
+            parser.error(f"no checkpoint found for thread {args.thread_id!r}")
+        if not is_resumable(graph, args.thread_id):
+            parser.error(f"the run on thread {args.thread_id!r} has already finished")
+        if args.query and args.query != query:
+            parser.error(f"thread {args.thread_id!r} was started for a different query: {query!r}")
+        return query
+    if query is not None:
+        parser.error(
+            f"thread {args.thread_id!r} already has a run; pass --resume to continue it "
+            "or choose another --thread-id"
+        )
+    return args.query
+
 def validate_environment():
     """Validate that necessary environment variables are set."""
     if not os.getenv("GEMINI_API_KEY"):
@@ -111,14 +464,15 @@ def validate_environment():
         print("Please create a .env file with your Gemini API key or set it manually.")
         sys.exit(1)
 
-def format_output(result, formatter):
+def format_output(result, formatter, streamed=False):
     """Format the agent's output for display using rich formatting."""
     try:
         # Extract the answer content
         answer = result["messages"][-1].content if "messages" in result and len(result["messages"]) > 0 else ""
         
-        # Display the formatted answer in the console
-        formatter.format_answer(answer)
+        # Display the formatted answer in the console (a streamed answer is already on screen)
+        if not streamed:
+            formatter.format_answer(answer)
         
         # Extract and display sources if available
         if "sources_gathered" in result and result["sources_gathered"]:
@@ -172,8 +526,48 @@ def save_results_to_file(filename, query, answer):
         traceback.print_exc()
         return False
 
-def run_search(query, config, formatter, max_retries=MAX_RETRIES):
-    """Run the search with the given query and configuration."""
+def save_metrics_report(filename, report):
+    """Write the JSON run report."""
+    try:
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+        return True
+    except OSError as e:
+        print(f"Error saving run report: {str(e)}")
+        return False
+
+def open_checkpointed_graph(checkpoint_path=None):
+    """Return the graph compiled with the SQLite checkpointer."""
+    from agent import create_graph_for_direct_use
+    from agent.checkpoint import DEFAULT_CHECKPOINT_PATH, get_checkpointer
+    
+    return create_graph_for_direct_use(get_checkpointer(checkpoint_path or DEFAULT_CHECKPOINT_PATH))
+
+def record_in_history(query, result, configurable, formatter):
+    """Store a finished run in the research history; failures only warn."""
+    import sqlite3
+    from agent.history import get_research_history
+    
+    try:
+        get_research_history(configurable.research_history_path).add_state(
+            query, result, configurable.max_research_loops
+        )
+    except sqlite3.Error as e:
+        formatter.console.print(f"[warning]Could not store the run in the research history: {e}[/warning]")
+
+def run_search(query, config, formatter, max_retries=MAX_RETRIES, thread_id=None, checkpoint_path=None):
+    """Run the search with the given query and configuration.
+    
+    With a ``thread_id`` every step is checkpointed, and a run that has a
+    checkpoint with steps left (after a crash, Ctrl-C or a failed attempt) is
+    continued from there instead of being started again.
+    """
+    from langchain_core.messages import HumanMessage
+    from agent import create_graph_for_direct_use
+    from agent.checkpoint import CHECKPOINT_DURABILITY, thread_config
+    from agent.configuration import Configuration
+    from agent.metrics import RunMetrics
+    
     # Create initial message
     messages = [HumanMessage(content=query)]
     
@@ -183,72 +577,257 @@ def run_search(query, config, formatter, max_retries=MAX_RETRIES):
         "reasoning_model": config.get("reasoning_model")
     }
     
-    # Show progress for query generation
-    formatter.display_progress("Generating search queries", 1.0)
-    
     # Create and run the graph
-    graph = create_graph_for_direct_use()
-    
-    # Show progress for search execution
-    formatter.display_progress("Executing web search", 1.0)
+    graph = open_checkpointed_graph(checkpoint_path) if thread_id else create_graph_for_direct_use()
     
     # Start timing the search
     start_time = time.time()
     
-    # Add retry logic for transient errors
-    retries = 0
-    while retries <= max_retries:
-        try:
-            result = graph.invoke(state, {"configurable": config})
-            break  # Success, exit the retry loop
-        except Exception as e:
-            error_message = str(e)
-            retries += 1
-            
-            # Check if it's a server overload error (503)
-            if "503 UNAVAILABLE" in error_message and "model is overloaded" in error_message:
-                if retries <= max_retries:
-                    formatter.console.print(f"[warning]Gemini API is overloaded. Retrying ({retries}/{max_retries}) in {RETRY_DELAY} seconds...[/warning]")
-                    time.sleep(RETRY_DELAY)
+    # One retry budget shared by every API call (and whole-run retry) of this search
+    configurable = Configuration.from_runnable_config({"configurable": config})
+    retry_budget = RetryBudget(max_wait_seconds=configurable.retry_budget_seconds)
+    metrics = RunMetrics()
+    run_config = {
+        "configurable": {
+            **config,
+            "max_retries": max_retries,
+            "retry_budget": retry_budget,
+            # Shared by every call, including whole-run retries
+            "deadline": run_deadline(configurable.run_deadline_seconds),
+            "metrics": metrics,
+            # Resolved once for the whole run
+            "configuration": configurable,
+            # Identifies this session to the shared rate limiter and the checkpointer
+            "thread_id": thread_id or uuid.uuid4().hex,
+        }
+    }
+    
+    def notify_retry(label, category, attempt, retries, delay):
+        formatter.console.print(
+            f"[warning]Gemini API call failed ({category}). "
+            f"Retrying ({attempt}/{retries}) in {delay:.1f} seconds...[/warning]"
+        )
+    
+    def stream_graph():
+        # Progress is driven by the real node updates, the final state comes from "values"
+        # and streamed answer tokens arrive as "custom" events
+        final_state = None
+        graph_input, options, saved = state, {}, None
+        if thread_id:
+            options["durability"] = CHECKPOINT_DURABILITY
+            saved = graph.get_state(thread_config(thread_id))
+            if saved.next:
+                # Continue after the last completed step, keeping finished web research
+                graph_input = None
+        with formatter.research_progress(
+            configurable.max_research_loops, configurable.consult_history
+        ) as progress:
+            if graph_input is None:
+                progress.resume(
+                    [task.name for task in saved.tasks], saved.values.get("research_loop_count") or 0
+                )
+            for mode, chunk in graph.stream(
+                graph_input, run_config, stream_mode=["updates", "values", "custom"], **options
+            ):
+                if mode == "updates":
+                    progress.handle(chunk)
+                elif mode == "custom":
+                    progress.handle_custom(chunk)
                 else:
-                    raise Exception(f"Gemini API is overloaded. Please try again later or try a different model.")
-            else:
-                # For other errors, don't retry
-                raise
+                    final_state = chunk
+        return final_state
     
-    end_time = time.time()
+    result = call_with_retry(
+        stream_graph,
+        RetryPolicy(max_retries=max_retries, base_delay=configurable.retry_base_delay),
+        retry_budget,
+        "run_search",
+        notify_retry,
+        deadline=run_config["configurable"]["deadline"],
+    )
+    result["run_metrics"] = retry_budget.snapshot()
+    result["run_metrics"]["reflection_usage"] = result.get("reflection_usage", [])
+    result["run_metrics"]["searches_saved"] = len(result.get("skipped_follow_up_queries", []))
+    result["run_metrics"]["skipped_follow_up_queries"] = result.get("skipped_follow_up_queries", [])
+    result["run_metrics"]["history_matches"] = result.get("history_matches", [])
+    result["run_metrics"]["stopping_decisions"] = result.get("stopping_decisions", [])
+    result["run_metrics"]["failed_searches"] = result.get("failed_searches", [])
+    result["run_metrics"]["nodes"] = metrics.summary()
+    if configurable.research_history:
+        record_in_history(query, result, configurable, formatter)
+    result["metrics_report"] = metrics.report(
+        query=query,
+        query_generator_model=configurable.query_generator_model,
+        reasoning_model=config.get("reasoning_model"),
+        number_of_initial_queries=configurable.number_of_initial_queries,
+        max_research_loops=configurable.max_research_loops,
+        run_metrics=result["run_metrics"],
+    )
     
-    # Show progress for answer generation
-    formatter.display_progress("Generating comprehensive answer", 1.0)
+    end_time = time.time()
     
     # Display execution time
     execution_time = end_time - start_time
-    formatter.display_completion(execution_time)
+    searches = result["run_metrics"]["nodes"].get("web_research", {})
+    formatter.display_completion(
+        execution_time,
+        result["run_metrics"]["retries"],
+        result["run_metrics"]["searches_saved"],
+        searches.get("hedges", 0),
+        searches.get("hedge_wins", 0),
+    )
     
     return result
 
+def run_batch_mode(args, config, formatter):
+    """Run all queries from the batch file and stream results to the output file."""
+    output_path = args.output or f"{os.path.splitext(args.batch)[0]}.results.jsonl"
+    queries = load_batch_queries(args.batch)
+    parallelism = f"concurrency {args.concurrency}"
+    if args.workers > 1:
+        parallelism = f"{args.workers} worker processes x {parallelism}"
+    formatter.console.print(
+        f"[info]Running {len(queries)} queries from [bold]{args.batch}[/bold] "
+        f"with {parallelism} -> [bold]{output_path}[/bold][/info]"
+    )
+    
+    def on_result(record):
+        style = "success" if record["status"] == "ok" else "danger"
+        formatter.console.print(
+            f"[{style}]{record['status'].upper()}[/{style}] {record['id']} "
+            f"({record['elapsed_seconds']:.1f}s) {record['query'][:70]}"
+        )
+    
+    start_time = time.time()
+    if args.workers > 1:
+        counts = run_batch_processes(
+            queries, config, output_path, args.workers, args.concurrency, on_result,
+            args.metrics_out, args.otel
+        )
+    else:
+        counts = asyncio.run(
+            run_batch(queries, config, output_path, args.concurrency, on_result, args.metrics_out)
+        )
+    formatter.console.print(
+        f"\n[success]{counts['ok']} succeeded[/success], "
+        f"[danger]{counts['error']} failed[/danger], "
+        f"{counts['skipped']} already done"
+    )
+    formatter.display_completion(time.time() - start_time)
+    return counts
+
 def main():
     """Main entry point for the CLI application."""
+    if sys.argv[1:2] == ["search-history"]:
+        sys.exit(search_history_main(sys.argv[2:]))
+    if sys.argv[1:2] == ["serve"]:
+        sys.exit(serve_main(sys.argv[2:]))
+    
     # Set up argument parsing
     parser = setup_argparse()
     args = parser.parse_args()
+    from agent.configuration import refresh_environment
+    # Every run of this invocation sees the environment it was started with
+    refresh_environment()
+    if args.resume and not args.thread_id:
+        parser.error("--resume needs the --thread-id of the run to continue")
+    if args.batch and args.thread_id:
+        parser.error("--thread-id can't be used with --batch (batches resume from their --output file)")
+    if not args.query and not args.batch and not args.resume:
+        parser.error("a query is required unless --batch or --resume is given")
     
     # Create formatter
+    from agent import OutputFormatter
     formatter = OutputFormatter(no_color=args.no_color)
     
+    if args.record and args.replay:
+        parser.error("--record and --replay can't be combined")
+    if args.workers > 1 and not args.batch:
+        parser.error("--workers needs --batch")
+    if args.workers > 1 and (args.record or args.replay):
+        parser.error("--record/--replay can't be combined with --workers (a cassette belongs to one process)")
+    
     # Validate environment
-    validate_environment()
+    if args.backend == "gemini" and not args.replay:
+        validate_environment()
     
     # Configure based on difficulty
     config = configure_for_difficulty(args.difficulty, args.model)
+    config["model_backend"] = args.backend
+    if args.record or args.replay:
+        try:
+            configure_cassette(args, config)
+        except FileNotFoundError as e:
+            parser.error(str(e))
+    if args.no_cache:
+        config["web_research_cache"] = False
+    if args.no_dedup:
+        config["dedup_follow_up_queries"] = False
+    if args.consult_history:
+        config["consult_history"] = True
+    if args.no_history:
+        config["research_history"] = False
+    config["max_retries"] = args.retries
+    if args.deadline is not None:
+        config["run_deadline_seconds"] = args.deadline
+    if args.call_timeout is not None:
+        config["call_timeout_seconds"] = args.call_timeout
+    if args.rpm:
+        config["requests_per_minute"] = args.rpm
+    if args.tpm:
+        config["tokens_per_minute"] = args.tpm
+    if args.stream:
+        config["stream_answer"] = True
+    if args.incremental_reflection:
+        config["incremental_reflection"] = True
+    if args.hedge is not None:
+        if not 0 < args.hedge < 100:
+            parser.error("--hedge takes a percentile between 0 and 100")
+        config["hedge_web_research"] = True
+        config["hedge_percentile"] = args.hedge
+    if args.hedge_budget is not None:
+        config["hedge_budget"] = args.hedge_budget
+    if args.otel:
+        from agent.metrics import configure_tracing
+        try:
+            configure_tracing()
+        except ImportError as e:
+            parser.error(str(e))
+    
+    if args.batch:
+        try:
+            counts = run_batch_mode(args, config, formatter)
+        except Exception as e:
+            formatter.display_error(f"Error running batch: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
+        sys.exit(1 if counts["error"] else 0)
+    
+    if args.thread_id:
+        try:
+            args.query = check_thread(args, parser)
+        except ImportError as e:
+            parser.error(str(e))
+        formatter.console.print(
+            f"[info]Checkpointing to thread [bold]{args.thread_id}[/bold] "
+            f"(continue an interrupted run with --thread-id {args.thread_id} --resume)[/info]"
+        )
     
     # Display header
     formatter.display_header(args.query, args.difficulty, config.get("reasoning_model"))
     
     try:
         # Run the search with retry logic
-        result = run_search(args.query, config, formatter, args.retries)
-        answer = format_output(result, formatter)
+        result = run_search(
+            args.query, config, formatter, args.retries, args.thread_id, args.checkpoint_db
+        )
+        answer = format_output(result, formatter, streamed=args.stream)
+        
+        if args.metrics_out:
+            result["metrics_report"]["difficulty"] = args.difficulty
+            if save_metrics_report(args.metrics_out, result["metrics_report"]):
+                formatter.console.print(f"[success]Run report saved to [bold]{args.metrics_out}[/bold][/success]")
         
         # Save results if requested
         if args.save:
@@ -262,11 +841,21 @@ def main():
                 import traceback
                 traceback.print_exc()
                 
+    except KeyboardInterrupt:
+        if args.thread_id:
+            formatter.display_error(
+                f"Interrupted. Continue with: python main.py --thread-id {args.thread_id} --resume"
+            )
+        sys.exit(130)
     except Exception as e:
         formatter.display_error(f"Error running search: {str(e)}")
         import traceback
         traceback.print_exc()
         sys.exit(1)
+    finally:
+        if args.otel:
+            from agent.metrics import shutdown_tracing
+            shutdown_tracing()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
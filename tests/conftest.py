@@ -0,0 +1,76 @@
+"""
+Shared fixtures: graph runs on the offline fake backend that touch nothing outside a temporary directory.
+"""
+
+import asyncio
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from agent.backends import register_backend
+from agent.configuration import Configuration
+from agent.fake_backend import FakeBackend
+from agent.metrics import RunMetrics
+from agent.retry import RetryBudget, run_deadline
+
+QUERY = "solar panel efficiency"
+
+
+@pytest.fixture
+def fake_backend(tmp_path):
+    """A fresh fake backend of this test, registered under its own name."""
+    backend = FakeBackend()
+    backend.name = f"fake-{tmp_path.name}"
+    register_backend(backend.name, backend)
+    return backend
+
+
+@pytest.fixture
+def fake_config(tmp_path, fake_backend):
+    """``configurable`` values for a one-loop run on the test's fake backend."""
+    return {
+        "model_backend": fake_backend.name,
+        # Set per difficulty by the CLI; the graph has no default for it
+        "reasoning_model": "gemini-2.0-flash",
+        "number_of_initial_queries": 2,
+        "max_research_loops": 1,
+        "web_research_cache": False,
+        "web_research_cache_path": str(tmp_path / "web_research.sqlite"),
+        "research_history": False,
+        "research_history_path": str(tmp_path / "history.sqlite"),
+        "retry_base_delay": 0.0,
+    }
+
+
+@pytest.fixture
+def run_config():
+    """Builds the RunnableConfig of one run, as the CLI does."""
+    def build(configurable, thread_id="test"):
+        configuration = Configuration.from_runnable_config({"configurable": configurable})
+        return {"configurable": {
+            **configurable,
+            "configuration": configuration,
+            "retry_budget": RetryBudget(),
+            "deadline": run_deadline(configuration.run_deadline_seconds),
+            "metrics": RunMetrics(),
+            "thread_id": thread_id,
+        }}
+
+    return build
+
+
+@pytest.fixture
+def run_research(run_config):
+    """Runs one research session on the sync (or async) graph; returns the final state and its config."""
+    from agent.graph import create_async_graph_for_direct_use, create_graph_for_direct_use
+
+    def run(configurable, query=QUERY, use_async=False):
+        config = run_config(configurable)
+        state = {"messages": [HumanMessage(content=query)], "reasoning_model": configurable["reasoning_model"]}
+        if use_async:
+            result = asyncio.run(create_async_graph_for_direct_use().ainvoke(state, config))
+        else:
+            result = create_graph_for_direct_use().invoke(state, config)
+        return result, config
+
+    return run
@@ -0,0 +1,64 @@
+"""
+A streamed answer is cleaned up exactly like the whole answer, whatever the chunk boundaries.
+"""
+
+import random
+
+from langchain_core.messages import HumanMessage
+
+from agent.backends import register_backend
+from agent.fake_backend import FakeBackend
+from agent.utils import CITATION_PATTERN, SHORT_URL_PREFIX, AnswerStreamRewriter, expand_short_urls
+
+SOURCES = [
+    {"short_url": f"{SHORT_URL_PREFIX}{id_}", "value": f"https://example.com/{id_}", "label": "example"}
+    for id_ in ("0-1", "0-12", "1-1", "2-0")
+]
+PIECES = [
+    "Solar ", "panels ", "convert light.", "\n", "\n\n## Heading\n", "[source0]", "[[1]]", "[", "]",
+    "(", ")", " [a", "b]", *(source["short_url"] for source in SOURCES), SHORT_URL_PREFIX, "https://vertex",
+]
+
+
+def _whole(text):
+    return expand_short_urls(CITATION_PATTERN.sub("", text), SOURCES)
+
+
+def _streamed(text, rng):
+    rewriter = AnswerStreamRewriter(SOURCES)
+    out, position = [], 0
+    while position < len(text):
+        size = rng.randint(1, 12)
+        out.append(rewriter.feed(text[position:position + size]))
+        position += size
+    out.append(rewriter.flush())
+    return "".join(out), rewriter.used_sources()
+
+
+def test_stream_rewrite_matches_the_whole_answer():
+    rng = random.Random(7)
+    for _ in range(1500):
+        text = "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 30)))
+        assert _streamed(text, rng) == _whole(text), text
+
+
+def test_graph_streams_the_same_answer_it_returns(fake_config, run_config):
+    from agent.graph import create_graph_for_direct_use
+
+    config = run_config({**fake_config, "stream_answer": True})
+    state = {"messages": [HumanMessage(content="solar panel efficiency")], "reasoning_model": fake_config["reasoning_model"]}
+    deltas, final = [], None
+    for mode, chunk in create_graph_for_direct_use().stream(state, config, stream_mode=["custom", "values"]):
+        if mode == "custom":
+            deltas.append(chunk["answer_delta"])
+        else:
+            final = chunk
+    answer = final["messages"][-1].content
+    assert len(deltas) > 1 and "".join(deltas) == answer
+    assert SHORT_URL_PREFIX not in answer and "https://source" in answer
+
+    # The same run without streaming, on a backend in the same state
+    register_backend(fake_config["model_backend"], FakeBackend())
+    unstreamed = create_graph_for_direct_use().invoke(state, run_config(fake_config))
+    assert unstreamed["messages"][-1].content == answer
+    assert unstreamed["sources_gathered"] == final["sources_gathered"]
@@ -0,0 +1,83 @@
+"""
+Batch files, result sinks and batch runs on the fake backend.
+"""
+
+import asyncio
+import json
+import sqlite3
+
+from agent.batch import completed_ids, load_batch_queries, open_sink, query_id, run_batch, run_batch_processes
+
+
+def _write(path, text):
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_loads_text_jsonl_and_json_lists(tmp_path):
+    text = _write(tmp_path / "q.txt", "# comment\nsolar panels\n\nheat pumps\n")
+    assert load_batch_queries(text) == [
+        {"id": query_id("solar panels"), "query": "solar panels"},
+        {"id": query_id("heat pumps"), "query": "heat pumps"},
+    ]
+    jsonl = _write(tmp_path / "q.jsonl", '{"id": 7, "query": "solar panels"}\n{"title": "Heat", "body": "pumps"}\n')
+    assert load_batch_queries(jsonl) == [
+        {"id": "7", "query": "solar panels"},
+        {"id": query_id("Heat\n\npumps"), "query": "Heat\n\npumps"},
+    ]
+    strings = _write(tmp_path / "strings.json", '[\n  "solar panels",\n  "heat pumps"\n]\n')
+    assert [item["query"] for item in load_batch_queries(strings)] == ["solar panels", "heat pumps"]
+    records = _write(tmp_path / "records.json", json.dumps([{"request_id": "r1", "question": "solar panels"}], indent=2))
+    assert load_batch_queries(records) == [{"id": "r1", "query": "solar panels"}]
+
+
+def test_sinks_report_completed_queries(tmp_path):
+    for name in ("out.jsonl", "out.sqlite"):
+        path = str(tmp_path / name)
+        with open_sink(path) as sink:
+            sink.write({"id": "a", "query": "qa", "status": "ok"})
+            sink.write({"id": "b", "query": "qb", "status": "error"})
+        with open_sink(path) as sink:
+            assert sink.completed_ids() == {"a"}
+    # An interrupted write leaves a partial last line
+    with open(tmp_path / "out.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"id": "c", "sta')
+    assert completed_ids(str(tmp_path / "out.jsonl")) == {"a"}
+
+
+def test_run_batch_writes_every_result_and_resumes(tmp_path, fake_config):
+    queries = [{"id": str(i), "query": f"topic {i}"} for i in range(4)]
+    output = str(tmp_path / "results.jsonl")
+    seen = []
+
+    counts = asyncio.run(run_batch(queries, fake_config, output, concurrency=2, on_result=seen.append))
+    assert counts == {"ok": 4, "error": 0, "skipped": 0}
+    assert sorted(record["id"] for record in seen) == ["0", "1", "2", "3"]
+    with open(output, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert all(record["status"] == "ok" and record["answer"] and record["sources"] for record in records)
+    assert all("web_research" in record["run_metrics"]["nodes"] for record in records)
+
+    more = queries + [{"id": "4", "query": "topic 4"}]
+    assert asyncio.run(run_batch(more, fake_config, output, concurrency=2)) == {"ok": 1, "error": 0, "skipped": 4}
+
+
+def test_process_batch_writes_results_in_input_order(tmp_path, fake_config):
+    # Spawned workers only know the backends registered by name at import
+    config = {**fake_config, "model_backend": "fake", "max_concurrent_requests": 4}
+    queries = [{"id": str(i), "query": f"topic {i}"} for i in range(5)]
+    output, metrics = str(tmp_path / "results.sqlite"), str(tmp_path / "reports.jsonl")
+    seen = []
+
+    counts = run_batch_processes(queries[:4], config, output, workers=2, concurrency=2,
+                                 on_result=seen.append, metrics_path=metrics)
+    assert counts == {"ok": 4, "error": 0, "skipped": 0}
+    assert sorted(record["id"] for record in seen) == ["0", "1", "2", "3"]
+    with sqlite3.connect(output) as conn:
+        rows = conn.execute("SELECT id, status FROM results ORDER BY rowid").fetchall()
+    assert rows == [(str(i), "ok") for i in range(4)]
+    with open(metrics, encoding="utf-8") as f:
+        assert [json.loads(line)["query"] for line in f] == [f"topic {i}" for i in range(4)]
+
+    assert run_batch_processes(queries, config, output, workers=2) == {"ok": 1, "error": 0, "skipped": 4}
+
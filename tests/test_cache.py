@@ -0,0 +1,54 @@
+"""
+The web research cache: keys, expiry and LRU eviction.
+"""
+
+import time
+
+from agent.cache import WebResearchCache, cache_key, payload_from_response, response_from_payload
+
+PAYLOAD = {
+    "text": "Result on solar panels.",
+    "chunks": [{"uri": "https://example.com/a", "title": "example.com"}],
+    "supports": [{"start_index": 0, "end_index": 23, "grounding_chunk_indices": [0]}],
+}
+
+
+def test_key_ignores_case_spacing_and_punctuation():
+    day = "2024-06-01"
+    assert cache_key("Solar  panels?", "m", day) == cache_key("solar panels", "m", day)
+    assert cache_key("solar panels", "m", day) != cache_key("solar panels", "other", day)
+    assert cache_key("solar panels", "m", day) != cache_key("solar panels", "m", "2024-06-02")
+
+
+def test_payload_round_trips_through_a_response():
+    assert payload_from_response(response_from_payload(PAYLOAD)) == PAYLOAD
+
+
+def test_get_returns_what_was_put(tmp_path):
+    cache = WebResearchCache(str(tmp_path / "cache.sqlite"))
+    assert cache.get("k") is None
+    cache.put("k", PAYLOAD)
+    assert cache.get("k") == PAYLOAD
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entries_expire(tmp_path):
+    cache = WebResearchCache(str(tmp_path / "cache.sqlite"), ttl_hours=0.1 / 3600)
+    cache.put("k", PAYLOAD)
+    time.sleep(0.15)
+    assert cache.get("k") is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = WebResearchCache(str(tmp_path / "cache.sqlite"))
+    cache.put("old", PAYLOAD)
+    cache.put("used", PAYLOAD)
+    # Room for exactly two entries
+    cache.max_bytes = 2 * cache._conn.execute("SELECT MAX(size) FROM web_research").fetchone()[0]
+    time.sleep(0.01)
+    cache.get("old")
+    time.sleep(0.01)
+    cache.put("new", PAYLOAD)
+    assert cache.get("used") is None
+    assert cache.get("old") == PAYLOAD
+    assert cache.get("new") == PAYLOAD
@@ -0,0 +1,77 @@
+"""
+A run recorded into a cassette replays the same responses without a network.
+"""
+
+import asyncio
+
+import pytest
+
+from agent.cache import payload_from_response
+from agent.cassette import CassetteMissError, RecordingBackend, ReplayBackend
+from agent.fake_backend import FakeBackend
+from agent.tools_and_schemas import SearchQueryList
+
+MODEL = "gemini-2.0-flash"
+QUERY_PROMPT = 'Generate no more than 2 queries. The current date is June 01, 2024. Context: solar panels'
+ANSWER_PROMPT = "Write the answer. The current date is June 01, 2024. User Context:\n- solar panels"
+
+
+def _record(directory, seed=0):
+    recorder = RecordingBackend(FakeBackend(seed=seed), str(directory))
+    queries = recorder.chat_model(MODEL, 1.0, SearchQueryList, include_raw=True).invoke(QUERY_PROMPT)
+    search = recorder.search(MODEL, "solar panels efficiency")
+    chunks = list(recorder.chat_model(MODEL, 0).stream(ANSWER_PROMPT))
+    return queries, search, chunks
+
+
+def test_replay_serves_the_recorded_responses(tmp_path):
+    queries, search, chunks = _record(tmp_path)
+    replay = ReplayBackend(str(tmp_path), time_scale=0)
+
+    replayed = replay.chat_model(MODEL, 1.0, SearchQueryList, include_raw=True).invoke(QUERY_PROMPT)
+    assert replayed["parsed"] == queries["parsed"]
+    assert replayed["raw"].usage_metadata == queries["raw"].usage_metadata
+    assert payload_from_response(replay.search(MODEL, "solar panels efficiency")) == payload_from_response(search)
+    replayed_chunks = list(replay.chat_model(MODEL, 0).stream(ANSWER_PROMPT))
+    assert "".join(c.content for c in replayed_chunks) == "".join(c.content for c in chunks)
+    usage = sum(chunks[1:], chunks[0]).usage_metadata
+    assert usage and sum(replayed_chunks[1:], replayed_chunks[0]).usage_metadata == usage
+    assert replay.replayed == 3
+
+
+def test_dates_in_prompts_are_masked(tmp_path):
+    queries, _, _ = _record(tmp_path)
+    replay = ReplayBackend(str(tmp_path), time_scale=0)
+    prompt = QUERY_PROMPT.replace("June 01, 2024", "July 15, 2025")
+    replayed = replay.chat_model(MODEL, 1.0, SearchQueryList, include_raw=True).invoke(prompt)
+    assert replayed["parsed"] == queries["parsed"]
+
+
+def test_streamed_answer_replays_as_a_plain_call(tmp_path):
+    _, _, chunks = _record(tmp_path)
+    replay = ReplayBackend(str(tmp_path), time_scale=0)
+
+    async def answer():
+        return await replay.chat_model(MODEL, 0).ainvoke(ANSWER_PROMPT)
+
+    assert asyncio.run(answer()).content == "".join(c.content for c in chunks)
+
+
+def test_repeated_requests_replay_in_order(tmp_path):
+    recorder = RecordingBackend(FakeBackend(), str(tmp_path))
+    first = recorder.search(MODEL, "solar panels")
+    second = recorder.search(MODEL, "solar panels")
+    assert payload_from_response(first) != payload_from_response(second)
+    replay = ReplayBackend(str(tmp_path), time_scale=0)
+    assert [payload_from_response(replay.search(MODEL, "solar panels")) for _ in range(3)] == [
+        payload_from_response(first), payload_from_response(second), payload_from_response(second),
+    ]
+
+
+def test_unrecorded_request_raises(tmp_path):
+    _record(tmp_path)
+    replay = ReplayBackend(str(tmp_path), time_scale=0)
+    with pytest.raises(CassetteMissError):
+        replay.search(MODEL, "wind turbines")
+    with pytest.raises(FileNotFoundError):
+        ReplayBackend(str(tmp_path / "missing"))
@@ -0,0 +1,60 @@
+"""
+A run interrupted after its web research resumes from the checkpoint without searching again.
+"""
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from agent.backends import register_backend
+from agent.checkpoint import CHECKPOINT_DURABILITY, get_checkpointer, is_resumable, saved_query, thread_config
+from agent.fake_backend import FakeBackend
+from agent.graph import create_graph_for_direct_use
+
+
+class _Crash(Exception):
+    pass
+
+
+class _CrashingFake(FakeBackend):
+    """Fake backend that fails its first reflection and counts its searches."""
+
+    def __init__(self):
+        super().__init__()
+        self.searches = []
+        self.crashed = False
+
+    def call(self, kind, model, prompt, timeout=None):
+        if kind == "search":
+            self.searches.append(prompt)
+        elif "knowledge gap" in prompt.lower() and not self.crashed:
+            self.crashed = True
+            raise _Crash("interrupted")
+        return super().call(kind, model, prompt, timeout)
+
+
+def test_resume_reuses_finished_web_research(fake_config, run_config, tmp_path):
+    backend = _CrashingFake()
+    register_backend(fake_config["model_backend"], backend)
+    graph = create_graph_for_direct_use(checkpointer=get_checkpointer(str(tmp_path / "checkpoints.sqlite")))
+    config = run_config({**fake_config, "max_research_loops": 2})
+    config["configurable"]["thread_id"] = "resume-test"
+    state = {"messages": [HumanMessage(content="solar panel efficiency")], "reasoning_model": fake_config["reasoning_model"]}
+
+    with pytest.raises(_Crash):
+        for _ in graph.stream(state, config, durability=CHECKPOINT_DURABILITY):
+            pass
+    first_loop = list(backend.searches)
+    assert len(first_loop) == fake_config["number_of_initial_queries"]
+    assert is_resumable(graph, "resume-test")
+    assert saved_query(graph, "resume-test") == "solar panel efficiency"
+    assert graph.get_state(thread_config("resume-test")).next == ("reflection",)
+
+    final = None
+    for final in graph.stream(None, config, stream_mode="values", durability=CHECKPOINT_DURABILITY):
+        pass
+    # Only the follow-up searches of the second loop run after resuming
+    assert backend.searches[:len(first_loop)] == first_loop
+    assert len(set(backend.searches)) == len(backend.searches) > len(first_loop)
+    assert len(final["web_research_result"]) == len(backend.searches)
+    assert final["messages"][-1].content
+    assert not is_resumable(graph, "resume-test")
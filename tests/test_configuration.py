@@ -0,0 +1,61 @@
+"""
+Configuration resolution: the cache, the environment snapshot and carried configurations.
+"""
+
+import pytest
+
+from agent.configuration import Configuration, environment_overrides, refresh_environment
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch):
+    monkeypatch.delenv("MAX_RESEARCH_LOOPS", raising=False)
+    refresh_environment()
+    yield monkeypatch
+    monkeypatch.undo()
+    refresh_environment()
+
+
+def _resolve(**configurable):
+    return Configuration.from_runnable_config({"configurable": configurable})
+
+
+def test_equal_inputs_share_one_instance():
+    first = _resolve(max_research_loops=3, query_generator_model="m")
+    assert _resolve(query_generator_model="m", max_research_loops=3) is first
+    assert _resolve(max_research_loops=4) is not first
+    # None means unset, like a missing value
+    assert _resolve(max_research_loops=3, query_generator_model="m", answer_model=None) is first
+
+
+def test_a_carried_configuration_is_returned_as_is():
+    configuration = Configuration(max_research_loops=7)
+    assert _resolve(configuration=configuration, max_research_loops=1) is configuration
+
+
+def test_unhashable_values_are_resolved_without_the_cache():
+    class Unhashable(str):
+        __hash__ = None
+
+    first = _resolve(query_generator_model=Unhashable("m"))
+    assert first.query_generator_model == "m"
+    assert _resolve(query_generator_model=Unhashable("m")) is not first
+
+
+def test_environment_variables_win(environment):
+    environment.setenv("MAX_RESEARCH_LOOPS", "5")
+    refresh_environment()
+    assert environment_overrides()["max_research_loops"] == "5"
+    assert _resolve(max_research_loops=2).max_research_loops == 5
+
+
+def test_the_environment_is_read_when_refreshed(environment):
+    before = _resolve(max_research_loops=2)
+    # A change after the snapshot doesn't reach cached or new resolutions
+    environment.setenv("MAX_RESEARCH_LOOPS", "6")
+    assert "max_research_loops" not in environment_overrides()
+    assert _resolve(max_research_loops=2) is before
+    assert _resolve(max_research_loops=3).max_research_loops == 3
+
+    assert refresh_environment()["max_research_loops"] == "6"
+    assert _resolve(max_research_loops=2).max_research_loops == 6
@@ -0,0 +1,86 @@
+"""
+Near-duplicate follow-up queries are dropped, distinct ones kept.
+"""
+
+from agent.dedup import deduplicate_queries, shingles, similarity
+
+
+def test_similarity_is_exact_jaccard():
+    a, b = shingles("solar panel efficiency"), shingles("solar panels efficiency 2024")
+    assert similarity(a, b) == len(a & b) / len(a | b)
+    assert similarity(a, a) == 1.0
+    assert similarity(a, frozenset()) == 0.0
+
+
+def test_drops_rewordings_of_executed_queries():
+    kept, skipped = deduplicate_queries(
+        ["latest solar panel efficiency", "perovskite cell stability"],
+        ["solar panels efficiency"],
+        threshold=0.7,
+    )
+    assert kept == ["perovskite cell stability"]
+    assert skipped == [{
+        "query": "latest solar panel efficiency",
+        "duplicate_of": "solar panels efficiency",
+        "similarity": 1.0,
+    }]
+
+
+def test_drops_duplicates_within_the_candidates():
+    kept, skipped = deduplicate_queries(
+        ["heat pump costs", "heat pumps cost", "heat pump noise"], [], threshold=0.8
+    )
+    assert kept == ["heat pump costs", "heat pump noise"]
+    assert [s["duplicate_of"] for s in skipped] == ["heat pump costs"]
+
+
+def test_threshold_above_one_keeps_everything():
+    candidates = ["heat pump costs", "heat pump costs"]
+    assert deduplicate_queries(candidates, candidates, threshold=1.01) == (candidates, [])
+
+
+def _updates(fake_config, run_config, configurable):
+    from langchain_core.messages import HumanMessage
+
+    from agent.graph import create_graph_for_direct_use
+
+    state = {"messages": [HumanMessage(content="solar panel efficiency")], "reasoning_model": fake_config["reasoning_model"]}
+    return list(create_graph_for_direct_use().stream(state, run_config(configurable), stream_mode="updates"))
+
+
+def test_each_loop_runs_only_the_latest_follow_ups(fake_config, run_config):
+    # follow_up_queries holds the last reflection's list: with an adding reducer
+    # every loop would run the follow-ups of all earlier loops again
+    updates = _updates(fake_config, run_config, {**fake_config, "max_research_loops": 4})
+    loops, follow_ups = [[]], []
+    for update in updates:
+        for node, value in update.items():
+            if node == "web_research":
+                loops[-1].extend(value["search_query"])
+            elif node == "reflection":
+                follow_ups.append(value["follow_up_queries"])
+                loops.append([])
+    assert len(follow_ups) >= 2
+    for ran, proposed in zip(loops[1:], follow_ups):
+        assert sorted(ran) == sorted(proposed)
+
+
+def test_research_ends_when_every_follow_up_is_a_duplicate(fake_config, run_config):
+    from agent.backends import register_backend
+    from agent.fake_backend import FakeBackend
+    from agent.tools_and_schemas import Reflection
+
+    class RepeatingFake(FakeBackend):
+        def structured(self, schema, prompt, rng):
+            result = super().structured(schema, prompt, rng)
+            if issubclass(schema, Reflection):
+                result.follow_up_queries = ["Solar panel efficiency overview?"]
+            return result
+
+    register_backend(fake_config["model_backend"], RepeatingFake())
+    configurable = {**fake_config, "max_research_loops": 3, "follow_up_dedup_threshold": 0.3}
+    updates = _updates(fake_config, run_config, configurable)
+    reflections = [value for update in updates for node, value in update.items() if node == "reflection"]
+    searches = [node for update in updates for node in update if node == "web_research"]
+    assert len(reflections) == 1 and reflections[0]["follow_up_queries"] == []
+    assert len(searches) == fake_config["number_of_initial_queries"]
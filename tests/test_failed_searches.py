@@ -0,0 +1,93 @@
+"""
+Failed searches are dropped without failing the run, and the run deadline bounds the research.
+"""
+
+import asyncio
+import re
+import time
+
+import pytest
+
+from agent.backends import register_backend
+from agent.fake_backend import FakeAPIError, FakeBackend
+from agent.retry import RetryExhaustedError
+from agent.utils import SHORT_URL_PREFIX
+
+
+class _FailingFake(FakeBackend):
+    """Fake backend whose searches of the ``failing`` queries (by order searched) fail or stall."""
+
+    def __init__(self, failing, error=None, stall=0.0):
+        super().__init__()
+        self.failing = failing
+        self.error = error
+        self.stall = stall
+        self.queries = []
+
+    def _affected(self, kind, prompt):
+        # Retries of a search send the same prompt
+        if kind != "search":
+            return False
+        if prompt not in self.queries:
+            self.queries.append(prompt)
+        return self.queries.index(prompt) in self.failing
+
+    def call(self, kind, model, prompt, timeout=None):
+        if self._affected(kind, prompt) and self.error is not None:
+            raise self.error
+        return super().call(kind, model, prompt, timeout)
+
+    async def acall(self, kind, model, prompt, timeout=None):
+        if self._affected(kind, prompt) and self.stall:
+            await asyncio.sleep(self.stall)
+        return await super().acall(kind, model, prompt, timeout)
+
+
+def _search_ids(result):
+    return {
+        re.match(re.escape(SHORT_URL_PREFIX) + r"(\d+)-", source["short_url"]).group(1)
+        for source in result["sources_gathered"]
+    }
+
+
+def test_a_search_that_keeps_failing_is_dropped(fake_config, run_research):
+    register_backend(fake_config["model_backend"], _FailingFake({1}, FakeAPIError(503, "unavailable")))
+    result, config = run_research({**fake_config, "number_of_initial_queries": 3, "max_research_loops": 2})
+    failed = result["failed_searches"]
+    # The reflection may ask for the dropped search again, and it fails again
+    (query,) = {entry["query"] for entry in failed}
+    assert query not in result["search_query"]
+    assert all(entry["error"].startswith("RetryExhaustedError") for entry in failed)
+    assert result["stopping_decisions"][0]["new_results"] == 2
+    assert result["messages"][-1].content
+    # Every search got its own id, and the dropped ones left theirs unused
+    launched = len(result["search_query"]) + len(failed)
+    ids = _search_ids(result)
+    assert len(ids) == len(result["web_research_result"]) and "1" not in ids
+    assert all(int(id_) < launched for id_ in ids)
+    assert config["configurable"]["retry_budget"].snapshot()["retries"] == 3 * len(failed)
+
+
+def test_dropping_can_be_turned_off(fake_config, run_research):
+    register_backend(fake_config["model_backend"], _FailingFake({1}, FakeAPIError(503, "unavailable")))
+    with pytest.raises(RetryExhaustedError):
+        run_research({**fake_config, "drop_failed_searches": False})
+
+
+def test_errors_that_are_not_transient_fail_the_run(fake_config, run_research):
+    register_backend(fake_config["model_backend"], _FailingFake({1}, ValueError("bad request")))
+    with pytest.raises(ValueError, match="bad request"):
+        run_research(fake_config)
+
+
+def test_run_deadline_answers_with_what_it_has(fake_config, run_research):
+    register_backend(fake_config["model_backend"], _FailingFake(range(1, 100), stall=30.0))
+    started = time.monotonic()
+    result, _ = run_research(
+        {**fake_config, "run_deadline_seconds": 0.5, "max_research_loops": 3}, use_async=True
+    )
+    assert time.monotonic() - started < 10
+    assert len(result["web_research_result"]) == 1
+    assert len(result["failed_searches"]) == fake_config["number_of_initial_queries"] - 1
+    assert "deadline" in result["stopping_decisions"][-1]["reason"]
+    assert result["messages"][-1].content
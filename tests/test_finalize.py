@@ -0,0 +1,54 @@
+"""
+Map-reduce finalize_answer condenses groups of results before the final answer.
+"""
+
+import math
+
+import pytest
+
+from agent.backends import register_backend
+from agent.fake_backend import FakeBackend
+
+
+class _PromptLog(FakeBackend):
+    """Fake backend that keeps the prompts of its chat calls."""
+
+    def __init__(self):
+        super().__init__()
+        self.prompts = []
+
+    def call(self, kind, model, prompt, timeout=None):
+        if kind == "chat":
+            self.prompts.append(prompt)
+        return super().call(kind, model, prompt, timeout)
+
+    async def acall(self, kind, model, prompt, timeout=None):
+        if kind == "chat":
+            self.prompts.append(prompt)
+        return await super().acall(kind, model, prompt, timeout)
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_map_step_condenses_groups(fake_config, run_research, use_async):
+    backend = _PromptLog()
+    register_backend(fake_config["model_backend"], backend)
+    result, config = run_research(
+        {**fake_config, "number_of_initial_queries": 5, "answer_group_size": 2}, use_async=use_async
+    )
+    calls = [call for node in config["configurable"]["metrics"].nodes if node.node == "finalize_answer"
+             for call in node.calls]
+    labels = [call.label for call in calls]
+    results = result["web_research_result"]
+    assert labels.count("finalize_answer.map") == math.ceil(len(results) / 2)
+    assert labels[-1] == "finalize_answer"
+    # The final prompt gets the partial answers instead of the raw results
+    final_prompt = backend.prompts[-1]
+    assert not any(summary in final_prompt for summary in results)
+    assert result["messages"][-1].content and result["sources_gathered"]
+
+
+def test_small_research_sets_skip_the_map_step(fake_config, run_research):
+    result, config = run_research({**fake_config, "answer_group_size": 8})
+    labels = [call.label for node in config["configurable"]["metrics"].nodes for call in node.calls]
+    assert "finalize_answer.map" not in labels
+    assert result["sources_gathered"]
@@ -0,0 +1,142 @@
+"""
+Hedged requests: when a duplicate is sent, and which response is used.
+"""
+
+import asyncio
+import itertools
+import threading
+import time
+
+import pytest
+
+from agent.hedging import MIN_SAMPLES, PRIMARY, HedgeBudget, Hedger, _thread_pool
+
+
+def _hedger(latency=0.05, budget_ratio=0.1):
+    hedger = Hedger(percentile=95, budget_ratio=budget_ratio)
+    for _ in range(MIN_SAMPLES):
+        hedger.latencies.record(latency)
+    return hedger
+
+
+def _first_call_slow(slow=1.0):
+    """Search stand-in whose first request straggles and every later one is fast."""
+    counter = itertools.count()
+
+    def search(started):
+        started()
+        attempt = next(counter)
+        time.sleep(slow if attempt == 0 else 0.01)
+        return attempt
+
+    return search
+
+
+def test_no_hedging_before_enough_latencies():
+    hedger = Hedger(percentile=95, budget_ratio=1.0)
+    assert hedger.delay() is None
+    assert hedger.call(_first_call_slow(0.1)) == 0
+    assert hedger.stats()["hedged"] == 0
+
+
+def test_slow_request_is_hedged_and_the_hedge_wins():
+    hedger = _hedger()
+    events = []
+    assert hedger.call(_first_call_slow(), events.append) == 1
+    assert events == ["won"]
+    assert hedger.stats()["hedge_won"] == 1
+
+
+def test_time_queued_before_sending_does_not_count():
+    hedger = _hedger()
+
+    def queued_then_fast(started):
+        # Waiting for a rate limiter permit well past the hedge delay
+        time.sleep(0.3)
+        started()
+        time.sleep(0.01)
+        return "primary"
+
+    assert hedger.call(queued_then_fast) == "primary"
+    assert hedger.stats()["hedged"] == 0
+
+
+def test_request_that_fails_before_sending_is_not_hedged():
+    hedger = _hedger()
+
+    def refused(started):
+        raise RuntimeError("deadline passed in the queue")
+
+    with pytest.raises(RuntimeError):
+        hedger.call(refused)
+    assert hedger.stats()["hedged"] == 0
+
+
+def test_budget_limits_hedges():
+    budget = HedgeBudget(ratio=0.5, burst=1.0)
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    budget.deposit()
+    assert not budget.try_spend()
+    budget.deposit()
+    assert budget.try_spend()
+
+    hedger = _hedger(budget_ratio=0.0)
+    hedger.budget.try_spend()
+    events = []
+    assert hedger.call(_first_call_slow(0.2), events.append) == 0
+    assert events == ["denied"]
+
+
+def test_async_hedge_cancels_the_loser():
+    hedger = _hedger()
+    cancelled = []
+    counter = itertools.count()
+
+    async def search(started):
+        started()
+        attempt = next(counter)
+        try:
+            await asyncio.sleep(1.0 if attempt == 0 else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(attempt)
+            raise
+        return attempt
+
+    async def main():
+        result = await hedger.acall(search)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == 1
+    assert cancelled == [0]
+
+
+def test_hedges_do_not_queue_behind_stragglers():
+    hedger = _hedger()
+    hedger.budget = HedgeBudget(ratio=1.0, burst=100)
+
+    def search(started):
+        # Primaries straggle; hedges run on their own pool's threads
+        primary = threading.current_thread().name.startswith(f"hedge-{PRIMARY}")
+        started()
+        time.sleep(2.0 if primary else 0.01)
+        return "primary" if primary else "hedge"
+
+    # As many concurrent calls as the primary pool has threads, so every thread straggles
+    calls = _thread_pool(PRIMARY)._max_workers
+    results, elapsed = [], []
+
+    def caller():
+        began = time.monotonic()
+        results.append(hedger.call(search))
+        elapsed.append(time.monotonic() - began)
+
+    threads = [threading.Thread(target=caller) for _ in range(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["hedge"] * calls
+    assert max(elapsed) < 1.0
+    assert hedger.stats()["hedge_won"] == calls
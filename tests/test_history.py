@@ -0,0 +1,124 @@
+"""
+The research history ranks prior runs and answers or seeds new runs from fresh, similar ones.
+"""
+
+import time
+
+from langchain_core.messages import AIMessage
+
+from agent.backends import register_backend
+from agent.fake_backend import FakeBackend
+from agent.history import ResearchHistory, _sources_in, get_research_history
+from agent.utils import SHORT_URL_PREFIX
+
+QUESTION = "solar panel efficiency"
+
+
+def _search(query, short_id):
+    url = f"{SHORT_URL_PREFIX}{short_id}"
+    return {"query": query, "summary": f"Findings on {query} [src]({url})",
+            "sources": [{"short_url": url, "value": f"https://example.com/{short_id}", "label": "src"}]}
+
+
+def _history(tmp_path):
+    return ResearchHistory(str(tmp_path / "history.sqlite"))
+
+
+def test_search_ranks_the_question_above_the_research(tmp_path):
+    history = _history(tmp_path)
+    in_research = history.add_run("wind turbines", "Answer.", [], [_search("solar panel output", "0-0")])
+    in_question = history.add_run("solar panel efficiency", "Answer.", [], [])
+    history.add_run("tidal power", "Answer.", [], [])
+    hits = history.search("solar panel")
+    assert [hit["id"] for hit in hits] == [in_question, in_research]
+    assert history.get(in_research)["searches"][0]["query"] == "solar panel output"
+
+
+def test_old_runs_are_not_consulted(tmp_path):
+    history = _history(tmp_path)
+    run_id = history.add_run(QUESTION, "Answer.", [], [], 1, 1)
+    with history._conn:
+        history._conn.execute("UPDATE runs SET created = ? WHERE id = ?", (time.time() - 3 * 3600, run_id))
+    assert history.search(QUESTION, max_age_hours=2) == []
+    assert history.consult(QUESTION, 2, 0.9, 0.4) == {"seed": []}
+    assert "answer" in history.consult(QUESTION, 4, 0.9, 0.4)
+
+
+def test_consult_answers_only_from_a_run_as_deep_as_this_one(tmp_path):
+    history = _history(tmp_path)
+    shallow = history.add_run(QUESTION, "Shallow answer.", [], [_search("q1", "0-0")], 1, 1)
+    assert history.consult(QUESTION, 24, 0.9, 0.4, max_research_loops=1)["answer"]["id"] == shallow
+    # A deeper run can only be seeded by it
+    decision = history.consult(QUESTION, 24, 0.9, 0.4, max_research_loops=3)
+    assert [run["id"] for run in decision["seed"]] == [shallow]
+    assert decision["seed"][0]["similarity"] == 1.0
+
+
+def test_consult_seeds_from_the_most_similar_runs(tmp_path):
+    history = _history(tmp_path)
+    history.add_run("solar panel efficiency in winter", "A.", [], [], 1, 1)
+    history.add_run("solar panel efficiency in deserts and winter", "B.", [], [], 1, 1)
+    history.add_run("solar panel efficiency of rooftop systems", "C.", [], [], 1, 1)
+    history.add_run("history of the steam engine", "D.", [], [], 1, 1)
+    decision = history.consult("solar panel efficiency in winter months", 24, 0.9, 0.3)
+    seeds = decision["seed"]
+    assert len(seeds) == 2 and seeds[0]["query"] == "solar panel efficiency in winter"
+    assert seeds[0]["similarity"] >= seeds[1]["similarity"] >= 0.3
+
+
+def test_sources_are_matched_as_whole_urls():
+    sources = [{"short_url": f"{SHORT_URL_PREFIX}1-1"}, {"short_url": f"{SHORT_URL_PREFIX}1-12"}]
+    assert _sources_in(f"see {SHORT_URL_PREFIX}1-12.", sources, "short_url") == [sources[1]]
+    assert _sources_in(f"see {SHORT_URL_PREFIX}1-1 and {SHORT_URL_PREFIX}1-12", sources, "short_url") == sources
+
+
+def test_add_state_skips_answered_and_seeded_results(tmp_path):
+    history = _history(tmp_path)
+    state = {
+        "messages": [AIMessage(content="Answer citing https://example.com/0-1")],
+        "search_query": ["seeded", "new"],
+        "web_research_result": [_search("seeded", "h1-0")["summary"], _search("new", "0-1")["summary"]],
+        "sources_gathered": [*_search("seeded", "h1-0")["sources"], *_search("new", "0-1")["sources"]],
+        "history_matches": [{"mode": "seed", "summaries": 1}],
+        "research_loop_count": 1,
+    }
+    run = history.get(history.add_state(QUESTION, state, 2))
+    assert [search["query"] for search in run["searches"]] == ["new"]
+    assert run["sources"] == [_search("new", "0-1")["sources"][0]]
+    assert (run["research_loops"], run["max_research_loops"]) == (1, 2)
+
+    state["history_matches"] = [{"mode": "answer", "summaries": 0}]
+    assert history.add_state(QUESTION, state) is None
+    assert history.count() == 1
+
+
+def _consulting(fake_config, tmp_path):
+    return {**fake_config, "consult_history": True, "research_history_path": str(tmp_path / "history.sqlite")}
+
+
+def test_graph_answers_a_repeated_question_from_the_history(fake_config, run_research, tmp_path):
+    config = _consulting(fake_config, tmp_path)
+    first, _ = run_research(config)
+    assert first["history_matches"] == []
+    get_research_history(config["research_history_path"]).add_state("solar panel efficiency", first, 1)
+
+    register_backend(fake_config["model_backend"], FakeBackend())
+    second, run = run_research(config)
+    assert [match["mode"] for match in second["history_matches"]] == ["answer"]
+    assert second["messages"][-1].content == first["messages"][-1].content
+    # No model was called
+    assert run["configurable"]["metrics"].tokens_used() == 0
+
+
+def test_graph_seeds_a_deeper_run_with_prior_searches(fake_config, run_research, tmp_path):
+    config = _consulting(fake_config, tmp_path)
+    first, _ = run_research(config)
+    get_research_history(config["research_history_path"]).add_state("solar panel efficiency", first, 1)
+
+    second, _ = run_research({**config, "max_research_loops": 2})
+    (match,) = second["history_matches"]
+    seeded = len(first["web_research_result"])
+    assert match["mode"] == "seed" and match["summaries"] == seeded
+    assert second["search_query"][:seeded] == first["search_query"]
+    assert all(f"{SHORT_URL_PREFIX}h{match['id']}-" in summary for summary in second["web_research_result"][:seeded])
+    assert len(second["web_research_result"]) > seeded
@@ -0,0 +1,70 @@
+"""
+Per-node records, totals with unknown usage and the run report.
+"""
+
+import json
+
+import pytest
+
+from agent.metrics import RunMetrics, call_span, node_span
+
+
+def _run_with_calls(*usages):
+    """Record one node whose calls report ``(prompt, completion, bytes)``, or fail for None."""
+    metrics = RunMetrics()
+    config = {"configurable": {"metrics": metrics}}
+    with node_span("reflection", config):
+        for usage in usages:
+            if usage is None:
+                with pytest.raises(RuntimeError), call_span("reflection", "m"):
+                    raise RuntimeError("no response")
+                continue
+            with call_span("reflection", "m") as call:
+                call.attempts = 1
+                call.prompt_tokens, call.completion_tokens, call.response_bytes = usage
+    return metrics
+
+
+def test_totals_add_up_reported_usage():
+    metrics = _run_with_calls((10, 5, 100), (20, 7, 50))
+    entry = metrics.summary()["reflection"]
+    assert (entry["calls"], entry["prompt_tokens"], entry["completion_tokens"], entry["response_bytes"]) == (2, 30, 12, 150)
+    assert metrics.tokens_used() == 42
+
+
+def test_unknown_usage_makes_the_total_unknown():
+    metrics = _run_with_calls((10, 5, 100), (None, None, 80))
+    entry = metrics.summary()["reflection"]
+    assert entry["prompt_tokens"] is None and entry["completion_tokens"] is None
+    assert entry["response_bytes"] == 180
+    assert metrics.tokens_used() is None
+
+
+def test_failed_calls_add_nothing():
+    metrics = _run_with_calls((10, 5, 100), None)
+    entry = metrics.summary()["reflection"]
+    assert entry["calls"] == 2 and entry["prompt_tokens"] == 10
+    assert metrics.tokens_used() == 15
+    assert metrics.report()["nodes"][0]["calls"][1]["error"] == "RuntimeError: no response"
+
+
+def test_nothing_is_recorded_without_a_collector():
+    with node_span("reflection", {"configurable": {}}) as record:
+        with call_span("reflection", "m") as call:
+            assert record is None and call is None
+
+
+def test_graph_run_report(fake_config, run_research):
+    result, config = run_research({**fake_config, "stream_answer": True})
+    metrics = config["configurable"]["metrics"]
+    report = json.loads(json.dumps(metrics.report(query="q"), default=str))
+    summary = report["summary"]
+    assert set(summary) >= {"generate_query", "web_research", "reflection", "finalize_answer"}
+    assert summary["web_research"]["executions"] == fake_config["number_of_initial_queries"]
+    for node in ("generate_query", "web_research", "finalize_answer"):
+        assert summary[node]["prompt_tokens"] > 0 and summary[node]["completion_tokens"] > 0
+    assert metrics.tokens_used() == sum(
+        entry["prompt_tokens"] + entry["completion_tokens"] for entry in summary.values()
+    )
+    branches = [record["branch"]["id"] for record in report["nodes"] if record["node"] == "web_research"]
+    assert sorted(branches) == list(range(fake_config["number_of_initial_queries"]))
@@ -0,0 +1,149 @@
+"""
+Permits, fair queueing and deadlines of the rate limiter.
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from agent.fake_backend import FakeAPIError
+from agent.configuration import Configuration
+from agent.ratelimit import ModelLimits, RateLimiter, parse_rate_limits, share_limits
+from agent.retry import Deadline, DeadlineExceededError
+
+MODEL = "gemini-2.0-flash"
+
+
+def _wait_for(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.005)
+
+
+def _rate_limited():
+    raise FakeAPIError(429, "RESOURCE_EXHAUSTED: Quota exceeded.")
+
+
+def _queue_behind(limiter, calls):
+    """Start each ``(session, label)`` call on a thread, once the previous one is queued."""
+    order, threads = [], []
+    for session, label in calls:
+        queued = limiter.stats()["queued"]
+
+        def run(session=session, label=label):
+            limiter.acquire(MODEL, 1, session=session, label=label).release()
+            order.append(session or label)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        threads.append(thread)
+        _wait_for(lambda: limiter.stats()["queued"] == queued + 1)
+    return order, threads
+
+
+def test_parse_rate_limits():
+    assert parse_rate_limits("a=60/1000, b=5") == {"a": ModelLimits(60, 1000), "b": ModelLimits(5, 0)}
+    with pytest.raises(ValueError):
+        parse_rate_limits("a=fast")
+
+
+def test_concurrency_limit_queues_calls():
+    limiter = RateLimiter(max_concurrency=1)
+    held = limiter.acquire(MODEL, 1)
+    order, threads = _queue_behind(limiter, [("s1", "")])
+    assert order == []
+    held.release()
+    for thread in threads:
+        thread.join(2)
+    assert order == ["s1"]
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_sessions_are_served_fairly():
+    limiter = RateLimiter(max_concurrency=1)
+    held = limiter.acquire(MODEL, 1, session="idle")
+    # A burst of one session doesn't make a later session wait for all of it
+    order, threads = _queue_behind(limiter, [("a", "")] * 3 + [("b", "")])
+    held.release()
+    for thread in threads:
+        thread.join(2)
+    assert order.index("b") <= 1
+
+
+def test_later_graph_stages_go_first():
+    limiter = RateLimiter(max_concurrency=1)
+    held = limiter.acquire(MODEL, 1)
+    order, threads = _queue_behind(limiter, [("", "generate_query"), ("", "web_research"), ("", "finalize_answer")])
+    held.release()
+    for thread in threads:
+        thread.join(2)
+    assert order == ["finalize_answer", "web_research", "generate_query"]
+
+
+def test_requests_per_minute_bucket():
+    # Six seconds of burst at 60 rpm: six calls pass, the seventh waits for a refill
+    limiter = RateLimiter(max_concurrency=0, default_limits=ModelLimits(requests_per_minute=60))
+    for _ in range(6):
+        limiter.acquire(MODEL, 1).release()
+    start = time.monotonic()
+    limiter.acquire(MODEL, 1).release()
+    assert time.monotonic() - start >= 0.5
+
+
+def test_rate_limit_error_holds_back_the_model():
+    limiter = RateLimiter(max_concurrency=0, default_limits=ModelLimits(requests_per_minute=600))
+    with pytest.raises(FakeAPIError):
+        limiter.call(_rate_limited, MODEL, 1)
+    assert limiter.stats()["rate_limited"] == 1
+    start = time.monotonic()
+    limiter.acquire(MODEL, 1).release()
+    assert time.monotonic() - start >= 0.05
+
+
+def test_queued_call_gives_up_at_the_deadline():
+    limiter = RateLimiter(max_concurrency=1)
+    held = limiter.acquire(MODEL, 1)
+    with pytest.raises(DeadlineExceededError):
+        limiter.call(lambda: "never", MODEL, 1, label="web_research", deadline=Deadline(0.05))
+    assert limiter.stats()["queued"] == 0
+    held.release()
+    assert limiter.call(lambda: "ok", MODEL, 1) == "ok"
+
+
+def test_async_permits_and_deadline():
+    limiter = RateLimiter(max_concurrency=1)
+
+    async def main():
+        held = await limiter.aacquire(MODEL, 1)
+        with pytest.raises(DeadlineExceededError):
+            await limiter.aacquire(MODEL, 1, deadline=Deadline(0.05))
+        waiting = asyncio.ensure_future(limiter.acall(lambda: asyncio.sleep(0, "ok"), MODEL, 1))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        held.release()
+        return await waiting
+
+    assert asyncio.run(main()) == "ok"
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_processes_split_the_quota():
+    configurable = Configuration(
+        max_concurrent_requests=10, requests_per_minute=300, tokens_per_minute=0,
+        rate_limits="gemini-2.5-pro=150/2000000,gemini-2.0-flash=1000",
+    )
+    limits = share_limits(configurable, 4)
+    assert limits["max_concurrent_requests"] == 2
+    assert (limits["requests_per_minute"], limits["tokens_per_minute"]) == (75, 0)
+    assert parse_rate_limits(limits["rate_limits"]) == {
+        "gemini-2.5-pro": ModelLimits(37.5, 500000),
+        "gemini-2.0-flash": ModelLimits(250, 0),
+    }
+    # Every process keeps at least one slot, and no limit stays no limit
+    assert share_limits(configurable, 20)["max_concurrent_requests"] == 1
+    assert share_limits(Configuration(max_concurrent_requests=0), 3)["max_concurrent_requests"] == 0
+    assert share_limits(configurable, 0) == share_limits(configurable, 1)
+
@@ -0,0 +1,57 @@
+"""
+Incremental reflection sends only the results that arrived since the last reflection, plus a digest.
+"""
+
+from agent.backends import register_backend
+from agent.fake_backend import FakeBackend
+
+
+class _PromptLog(FakeBackend):
+    """Fake backend that keeps the prompts of its chat calls."""
+
+    def __init__(self):
+        super().__init__()
+        self.prompts = []
+
+    def call(self, kind, model, prompt, timeout=None):
+        if kind == "chat":
+            self.prompts.append(prompt)
+        return super().call(kind, model, prompt, timeout)
+
+
+def _reflection_prompts(backend):
+    return [prompt for prompt in backend.prompts if "knowledge gap" in prompt.lower() and "summaries" in prompt.lower()]
+
+
+def _run(fake_config, run_research, incremental):
+    backend = _PromptLog()
+    register_backend(fake_config["model_backend"], backend)
+    result, _ = run_research({**fake_config, "max_research_loops": 3, "incremental_reflection": incremental})
+    return result, _reflection_prompts(backend)
+
+
+def test_incremental_reflection_sends_only_new_results(fake_config, run_research):
+    result, prompts = _run(fake_config, run_research, incremental=True)
+    usage = result["reflection_usage"]
+    # The reflection after the last allowed loop is skipped
+    assert [entry["loop"] for entry in usage] == [1, 2]
+    assert all(entry["mode"] == "incremental" for entry in usage)
+    first_loop = usage[0]["summaries"]
+    assert first_loop == fake_config["number_of_initial_queries"]
+    assert 0 < usage[1]["summaries"] < len(result["web_research_result"])
+    assert result["research_digest"]
+    assert len(prompts) == 2
+    # Earlier results reach the second reflection only through the digest
+    assert not any(summary in prompts[1] for summary in result["web_research_result"][:first_loop])
+    assert "No findings yet." in prompts[0]
+    assert result["research_digest"].splitlines()[0] in prompts[1]
+
+
+def test_full_reflection_resends_every_result(fake_config, run_research):
+    result, prompts = _run(fake_config, run_research, incremental=False)
+    usage = result["reflection_usage"]
+    assert [entry["mode"] for entry in usage] == ["full", "full"]
+    assert usage[1]["summaries"] > usage[0]["summaries"]
+    first_loop = usage[0]["summaries"]
+    assert all(summary in prompts[1] for summary in result["web_research_result"][:first_loop])
+    assert not result.get("research_digest")
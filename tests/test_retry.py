@@ -0,0 +1,111 @@
+"""
+Classification of API errors and the retry loop around model calls.
+"""
+
+import asyncio
+
+import pytest
+
+from agent.fake_backend import FakeAPIError
+from agent.retry import (
+    CONNECTION,
+    RATE_LIMITED,
+    TIMEOUT,
+    UNAVAILABLE,
+    Deadline,
+    DeadlineExceededError,
+    RetryBudget,
+    RetryExhaustedError,
+    RetryPolicy,
+    acall_with_retry,
+    call_with_retry,
+    classify_error,
+)
+
+NO_WAIT = RetryPolicy(max_retries=3, base_delay=0.0, max_delay=0.0)
+
+
+class _Failing:
+    """Raises the given errors in turn, then returns "ok"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_classifies_by_status_type_and_cause():
+    assert classify_error(FakeAPIError(429, "RESOURCE_EXHAUSTED")) == RATE_LIMITED
+    assert classify_error(FakeAPIError(503, "UNAVAILABLE")) == UNAVAILABLE
+    assert classify_error(TimeoutError()) == TIMEOUT
+    assert classify_error(ConnectionResetError()) == CONNECTION
+    try:
+        try:
+            raise FakeAPIError(503, "UNAVAILABLE")
+        except FakeAPIError as inner:
+            raise RuntimeError("model call failed") from inner
+    except RuntimeError as outer:
+        assert classify_error(outer) == UNAVAILABLE
+
+
+def test_does_not_classify_by_words_in_the_message():
+    assert classify_error(ValueError("international quota of 500 items")) is None
+    assert classify_error(ValueError("503 Service Unavailable")) == UNAVAILABLE
+
+
+def test_retries_transient_errors_until_success():
+    fn = _Failing(FakeAPIError(503, "UNAVAILABLE"), FakeAPIError(429, "RESOURCE_EXHAUSTED"))
+    budget = RetryBudget()
+    assert call_with_retry(fn, NO_WAIT, budget, "web_research", notify=None) == "ok"
+    assert fn.calls == 3
+    assert budget.snapshot()["retries_by_category"] == {UNAVAILABLE: 1, RATE_LIMITED: 1}
+
+
+def test_does_not_retry_other_errors():
+    fn = _Failing(ValueError("bad request"))
+    with pytest.raises(ValueError):
+        call_with_retry(fn, NO_WAIT, notify=None)
+    assert fn.calls == 1
+
+
+def test_gives_up_after_max_retries():
+    fn = _Failing(*[FakeAPIError(503, "UNAVAILABLE")] * 5)
+    with pytest.raises(RetryExhaustedError) as info:
+        call_with_retry(fn, NO_WAIT, notify=None)
+    assert info.value.category == UNAVAILABLE
+    assert fn.calls == NO_WAIT.max_retries + 1
+
+
+def test_budget_is_shared_by_calls():
+    budget = RetryBudget(max_retries=1)
+    assert call_with_retry(_Failing(TimeoutError()), NO_WAIT, budget, notify=None) == "ok"
+    with pytest.raises(RetryExhaustedError):
+        call_with_retry(_Failing(TimeoutError()), NO_WAIT, budget, notify=None)
+
+
+def test_backoff_stays_under_the_capped_exponential():
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+    for attempt, ceiling in ((1, 1.0), (2, 2.0), (3, 4.0), (6, 5.0)):
+        assert all(0 <= policy.backoff(attempt) <= ceiling for _ in range(100))
+
+
+def test_no_retry_past_the_deadline():
+    fn = _Failing(FakeAPIError(503, "UNAVAILABLE"))
+    with pytest.raises(DeadlineExceededError):
+        call_with_retry(fn, NO_WAIT, notify=None, deadline=Deadline(0))
+    assert fn.calls == 1
+
+
+def test_async_retry():
+    fn = _Failing(FakeAPIError(429, "RESOURCE_EXHAUSTED"))
+
+    async def call():
+        return fn()
+
+    assert asyncio.run(acall_with_retry(call, NO_WAIT, notify=None)) == "ok"
+    assert fn.calls == 2
@@ -0,0 +1,143 @@
+"""
+The HTTP service validates requests, runs research on the fake backend and streams its events.
+"""
+
+import http.client
+import json
+import threading
+import time
+
+import pytest
+
+from agent import server as server_module
+from agent.backends import register_backend
+from agent.fake_backend import FakeBackend, LatencyDistribution
+from agent.server import ResearchService, create_server
+
+
+@pytest.fixture
+def service(fake_config):
+    service = ResearchService(lambda difficulty, model: dict(fake_config), workers=2, max_queue=4)
+    service.start()
+    httpd = create_server(service, "127.0.0.1", 0, quiet=True)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    service.port = httpd.server_address[1]
+    yield service
+    httpd.shutdown()
+    httpd.server_close()
+    service.stop()
+
+
+def _request(service, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", service.port, timeout=30)
+    try:
+        payload = json.dumps(body).encode() if isinstance(body, (dict, list)) else body
+        conn.request(method, path, payload, headers or {})
+        response = conn.getresponse()
+        data = response.read()
+        return response.status, json.loads(data) if data else None, response
+    finally:
+        conn.close()
+
+
+def _raw_submit(service, content_length, body=b""):
+    conn = http.client.HTTPConnection("127.0.0.1", service.port, timeout=30)
+    try:
+        conn.putrequest("POST", "/research")
+        conn.putheader("Content-Length", content_length)
+        conn.endheaders(body)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def _events(service, job_id, last_event_id=None):
+    conn = http.client.HTTPConnection("127.0.0.1", service.port, timeout=30)
+    try:
+        conn.request("GET", f"/research/{job_id}/events",
+                     headers={"Last-Event-ID": str(last_event_id)} if last_event_id is not None else {})
+        response = conn.getresponse()
+        assert response.getheader("Content-Type") == "text/event-stream"
+        events = []
+        for block in response.read().decode().split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+            if fields:
+                events.append({"id": int(fields["id"]), "event": fields["event"], "data": json.loads(fields["data"])})
+        return events
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("content_length", ["abc", "-5", "1.5"])
+def test_malformed_content_length_is_rejected(service, content_length):
+    status, body = _raw_submit(service, content_length)
+    assert status == 400 and "Content-Length" in body["error"]
+
+
+def test_oversized_body_is_rejected(service):
+    status, body = _raw_submit(service, str(server_module.MAX_BODY_BYTES + 1))
+    assert status == 413
+
+
+@pytest.mark.parametrize("body, error", [
+    (b"{not json", "Invalid JSON"),
+    ([1, 2], "JSON object"),
+    ({"query": "  "}, "non-empty"),
+    ({"query": "q", "difficulty": "extreme"}, "difficulty"),
+    ({"query": "q", "config": []}, "'config'"),
+    ({"query": "q", "config": {"model_backend": "gemini"}}, "model_backend"),
+    ({"query": "q", "config": {"max_research_loops": "many"}}, "max_research_loops"),
+])
+def test_invalid_submits_are_rejected(service, body, error):
+    status, payload, _ = _request(service, "POST", "/research", body)
+    assert status == 400 and error in payload["error"]
+    assert service.health()["queued"] == 0
+
+
+@pytest.mark.parametrize("wait", ["soon", "nan"])
+def test_wait_must_be_a_number(service, wait):
+    status, _, _ = _request(service, "GET", f"/research/unknown?wait={wait}")
+    assert status == 400
+
+
+def test_wait_is_clamped(service, fake_config, monkeypatch):
+    register_backend(fake_config["model_backend"], FakeBackend(chat_latency=LatencyDistribution(median=30)))
+    monkeypatch.setattr(server_module, "MAX_WAIT_SECONDS", 0.2)
+    _, job, _ = _request(service, "POST", "/research", {"query": "solar panel efficiency"})
+    started = time.time()
+    status, polled, _ = _request(service, "GET", f"/research/{job['id']}?wait=1e9")
+    assert status == 200 and polled["status"] == "running"
+    assert time.time() - started < 5
+    status, cancelled, _ = _request(service, "DELETE", f"/research/{job['id']}")
+    assert status == 202
+    assert service.wait(job["id"], 10).status == "cancelled"
+
+
+def test_run_streams_its_events(service):
+    status, job, response = _request(
+        service, "POST", "/research", {"query": "solar panel efficiency", "config": {"stream_answer": True}}
+    )
+    assert status == 202 and response.getheader("Location") == f"/research/{job['id']}"
+    events = _events(service, job["id"])
+    assert [event["id"] for event in events] == list(range(len(events)))
+    kinds = [event["event"] for event in events]
+    assert kinds[-1] == "done" and "node" in kinds
+    nodes = [event["data"]["node"] for event in events if event["event"] == "node"]
+    assert nodes[0] == "generate_query" and nodes[-1] == "finalize_answer"
+    done = events[-1]["data"]
+    deltas = "".join(event["data"]["text"] for event in events if event["event"] == "answer_delta")
+    assert deltas and deltas == done["answer"]
+    assert done["sources"] and done["run_metrics"]["nodes"]["web_research"]["executions"] == 2
+
+    # Reconnecting resumes after the last event seen
+    assert _events(service, job["id"], last_event_id=len(events) - 2) == events[-1:]
+    status, polled, _ = _request(service, "GET", f"/research/{job['id']}?wait=5")
+    assert polled["status"] == "done" and polled["result"]["answer"] == done["answer"]
+
+
+def test_unknown_runs_are_not_found(service):
+    assert _request(service, "GET", "/research/missing")[0] == 404
+    assert _request(service, "GET", "/research/missing/events")[0] == 404
+    assert _request(service, "DELETE", "/research/missing")[0] == 404
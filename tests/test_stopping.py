@@ -0,0 +1,109 @@
+"""
+Loop signals, the stopping policies and the stopping decisions of a run.
+"""
+
+import pytest
+
+from agent.configuration import Configuration
+from agent.metrics import RunMetrics, call_span, node_span
+from agent.stopping import get_stopping_policy, research_signals
+from agent.utils import SHORT_URL_PREFIX
+
+SOURCES = [
+    {"short_url": f"{SHORT_URL_PREFIX}{id_}", "value": f"https://example.com/{id_}", "label": "src"}
+    for id_ in ("0-0", "0-1", "1-0", "1-1")
+]
+
+
+def _result(text, *ids):
+    return text + "".join(f" [src]({SHORT_URL_PREFIX}{id_})" for id_ in ids)
+
+
+def _state(earlier, new, loop=2):
+    return {
+        "web_research_result": earlier + new,
+        "reflected_result_count": len(earlier),
+        "sources_gathered": SOURCES,
+        "research_loop_count": loop,
+    }
+
+
+def _signals(**overrides):
+    signals = {
+        "loop": 2, "new_results": 2, "new_sources": 2, "total_sources": 4, "summary_overlap": 0.2,
+        "elapsed_seconds": 10.0, "tokens_used": 1000, "unreported_token_calls": 0,
+        "seconds_per_loop": 5.0, "tokens_per_loop": 500,
+    }
+    return {**signals, **overrides}
+
+
+def test_signals_count_new_sources_and_overlap():
+    earlier = [_result("Rooftop solar panels convert sunlight efficiently", "0-0", "0-1")]
+    new = [_result("Rooftop solar panels convert sunlight efficiently in winter", "0-1", "1-0")]
+    signals = research_signals(_state(earlier, new), elapsed_seconds=9.0, tokens_used=900, unreported_token_calls=1)
+    assert (signals["new_results"], signals["new_sources"], signals["total_sources"]) == (1, 1, 3)
+    assert 0.5 < signals["summary_overlap"] < 1
+    assert (signals["seconds_per_loop"], signals["tokens_per_loop"]) == (4.5, 450)
+    assert signals["unreported_token_calls"] == 1
+
+
+def test_first_loop_has_no_overlap():
+    signals = research_signals(_state([], [_result("Findings", "0-0")], loop=1), None, None)
+    assert signals["summary_overlap"] is None and signals["new_sources"] == 1
+    assert signals["seconds_per_loop"] is None and signals["tokens_per_loop"] is None
+
+
+def test_fixed_policy_never_stops():
+    configurable = Configuration(research_token_budget=1, research_time_budget_seconds=1)
+    assert get_stopping_policy("fixed").should_stop(_signals(new_sources=0, summary_overlap=1.0), configurable) is None
+
+
+@pytest.mark.parametrize("signals, settings, reason", [
+    (_signals(new_sources=0), {}, "found 0 new sources"),
+    (_signals(summary_overlap=0.95), {}, "overlap 95%"),
+    (_signals(), {"research_time_budget_seconds": 12}, "12s time budget"),
+    (_signals(), {"research_token_budget": 1200}, "1200 token budget"),
+    (_signals(), {"research_time_budget_seconds": 20, "research_token_budget": 2000}, None),
+    # Nothing to compare the first loop with
+    (_signals(loop=1, new_sources=0, summary_overlap=None), {}, None),
+])
+def test_marginal_gain_policy(signals, settings, reason):
+    decision = get_stopping_policy("marginal_gain").should_stop(signals, Configuration(**settings))
+    if reason is None:
+        assert decision is None
+    else:
+        assert reason in decision
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError, match="marginal_gain"):
+        get_stopping_policy("no-such-policy")
+
+
+def test_calls_without_usage_are_left_out_of_the_estimate():
+    metrics = RunMetrics()
+    with node_span("web_research", {"configurable": {"metrics": metrics}}):
+        for prompt_tokens, completion_tokens in ((300, 100), (None, None), (50, None)):
+            with call_span("web_research", "m") as call:
+                call.prompt_tokens, call.completion_tokens = prompt_tokens, completion_tokens
+    assert metrics.tokens_used() is None
+    assert metrics.reported_tokens() == (450, 2)
+
+
+def test_token_budget_stops_a_run(fake_config, run_research):
+    result, _ = run_research({
+        **fake_config, "max_research_loops": 5, "stopping_policy": "marginal_gain",
+        "min_new_sources": 0, "max_summary_overlap": 1.0, "research_token_budget": 1,
+    })
+    (decision,) = result["stopping_decisions"]
+    assert decision["stop"] and "token budget" in decision["reason"]
+    assert decision["tokens_used"] > 0 and decision["unreported_token_calls"] == 0
+    assert result["research_loop_count"] == 1 and result["reflection_usage"] == []
+
+
+def test_fixed_policy_runs_every_loop(fake_config, run_research):
+    result, _ = run_research({**fake_config, "max_research_loops": 3, "research_token_budget": 1})
+    decisions = result["stopping_decisions"]
+    assert [decision["policy"] for decision in decisions] == ["fixed"] * len(decisions)
+    assert decisions[-1]["reason"] == "research loop limit reached"
+    assert not any(decision["stop"] for decision in decisions[:-1])
@@ -0,0 +1,91 @@
+"""
+Citation markers and short url expansion must give exactly what the original implementations gave.
+"""
+
+import random
+
+from agent.utils import SHORT_URL_PREFIX, expand_short_urls, insert_citation_markers
+
+
+def _baseline_insert_citation_markers(text, citations_list):
+    # The implementation before the single-pass rewrite
+    sorted_citations = sorted(
+        citations_list, key=lambda c: (c["end_index"], c["start_index"]), reverse=True
+    )
+    modified_text = text
+    for citation_info in sorted_citations:
+        end_idx = citation_info["end_index"]
+        marker_to_insert = ""
+        for segment in citation_info["segments"]:
+            marker_to_insert += f" [{segment['label']}]({segment['short_url']})"
+        modified_text = modified_text[:end_idx] + marker_to_insert + modified_text[end_idx:]
+    return modified_text
+
+
+def _random_citations(rng, text_length, out_of_range):
+    citations = []
+    for _ in range(rng.randint(0, 12)):
+        # Few distinct positions, so shared start and end indices are common
+        end_index = rng.randint(0, text_length)
+        if out_of_range and rng.random() < 0.3:
+            end_index = rng.choice([-3, -1, text_length + 1, text_length + 7])
+        citations.append({
+            "start_index": rng.randint(0, max(0, end_index)),
+            "end_index": end_index,
+            "segments": [
+                {"label": f"s{rng.randrange(5)}", "short_url": f"https://vertexaisearch.cloud.google.com/id/{rng.randrange(50)}"}
+                for _ in range(rng.randint(0, 3))
+            ],
+        })
+    return citations
+
+
+def test_matches_baseline_on_random_citations():
+    rng = random.Random(20240601)
+    for case in range(2000):
+        text = "".join(rng.choice("ab .\n") for _ in range(rng.randint(0, 40)))
+        citations = _random_citations(rng, len(text), out_of_range=case % 4 == 0)
+        expected = _baseline_insert_citation_markers(text, citations)
+        assert insert_citation_markers(text, citations) == expected, (text, citations)
+
+
+def test_markers_at_the_same_index_keep_their_order():
+    citations = [
+        {"start_index": 0, "end_index": 5, "segments": [{"label": "a", "short_url": "u1"}]},
+        {"start_index": 2, "end_index": 5, "segments": [{"label": "b", "short_url": "u2"}]},
+    ]
+    assert insert_citation_markers("Hello world", citations) == "Hello [a](u1) [b](u2) world"
+
+
+def _baseline_expand_short_urls(text, sources_gathered):
+    # The replacement loop finalize_answer used before the single scan
+    unique_sources = []
+    for source in sources_gathered:
+        if source["short_url"] in text:
+            text = text.replace(source["short_url"], source["value"])
+            unique_sources.append(source)
+    return text, unique_sources
+
+
+def test_expansion_matches_baseline_on_random_answers():
+    rng = random.Random(20240602)
+    for _ in range(500):
+        # Ids of one width, so no short url is a prefix of another
+        sources = [
+            {"short_url": f"{SHORT_URL_PREFIX}{rng.randrange(10)}-{rng.randrange(10)}",
+             "value": f"https://example.com/{rng.randrange(1000)}", "label": "example"}
+            for _ in range(rng.randint(0, 8))
+        ]
+        pieces = ["Text ", "(", ")", "\n"] + [source["short_url"] for source in sources]
+        text = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 20)))
+        assert expand_short_urls(text, sources) == _baseline_expand_short_urls(text, sources), (text, sources)
+
+
+def test_longer_short_url_is_not_split_by_its_prefix():
+    sources = [
+        {"short_url": f"{SHORT_URL_PREFIX}1-1", "value": "https://a.example"},
+        {"short_url": f"{SHORT_URL_PREFIX}1-12", "value": "https://b.example"},
+    ]
+    text, used = expand_short_urls(f"See ({SHORT_URL_PREFIX}1-12).", sources)
+    assert text == "See (https://b.example)."
+    assert used == [sources[1]]